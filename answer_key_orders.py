@@ -0,0 +1,80 @@
+# answer_key_orders.py
+# 作用：input_data v1 紧凑编码 (见 database_manager.AnswerCodec) 的题目顺序登记表。
+# 每条已存储的记录带一个题目顺序指纹 "k"，解码时按指纹取这里登记的顺序，与模型的特征列文件无关：
+# 重新训练 / 导出模型、调整问卷题目都不会让已存储的记录无法解码。
+# 规则：已登记的顺序只增不改。题目有增删时新增一组顺序并登记，再把 CURRENT 指向它；
+# 新增题目在切换之前会以原值保存在 "x" 中，不会丢失。
+
+# ----- cce6f537：首个 v1 布局 (取自当时 feat_cols_longterm.json 的列顺序) -----
+KEYS_48H_CCE6F537 = (
+    "食欲增加_48h",
+    "怕光_48h",
+    "怕噪声_48h",
+    "怕特殊气味_48h",
+    "嗜睡_48h",
+    "早醒_48h",
+    "疲乏感_48h",
+    "注意力集中困难_48h",
+    "腹胀_48h",
+    "多尿_48h",
+    "竖毛_48h",
+    "面色苍白_48h",
+    "口渴_48h",
+    "打呵欠_48h",
+    "颈部僵硬或难受_48h",
+    "眼部不适_48h",
+    "头晕/眩晕_48h",
+    "恶心_48h",
+    "体力透支_48h",
+    "脑力透支_48h",
+    "压力（生活/工作压力）_48h",
+    "心情波动和情绪改变_48h",
+    "应激事件_48h",
+    "如果您是“月经性偏头痛”，请填写  月经期和月经期附近 是否头痛_48h",
+    "如果您不是“月经性偏头痛”，请填写  月经期和月经期附近 是否头痛(无月经者不填)_48h",
+    "排卵期和排卵期附近 是否头痛(无月经者不填)_48h",
+    "饱餐_48h",
+    "睡眠不足_48h",
+    "服用诱发头痛的饮食或药物_48h",
+    "视觉异常（闪光、暗点、亮线、等先兆_48h",
+)
+
+KEYS_LONGTERM_CCE6F537 = (
+    "食欲增加_长期",
+    "怕光_长期",
+    "怕噪声_长期",
+    "怕特殊气味_长期",
+    "嗜睡_长期",
+    "早醒_长期",
+    "疲乏感_长期",
+    "注意力集中困难_长期",
+    "腹胀_长期",
+    "多尿_长期",
+    "竖毛_长期",
+    "面色苍白_长期",
+    "口渴_长期",
+    "打呵欠_长期",
+    "颈部僵硬或难受_长期",
+    "头晕/眩晕_长期",
+    "恶心_长期",
+    "体力透支_长期",
+    "脑力透支_长期",
+    "压力（生活/工作压力）_长期",
+    "心情波动和情绪改变_长期",
+    "应激事件_长期",
+    "如果您是“月经性偏头痛”，请填写  月经期和月经期附近 是否头痛_长期",
+    "如果您不是“月经性偏头痛”，请填写  月经期和月经期附近 是否头痛(无月经者不填)_长期",
+    "排卵期和排卵期附近 是否头痛(无月经者不填)_长期",
+    "饱餐_长期",
+    "睡眠不足_长期",
+    "服用诱发头痛的饮食或药物_长期",
+    "视觉异常、闪光、暗点等先兆_长期",
+)
+
+# 指纹 -> (48h 题目顺序, 长期画像题目顺序)
+KEY_ORDERS = {
+    "cce6f537": (KEYS_48H_CCE6F537, KEYS_LONGTERM_CCE6F537),
+}
+
+# 新记录使用的布局
+CURRENT = "cce6f537"
@@ -0,0 +1,290 @@
+# api_server.py
+# 作用：供合作方系统直接调用的 HTTP 打分接口 (asyncio 实现，可与 Streamlit 网页并行部署)
+# 运行方式：python api_server.py [--host 0.0.0.0] [--port 8600] [--workers 2] [--stub]
+#
+# 接口 (JSON；answers 的 key 为 content_library 中的题目 key，值为 0~1 的数值，未作答可省略或为 null)：
+#   POST /predict        {"answers": {...}, "has_history": false}
+#   POST /predict/batch  {"items": [{"answers": {...}, "has_history": false}, ...]}
+#   POST /anti-fraud     {"answers": {...}, "gender": "女"}  (不依赖模型，加载完成前也可用)
+#   GET  /healthz        进程存活即返回 200
+#   GET  /readyz         模型加载完成后返回 200，加载中 / 加载失败返回 503
+#   GET  /metrics        在途请求数、模型副本池的繁忙度、级联推理的升级率 / 不一致率
+#
+# 推理是 CPU 密集的，一律交给有界线程池执行，事件循环本身只做收发与解析；
+# 在途请求超过 --max-pending 时直接返回 503，而不是无限排队。
+# --stub 使用 migraine_core.stub 的替身模型，不需要 torch / TabPFN 模型文件即可本地联调。
+
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import questionnaire_schema as qs
+import migraine_core as core
+
+MAX_BODY_BYTES = 8 << 20
+MAX_HEADER_LINES = 100
+MAX_BATCH_ITEMS = 1000
+KNOWN_KEYS = frozenset(qs.SCHEMA_48H.keys) | frozenset(qs.SCHEMA_LONGTERM.keys)
+
+HTTP_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# ================= 请求解析 =================
+def parse_answers(obj):
+    if not isinstance(obj, dict):
+        raise HTTPError(400, "answers 必须是 JSON 对象")
+    answers = {}
+    for key, value in obj.items():
+        if key not in KNOWN_KEYS:
+            raise HTTPError(400, f"未知的题目 key: {key}")
+        if value is None:
+            continue
+        if not isinstance(value, (int, float)) or not 0 <= value <= 1:
+            raise HTTPError(400, f"{key} 的作答必须是 0~1 的数值")
+        answers[key] = float(value)
+    return answers
+
+
+def parse_item(obj):
+    if not isinstance(obj, dict):
+        raise HTTPError(400, "请求体必须是 JSON 对象")
+    return parse_answers(obj.get("answers")), bool(obj.get("has_history", False))
+
+
+def format_result(raw_score, lca_probs, lca_class):
+    ppc = core.stretch_prob(raw_score)
+    level_text, msg_text = core.concordance_level(ppc)
+    return {
+        "raw_score": float(raw_score),
+        "ppc": ppc,
+        "level": level_text,
+        "message": msg_text,
+        "lca_class": int(lca_class),
+        "lca_probs": [float(p) for p in lca_probs],
+    }
+
+
+# ================= 服务 =================
+class ScoringService:
+    def __init__(self, workers=2, max_pending=32, stub=False, model_dir=core.MODEL_DIR):
+        # 每个推理线程对应一个模型副本，线程之间不会共用同一个模型对象
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-infer")
+        self.max_pending = max_pending
+        self.pending = 0
+        self.stub = stub
+        self.model_dir = model_dir
+        self.predictor = None
+        self.load_error = None
+        self.fraud_engine = core.FraudEngine()
+        self.routes = {
+            "/predict": ("POST", self.handle_predict),
+            "/predict/batch": ("POST", self.handle_predict_batch),
+            "/anti-fraud": ("POST", self.handle_anti_fraud),
+            "/healthz": ("GET", self.handle_healthz),
+            "/readyz": ("GET", self.handle_readyz),
+            "/metrics": ("GET", self.handle_metrics),
+        }
+
+    # ---------- 模型加载 ----------
+    def _build_predictor(self):
+        if self.stub:
+            from migraine_core.stub import stub_assets
+
+            return core.MigrainePredictor(stub_assets(self.model_dir), model_dir=self.model_dir,
+                                          pool_size=self.workers)
+        return core.MigrainePredictor.from_model_dir(self.model_dir, pool_size=self.workers)
+
+    async def load(self):
+        t0 = time.perf_counter()
+        try:
+            self.predictor = await asyncio.get_running_loop().run_in_executor(self.executor, self._build_predictor)
+            print(f"[API] 模型加载完成 ({'stub' if self.stub else self.model_dir})，耗时 {time.perf_counter() - t0:.1f}s")
+        except Exception as e:
+            self.load_error = str(e)
+            print(f"[API] ❌ 模型加载失败: {e}")
+
+    def _require_predictor(self):
+        if self.predictor is None:
+            raise HTTPError(503, self.load_error or "模型加载中，请稍后重试")
+        return self.predictor
+
+    async def run_blocking(self, fn, *args):
+        """把推理交给线程池；在途请求超过上限时立即拒绝"""
+        if self.pending >= self.max_pending:
+            raise HTTPError(503, "服务繁忙，请稍后重试")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    # ---------- 接口 ----------
+    def _predict_one(self, answers, has_history):
+        res = self.predictor.predict(answers, has_history)
+        if "error" in res:
+            raise RuntimeError(res["error"])
+        return format_result(res["raw_score"], res["lca_probs"], res["lca_class"])
+
+    def _predict_many(self, items):
+        import pandas as pd
+
+        df = pd.DataFrame([answers for answers, _ in items], columns=sorted(KNOWN_KEYS), dtype=np.float64)
+        res = self.predictor.predict_batch(df, np.array([h for _, h in items], dtype=bool))
+        return [format_result(*r) for r in zip(res["raw_score"], res["lca_probs"], res["lca_class"])]
+
+    async def handle_predict(self, body):
+        answers, has_history = parse_item(body)
+        self._require_predictor()
+        return await self.run_blocking(self._predict_one, answers, has_history)
+
+    async def handle_predict_batch(self, body):
+        items = body.get("items") if isinstance(body, dict) else None
+        if not isinstance(items, list) or not items:
+            raise HTTPError(400, "items 必须是非空数组")
+        if len(items) > MAX_BATCH_ITEMS:
+            raise HTTPError(413, f"单次最多 {MAX_BATCH_ITEMS} 条")
+        parsed = [parse_item(item) for item in items]
+        self._require_predictor()
+        return {"results": await self.run_blocking(self._predict_many, parsed)}
+
+    async def handle_anti_fraud(self, body):
+        # 与网页端同一套规则；单条检测在微秒级，直接在事件循环里完成。
+        # 检测过的提交会记入近期索引，用于之后的近似重复判断
+        answers, _ = parse_item(body)
+        res = self.fraud_engine.check_matrix(self.fraud_engine.to_matrix([answers]),
+                                             [body.get("gender", "女")], remember=True)
+        return {"is_fraud": bool(res.is_fraud[0]), "reason": res.reasons[0],
+                "flags": [rule for rule, hit in res.flags.items() if hit[0]]}
+
+    async def handle_healthz(self, body):
+        return {"status": "ok"}
+
+    async def handle_readyz(self, body):
+        self._require_predictor()
+        return {"status": "ready", "lca_version": self.predictor.lca_version, "stub": self.stub,
+                "pending": self.pending, "max_pending": self.max_pending}
+
+    async def handle_metrics(self, body):
+        return {"pending": self.pending, "max_pending": self.max_pending,
+                "model_pool": self.predictor.model_pool.stats() if self.predictor else None,
+                "cascade": self.predictor.cascade.stats() if self.predictor and self.predictor.cascade else None}
+
+    # ---------- HTTP ----------
+    async def dispatch(self, method, path, raw_body):
+        route = self.routes.get(path)
+        if route is None:
+            return 404, {"error": f"未找到接口: {path}"}
+        if method != route[0]:
+            return 405, {"error": f"{path} 只支持 {route[0]}"}
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+        except ValueError:
+            return 400, {"error": "请求体不是合法的 JSON"}
+        try:
+            return 200, await route[1](body)
+        except HTTPError as e:
+            return e.status, {"error": e.message}
+        except core.PoolTimeout as e:
+            return 503, {"error": str(e)}
+        except Exception as e:
+            print(f"[API] ❌ {method} {path} 处理失败: {e!r}")
+            return 500, {"error": "内部错误"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                t0 = time.perf_counter()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "请求行格式错误"}, keep_alive=False)
+                    break
+
+                headers = {}
+                for _ in range(MAX_HEADER_LINES):
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                raw_length = headers.get("content-length") or "0"
+                if not (raw_length.isascii() and raw_length.isdigit()):
+                    # 非数字 / 负数 / 上标数字等 (isdigit 不接受 "-"，但接受 latin-1 的 "²")
+                    await self._respond(writer, 400, {"error": "Content-Length 格式错误"}, keep_alive=False)
+                    break
+                length = int(raw_length)
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "请求体过大"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                path = target.split("?", 1)[0]
+                status, payload = await self.dispatch(method.upper(), path, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                print(f"[API] {method} {path} {status} {(time.perf_counter() - t0) * 1000:.1f}ms")
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+
+async def serve(host, port, workers, max_pending, stub, model_dir):
+    service = ScoringService(workers, max_pending, stub, model_dir)
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    # 先开始监听 (healthz 可用)，模型在后台加载，加载完成前 readyz 返回 503
+    load_task = asyncio.create_task(service.load())
+    print(f"[API] 正在监听 http://{host}:{port} (推理线程 {workers}，在途上限 {max_pending})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        load_task.cancel()
+        service.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migraine AI 打分 HTTP 接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--workers", type=int, default=2, help="推理线程数")
+    parser.add_argument("--max-pending", type=int, default=32, help="在途推理请求上限，超过后返回 503")
+    parser.add_argument("--stub", action="store_true", help="使用替身模型 (不需要 torch / TabPFN 模型文件)")
+    parser.add_argument("--model-dir", default=core.MODEL_DIR, help="模型目录")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_pending, args.stub, args.model_dir))
+    except KeyboardInterrupt:
+        print("[API] 已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,19 @@
 import streamlit as st
-import pandas as pd
 import numpy as np
-import plotly.graph_objects as go
-from logic_processor import predictor
+import logic_processor
+import migraine_core as core
+from migraine_core import stretch_prob, concordance_level, PoolTimeout, ServerBusy
 import content_library as lib
+import questionnaire_schema as qs
 import database_manager as db
 import re  # 引入正则库用于校验手机号
+import uuid
 
 # ================= 页面配置 =================
 st.set_page_config(page_title="Migraine AI · 智能预警系统", page_icon="🩺", layout="centered")
 
 # ================= 🎨 视觉升级：CSS 终极修正 =================
-st.markdown("""
+APP_CSS = """
     <style>
     /* 全局背景：淡雅医疗蓝渐变 */
     .stApp {
@@ -130,21 +132,26 @@ st.markdown("""
         background: rgba(0,0,0,0) !important;
     }
     </style>
-    """, unsafe_allow_html=True)
+    """
+# 整页 rerun 时 Streamlit 会清掉未重新输出的元素，所以样式仍需每次整页输出；
+# 问卷提交/校验只重跑下面的 st.fragment 片段，不会再走到这里
+st.markdown(APP_CSS, unsafe_allow_html=True)
+
+
+@st.cache_resource
+def _init_db_once():
+    # 每个服务进程只初始化一次，而不是每次 rerun 都调用
+    db.init_db()
+    return True
+
 
 # 初始化
-db.init_db()
+_init_db_once()
 if 'step' not in st.session_state: st.session_state.step = 0
 if 'user_info' not in st.session_state: st.session_state.user_info = {}
 if 'input_data' not in st.session_state: st.session_state.input_data = {}
 
 
-def stretch_prob(p):
-    q_low, q_high = 0.23, 0.76
-    p_norm = (p - q_low) / (q_high - q_low)
-    return float(np.clip(0.05 + p_norm * 0.90, 0.05, 0.95))
-
-
 # ================= 辅助：手机号校验 =================
 def validate_phone(phone_str):
     # 1. 去除空格和横杠
@@ -184,6 +191,12 @@ def show_cover():
     </div>
     """, unsafe_allow_html=True)
 
+    _cover_form()
+
+
+@st.fragment
+def _cover_form():
+    # 表单提交与校验只重跑这个片段；校验通过后 st.rerun() 再整页切换
     with st.form("info"):
         col1, col2 = st.columns(2)
         name = col1.text_input("姓名 / 昵称")
@@ -215,6 +228,10 @@ def show_cover():
                     "phone": formatted_phone,  # 保存带+86的格式
                     "history": (history == "确诊偏头痛 / 有长期病史")
                 }
+                # 老用户：按规范化手机号 + 姓名查近期的长期画像 (进程内 TTL 缓存)，用于跳过长期画像一步。
+                # 手机号是自填的、未经验证，因此至少要求姓名也一致；查到的作答只在服务端使用，不在页面上显示
+                if st.session_state.user_info['history']:
+                    st.session_state.longterm_profile = db.get_latest_profile(formatted_phone, name)
                 st.session_state.step = 1 if st.session_state.user_info['history'] else 2
                 st.rerun()
 
@@ -260,35 +277,48 @@ def show_longterm():
     st.markdown(" 📋 Phase 1: 长期基线画像")
     st.caption("请回顾您过去 3 个月的整体健康模式。")
 
+    # 近期填写过长期画像的老用户可以选择直接沿用 (不显示上次的日期与作答，避免他人凭手机号和姓名查看)
+    profile = st.session_state.get('longterm_profile')
+    if profile:
+        st.info("检测到与您的姓名和手机号匹配的近期长期画像。可以直接沿用，或在下方重新填写。")
+        if st.button("沿用上次的长期画像，直接进入下一步"):
+            visible = set(qs.SCHEMA_LONGTERM.visible_keys(st.session_state.user_info['gender']))
+            st.session_state.input_data.update({k: v for k, v in profile['answers'].items() if k in visible})
+            # 记录沿用的是哪一次的画像，保存时带上原填写时间，有效期不会因沿用而顺延
+            st.session_state.user_info['profile_answered_at'] = profile['answered_at']
+            st.session_state.step = 2
+            st.rerun()
+
+    _longterm_form()
+
+
+@st.fragment
+def _longterm_form():
+    # 表单提交与校验只重跑这个片段；校验通过后 st.rerun() 再整页切换
     temp_data = {}
     filled_count = 0
 
     with st.form("long"):
-        for key, val in lib.MAPPING_LONGTERM.items():
-            if st.session_state.user_info['gender'] == "男":
-                if "hormone" in key or "月经" in key or "排卵" in key:
-                    continue
-
-            if key.startswith("section"):
-                st.markdown(f"### {val}")
-            else:
-                st.markdown(f'<p style="font-size: 1.2rem; font-weight: 600; margin-bottom: 8px;">{val}</p>',
-                            unsafe_allow_html=True)
-                # ans = st.radio(val, lib.FREQ_MAP_UI, index=None, key=key)
-                ans = st.radio("", lib.FREQ_MAP_UI, index=None, key=key, label_visibility="collapsed")
+        # 按性别过滤好的题目列表在 import 时已编译，这里只负责渲染
+        for section in qs.SCHEMA_LONGTERM.visible_sections(st.session_state.user_info['gender']):
+            st.markdown(f"### {section.title}")
+            for q in section.questions:
+                st.markdown(q.label_html, unsafe_allow_html=True)
+                ans = st.radio(q.text, lib.FREQ_MAP_UI, index=None, key=q.key, label_visibility="collapsed")
 
                 if ans:
                     # 这样通过 ans (比如 "经常") 就能在 lib.FREQ_MAP_VAL 里找到对应的数值 (0.5)
-                    temp_data[key] = lib.FREQ_MAP_VAL[ans]
+                    temp_data[q.key] = lib.FREQ_MAP_VAL[ans]
                     filled_count += 1
                 else:
-                    temp_data[key] = np.nan
+                    temp_data[q.key] = np.nan
 
         if st.form_submit_button("保存并下一步"):
             if filled_count < 15:
                 st.error(f"为了保证模型精度，请至少完成 15 项评估（当前 {filled_count} 项）。")
             else:
                 st.session_state.input_data.update(temp_data)
+                st.session_state.user_info.pop('profile_answered_at', None)  # 重新填写：按本次提交时间记
                 st.session_state.step = 2
                 st.rerun()
 
@@ -380,27 +410,84 @@ def show_48h():
     st.markdown(" ⚡ Phase 2: 当前 (48h) 症状捕捉")
     st.caption("请仔细感知您最近两天的细微身体变化。")
 
+    _48h_form()
+
+
+def _wait_for_admission(predictor):
+    """领取推理名额；需要排队时每 0.5 秒刷新一次排队位置与预计等待时间。队列已满抛 ServerBusy"""
+    ticket = predictor.admission.enqueue()
+    if not ticket.admitted:
+        status = st.empty()
+        try:
+            while not ticket.wait(timeout=0.5):
+                status.info(f"⏳ 当前评估人数较多，您前面还有 {max(ticket.position() - 1, 0)} 人，"
+                            f"预计等待约 {ticket.estimated_wait():.0f} 秒，请勿刷新页面...")
+        except BaseException:
+            # 用户离开页面 (Streamlit 中断脚本) 时让出队列位置
+            ticket.release()
+            raise
+        status.empty()
+    return ticket
+
+
+def _run_submission(temp_data, answers, user_info):
+    """一次提交的全部工作 (反作弊 -> 推理 -> 保存)，由提交登记表保证同一份作答只执行一次。
+    拦截时返回 {"fraud": 原因}，否则返回结果页用到的 prediction_results"""
+    # 3. 反作弊检测 (模型通常已在用户填写问卷时于后台加载完成)
+    predictor = logic_processor.get_predictor()
+    is_fraud, msg = predictor.fraud_engine.check(temp_data, user_info['gender'], remember=True)
+    if msg and not is_fraud:
+        print(f"[Fraud] 提交已放行但被标记: {msg}")
+    if is_fraud:
+        return {"fraud": msg}
+
+    # 4. 执行核心计算逻辑 (由结果页前移至此)
+    # 调用模型推理：级联模式下先由廉价模型筛查，只有需要跑 TabPFN 时才排队领取推理名额
+    # (排队时显示位置与预计等待)；队列已满或模型副本等待超时时抛出 ServerBusy / PoolTimeout，由调用方提示用户稍后重试。
+    # 章节归因 (逐节去掉作答后的分数变化) 与本次打分在同一次批量推理中完成，结果随 res 缓存
+    res = predictor.predict_with_attribution(answers, user_info['history'], user_info['gender'],
+                                             admit=lambda: _wait_for_admission(predictor))
+
+    # 计算 PPC (前驱期表型符合度)
+    prob = stretch_prob(res['raw_score'])
+
+    # 确定风险等级描述 (阈值与批量打分共用 migraine_core.scoring)
+    level_text, msg_text = concordance_level(prob)
+
+    # 5. 计算结果，供下一步渲染 (人群百分位与相似患者都在保存本条记录之前查询，避免把自己算进去)
+    results = {
+        "res": res,
+        "prob": prob,
+        "level_text": level_text,
+        "msg": msg_text,
+        "percentile": db.get_percentile(prob, user_info['history'], user_info['gender']),
+        "similar": db.find_similar(answers)
+    }
+
+    # 6. 同步保存数据到云端数据库 (Supabase)
+    res_save = {'risk_prob_display': prob, 'risk_level': level_text}
+    db.save_record(user_info, answers, res_save)
+    return results
+
+
+@st.fragment
+def _48h_form():
+    # 表单提交与校验只重跑这个片段；校验通过后 st.rerun() 再整页切换
     temp_data = {}
     filled_count = 0
 
     with st.form("48h"):
-        for key, val in lib.MAPPING_48H.items():
-            # 1. 严格保留原有的男性过滤逻辑
-            if st.session_state.user_info['gender'] == "男":
-                if "section_6" in key or "月经" in str(key) or "排卵" in str(key):
-                    continue
-
-            if key.startswith("section"):
-                st.markdown(f"### {val}")
-            else:
-                st.markdown(f'<p style="font-size: 1.2rem; font-weight: 600; margin-bottom: 8px;">{val}</p>',
-                            unsafe_allow_html=True)
-                ans = st.radio("", ["否", "是"], index=None, key=key, label_visibility="collapsed")
+        # 1. 男性过滤 (女性生理周期一节) 已在 questionnaire_schema 中预先完成
+        for section in qs.SCHEMA_48H.visible_sections(st.session_state.user_info['gender']):
+            st.markdown(f"### {section.title}")
+            for q in section.questions:
+                st.markdown(q.label_html, unsafe_allow_html=True)
+                ans = st.radio(q.text, ["否", "是"], index=None, key=q.key, label_visibility="collapsed")
                 if ans is not None:
-                    temp_data[key] = 1 if ans == "是" else 0
+                    temp_data[q.key] = 1 if ans == "是" else 0
                     filled_count += 1
                 else:
-                    temp_data[key] = np.nan
+                    temp_data[q.key] = np.nan
 
         # --- 核心改进部分：表单提交与即时计算 ---
         submit_btn = st.form_submit_button("生成分析报告")
@@ -411,45 +498,26 @@ def show_48h():
             else:
                 # 2. 开启 Spinner 动画：此时动画会紧跟在提交按钮下方
                 with st.spinner("🧠 AI 正在提取临床表型特征并匹配 ICHD-3 模式，请保持页面停留..."):
-                    # 3. 反作弊检测
-                    df_chk = pd.DataFrame([temp_data]).fillna(0)
-                    is_fraud, msg = predictor.anti_fraud_check(df_chk)
-
-                    if is_fraud:
-                        st.error(f"⚠️ 数据异常拦截：{msg}")
+                    # 幂等键 = 会话 + 完整作答 + 病史 + 性别：双击、重试、rerun 带来的重复提交
+                    # 合并到同一次反作弊检测、推理与保存上 (见 migraine_core.submission)
+                    user_info = st.session_state.user_info
+                    answers = dict(st.session_state.input_data, **temp_data)
+                    if 'session_key' not in st.session_state:
+                        st.session_state.session_key = uuid.uuid4().hex
+                    key = core.idempotency_key(st.session_state.session_key, answers,
+                                               user_info['history'], user_info['gender'])
+                    try:
+                        outcome = logic_processor.SUBMISSIONS.run(
+                            key, lambda: _run_submission(temp_data, answers, user_info))
+                    except (ServerBusy, PoolTimeout):
+                        st.error("当前评估人数较多，请稍后再次点击“生成分析报告”。")
+                        return
+
+                    if "fraud" in outcome:
+                        st.error(f"⚠️ 数据异常拦截：{outcome['fraud']}")
                     else:
-                        # 4. 执行核心计算逻辑 (由结果页前移至此)
-                        st.session_state.input_data.update(temp_data)
-                        has_hist = st.session_state.user_info['history']
-
-                        # 调用模型推理
-                        res = predictor.predict(st.session_state.input_data, has_hist)
-
-                        # 计算 PPC (前驱期表型符合度)
-                        prob = stretch_prob(res['raw_score'])
-
-                        # 确定风险等级描述
-                        if prob > 0.6:
-                            level_text = "Highly Concordant (高度相关)"
-                            msg_text = "您的当前生理指征与偏头痛前驱期模式呈现高度一致性。"
-                        elif prob > 0.35:
-                            level_text = "Moderately Concordant (中度相关)"
-                            msg_text = "检测到部分符合前驱期特征的生理信号。"
-                        else:
-                            level_text = "Low Concordance (低相关)"
-                            msg_text = "目前的指征未显示明显的前驱期模式特征。"
-
-                        # 5. 存储计算结果到 session_state，供下一步渲染
-                        st.session_state.prediction_results = {
-                            "res": res,
-                            "prob": prob,
-                            "level_text": level_text,
-                            "msg": msg_text
-                        }
-
-                        # 6. 同步保存数据到云端数据库 (Supabase)
-                        res_save = {'risk_prob_display': prob, 'risk_level': level_text}
-                        db.save_record(st.session_state.user_info, st.session_state.input_data, res_save)
+                        st.session_state.input_data = answers
+                        st.session_state.prediction_results = outcome
 
                         # 7. 计算全部完成，切换页面步骤并跳转
                         st.session_state.step = 3
@@ -672,6 +740,22 @@ def show_result():
     </div>
     """, unsafe_allow_html=True)
 
+    # --- 人群百分位：与同性别、同病史情况的既往评估比较 (提交时、保存本条记录之前已查询并缓存) ---
+    user_info = st.session_state.user_info
+    percentile = cache.get('percentile')
+    if percentile is not None:
+        group_text = f"{user_info['gender']}性、{'有' if user_info['history'] else '无'}长期病史"
+        st.caption(f"📈 在{group_text}人群的既往评估中 (同一用户的多次评估分别计入)，"
+                   f"您本次的 PPC 高于约 {percentile:.0f}% 的评估结果。")
+
+    # --- 相似患者：48h 症状组合最接近的既往评估者的等级分布 (提交时已检索并缓存) ---
+    similar = cache.get('similar')
+    if similar:
+        parts = "、".join(f"{level.split(' (')[0]} {share:.0%}"
+                         for level, share in sorted(similar['distribution'].items(), key=lambda kv: -kv[1]))
+        st.caption(f"👥 与您 48h 症状最相似的 {len(similar['risk_levels'])} 位既往评估者"
+                   f"(平均相差 {similar['distances'].mean():.1f} 项)中：{parts}。")
+
     # --- PPC 严谨解释 ---
     with st.expander("🔬 什么是前驱期表型符合度？", expanded=False):
         st.markdown(f"""
@@ -689,24 +773,20 @@ def show_result():
 
     st.markdown("<h3 style='text-align: center;'>📊 风险特征多维分布图</h3>", unsafe_allow_html=True)
 
-    # --- 3. 升级六维雷达图：通俗且严谨的标签 ---
-    cats = ['先兆表型', '感觉敏化度', '核心前驱项', '诱发相关', '临床群体匹配', '自主神经征']
-
-    vals = [
-        res['raw_score'] * 4.5,  # 先兆期表型
-        res['raw_score'] * 3.8,  # 感觉敏化度
-        res['raw_score'] * 4.0,  # 核心前驱项
-        3.0 + np.random.rand(),  # 诱发相关性
-        res['lca_probs'].max() * 5,  # 临床群体匹配
-        (res['raw_score'] * 3.5 + 1.0)  # 自主神经征
-    ]
+    # --- 3. 章节归因雷达图：每一轴是去掉该章节作答后模型分数的下降幅度 (提交时已算好并缓存) ---
+    import plotly.graph_objects as go  # 只有结果页用到，按需导入
+    attribution = res.get('attribution', {})
+    cats = list(attribution)
+    # 只画推高分数的部分 (拉低分数的章节记为 0)，单位为原始分数的百分点
+    vals = [max(v, 0.0) * 100 for v in attribution.values()]
 
     fig = go.Figure(go.Scatterpolar(r=vals, theta=cats, fill='toself',
                                     line=dict(color=theme_color, width=2),
-                                    fillcolor=f"rgba(0, 96, 100, 0.2)"))
+                                    fillcolor=f"rgba(0, 96, 100, 0.2)",
+                                    hovertemplate="%{theta}: +%{r:.1f}<extra></extra>"))
     fig.update_layout(
         polar=dict(
-            radialaxis=dict(visible=True, range=[0, 5], showticklabels=False),
+            radialaxis=dict(visible=True, range=[0, max(vals + [1.0]) * 1.15], showticklabels=False),
             angularaxis=dict(tickfont=dict(size=12, color='#455a64'))
         ),
         paper_bgcolor='rgba(255,255,255,1)',
@@ -715,28 +795,38 @@ def show_result():
         autosize=True
     )
     st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+    st.caption("各轴表示该部分作答对本次评分的贡献：将该部分视为未作答后，模型分数下降的幅度。")
+
+    # --- 历次评估趋势：同一手机号且姓名一致的既往 PPC (一次按手机号 + 时间的索引查询，结果缓存在本次会话)。
+    # 手机号是自填的、未经验证，只凭手机号会把别人的历次结果画出来，因此要求姓名也一致 ---
+    if 'history' not in cache:
+        cache['history'] = db.get_history(user_info['phone'], user_info['name'])
+    history = cache['history']
+    if len(history) >= 2:
+        points = sorted(history, key=lambda r: r['created_at'])
+        trend = go.Figure(go.Scatter(x=[r['created_at'] for r in points],
+                                     y=[r['risk_score'] * 100 for r in points],
+                                     mode='lines+markers', line=dict(color=theme_color, width=2),
+                                     hovertemplate="%{x|%Y-%m-%d %H:%M}<br>PPC %{y:.1f}<extra></extra>"))
+        trend.update_layout(
+            yaxis=dict(range=[0, 100], title="PPC"),
+            paper_bgcolor='rgba(255,255,255,1)',
+            margin=dict(t=20, b=30, l=40, r=20),
+            height=240,
+        )
+        st.markdown("<h3 style='text-align: center;'>📅 历次评估趋势</h3>", unsafe_allow_html=True)
+        st.plotly_chart(trend, use_container_width=True, config={'displayModeBar': False})
 
     st.markdown("---")
     st.subheader("🩺 临床决策支持与建议")
 
-    # 构建建议逻辑 (保持原样)
+    # 构建建议逻辑 (章节归属与证据库查找表由 questionnaire_schema 预先编译)
     active_symptoms = [k for k, v in st.session_state.input_data.items() if v >= 0.5]
-    section_map = {}
-    for k, v in lib.MAPPING_48H.items():
-        if k.startswith("section"):
-            current_section = v
-        else:
-            section_map[k] = current_section
-    for k, v in lib.MAPPING_LONGTERM.items():
-        if k.startswith("section"):
-            current_section = v
-        else:
-            section_map[k] = current_section
 
     grouped_advice = {}
     for sym in active_symptoms:
-        if sym in lib.EVIDENCE_LIBRARY:
-            cat = section_map.get(sym, "综合指征")
+        if sym in qs.EVIDENCE:
+            cat = qs.SECTION_OF.get(sym, "综合指征")
             if cat not in grouped_advice: grouped_advice[cat] = []
             grouped_advice[cat].append(sym)
 
@@ -746,7 +836,7 @@ def show_result():
         for cat, symptoms in grouped_advice.items():
             with st.expander(f"📌 {cat} ({len(symptoms)}项信号)", expanded=True):
                 for sym in symptoms:
-                    evidence = lib.EVIDENCE_LIBRARY[sym]
+                    evidence = qs.EVIDENCE[sym]
                     display_name = sym.split('_')[0]
                     st.markdown(f"**🔹 {display_name}**")
                     st.markdown(
@@ -760,11 +850,28 @@ def show_result():
     with st.expander("🔐 数据管理 (Admin Only)"):
         pwd = st.text_input("Access Key", type="password", key="admin_pwd")
         if pwd == "admin123":
+            import pandas as pd
+            # 筛选条件与导出列在数据库端执行，导出一周 / 某一人群时只传输需要的行和列
+            date_range = st.date_input("提交日期范围 (留空为全部)", value=(), key="admin_dates")
+            c1, c2, c3 = st.columns(3)
+            levels = c1.multiselect("风险等级", [lv[1] for lv in core.CONCORDANCE_LEVELS], key="admin_levels")
+            gender = c2.selectbox("性别", ["全部", "女", "男"], key="admin_gender")
+            history_filter = c3.selectbox("偏头痛病史", ["全部", "有", "无"], key="admin_history")
+            columns = st.multiselect("导出列 (input_data 展开为各题作答)", list(db.EXPORT_COLUMNS),
+                                     default=list(db.EXPORT_COLUMNS), key="admin_columns")
+            latest_only = st.checkbox("每个手机号只导出最新一次评估", value=True, key="admin_latest")
             try:
-                df = db.get_all_data()
-                st.write(f"当前云端总记录数: {len(df)}")
+                df = db.get_all_data(
+                    columns=columns,
+                    start=date_range[0] if len(date_range) > 0 else None,
+                    end=date_range[1] if len(date_range) > 1 else None,
+                    risk_levels=levels,
+                    gender=None if gender == "全部" else gender,
+                    history=None if history_filter == "全部" else history_filter == "有",
+                    latest_only=latest_only)
+                st.write(f"符合条件的记录数: {len(df)}")
                 st.download_button(
-                    label="📥 导出全量加密数据 (CSV)",
+                    label="📥 导出加密数据 (CSV)",
                     data=df.to_csv(index=False).encode('utf-8-sig'),
                     file_name=f"migraine_data_{pd.Timestamp.now().strftime('%Y%m%d')}.csv",
                     mime="text/csv"
@@ -780,6 +887,9 @@ def show_result():
 
 
 if __name__ == "__main__":
+    # 后台开始加载模型与分数索引 (幂等)：用户在封面和问卷页停留期间完成加载
+    logic_processor.preload()
+    db.preload_indexes()
     if st.session_state.step == 0:
         show_cover()
     elif st.session_state.step == 1:
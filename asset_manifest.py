@@ -0,0 +1,102 @@
+# asset_manifest.py
+# 作用：models/manifest.json 的读写与校验
+# 导出端 (export_assets_local.py) 记录每个资产的哈希、大小、特征数与依赖版本，用于跳过未变化的资产；
+# 预测端启动时只做 stat + 小 JSON 读取级别的检查，在加载阶段就发现资产之间不一致，而不是等到 predict 时报 KeyError。
+
+import os
+import sys
+import json
+import hashlib
+from datetime import datetime
+
+MANIFEST_NAME = "manifest.json"
+
+# 模型文件 -> 对应的特征列文件
+MODEL_FEATURE_FILES = {
+    "tabpfn_48h_only.pkl": "feat_cols_48h.json",
+    "tabpfn_longterm.pkl": "feat_cols_longterm.json",
+}
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def describe_file(path, **extra):
+    info = {"sha256": file_sha256(path), "size": os.path.getsize(path)}
+    info.update(extra)
+    return info
+
+
+def library_versions():
+    versions = {"python": sys.version.split()[0]}
+    for name in ("numpy", "pandas", "sklearn", "torch", "tabpfn", "joblib"):
+        module = sys.modules.get(name)
+        if module is None:
+            try:
+                module = __import__(name)
+            except ImportError:
+                continue
+        versions[name] = getattr(module, "__version__", "unknown")
+    return versions
+
+
+def load_manifest(model_dir):
+    path = os.path.join(model_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def update_manifest(model_dir, artifacts):
+    """合并写入若干资产记录 (原子替换)"""
+    manifest = load_manifest(model_dir) or {"artifacts": {}}
+    manifest["artifacts"].update(artifacts)
+    manifest["versions"] = library_versions()
+    manifest["updated_at"] = datetime.now().isoformat(timespec="seconds")
+
+    path = os.path.join(model_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+    return manifest
+
+
+def is_unchanged(manifest, dst_name, src_sha256, dst_path):
+    """源文件哈希与上次导出一致、且目标文件还在且大小未变 -> 可以跳过"""
+    entry = (manifest or {}).get("artifacts", {}).get(dst_name)
+    return (entry is not None and entry.get("source_sha256") == src_sha256
+            and os.path.exists(dst_path) and os.path.getsize(dst_path) == entry.get("size"))
+
+
+def verify_files(model_dir, manifest):
+    """廉价校验：只比较文件是否存在与大小，不重新计算哈希"""
+    problems = []
+    for name, entry in manifest.get("artifacts", {}).items():
+        path = os.path.join(model_dir, name)
+        if not os.path.exists(path):
+            problems.append(f"{name}: 文件缺失")
+        elif os.path.getsize(path) != entry.get("size"):
+            problems.append(f"{name}: 大小 {os.path.getsize(path)} 与清单记录 {entry.get('size')} 不一致")
+    return problems
+
+
+def check_consistency(lca_assets, models, feat_cols):
+    """资产间的结构一致性：特征列数 vs 模型输入宽度，LCA 类别数 vs LCA_class_prob_* 特征
+    models / feat_cols: {模型文件名: 模型对象} / {模型文件名: 特征列列表}"""
+    problems = []
+    n_classes = lca_assets.get("n_classes", len(lca_assets["pi"]))
+    for name, model in models.items():
+        cols = feat_cols.get(name) or []
+        n_in = getattr(model, "n_features_in_", None)
+        if n_in is not None and n_in != len(cols):
+            problems.append(f"{name}: 模型输入宽度 {n_in} 与 {MODEL_FEATURE_FILES[name]} 的 {len(cols)} 列不一致")
+        n_lca = sum(1 for c in cols if c.startswith("LCA_class_prob_"))
+        if n_lca and n_lca != n_classes:
+            problems.append(f"{name}: 特征列需要 {n_lca} 个 LCA 类别，LCA 参数只有 {n_classes} 个")
+    return problems
@@ -0,0 +1,149 @@
+# benchmark.py
+# 作用：性能基准工具
+# 运行方式：
+#   python benchmark.py importtime                # 各入口模块的冷启动导入耗时 (基于 python -X importtime)
+#   python benchmark.py importtime --module app --top 20
+#   python benchmark.py fraud                     # 反作弊引擎单条延迟与批量吞吐
+#   python benchmark.py memory --replicas 4       # 底座权重共享前后的内存占用 (需要真实模型文件)
+
+import os
+import sys
+import argparse
+import subprocess
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 冷启动时不应被提前导入的重型依赖
+HEAVY_MODULES = ("torch", "tabpfn", "sklearn", "plotly", "pandas", "supabase")
+
+
+def _parse_importtime(stderr):
+    """解析 -X importtime 输出：返回 [(模块名, self_us, cumulative_us, 层级)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_part, cum_us, name = line.split("|", 2)
+        self_us = self_part.split(":", 1)[1]
+        name = name.rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cum_us), depth))
+    return rows
+
+
+def importtime_report(module, top=15):
+    code = f"import time; t0 = time.perf_counter(); import {module}; print(time.perf_counter() - t0)"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=ROOT, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    if proc.returncode != 0:
+        print(f"❌ import {module} 失败:\n{proc.stderr[-2000:]}")
+        return None
+
+    rows = _parse_importtime(proc.stderr)
+    wall = float(proc.stdout.strip().splitlines()[-1])
+    loaded = {r[0].split(".")[0] for r in rows}
+
+    print(f"\n===== import {module}: {wall * 1000:.0f} ms (wall), 共导入 {len(rows)} 个模块 =====")
+    print(f"{'cumulative(ms)':>15} {'self(ms)':>10}  module")
+    for name, self_us, cum_us, depth in sorted(rows, key=lambda r: -r[2])[:top]:
+        print(f"{cum_us / 1000:>15.1f} {self_us / 1000:>10.1f}  {'  ' * depth}{name}")
+    print("重型依赖:", ", ".join(f"{m}={'已导入' if m in loaded else '未导入'}" for m in HEAVY_MODULES))
+    return {"module": module, "wall_s": wall, "n_modules": len(rows), "heavy": sorted(loaded & set(HEAVY_MODULES))}
+
+
+def fraud_report(batch_sizes=(1, 100, 1000), index_fill=5000, repeat=50, seed=0):
+    import numpy as np
+    from migraine_core import FraudEngine
+
+    rng = np.random.default_rng(seed)
+    engine = FraudEngine(index_capacity=index_fill)
+    engine.remember((rng.random((index_fill, len(engine.keys))) < 0.4).astype(np.float64))
+    print(f"\n===== FraudEngine ({len(engine.keys)} 题，近期索引 {index_fill} 条) =====")
+
+    answers = {k: float(rng.random() < 0.4) for k in engine.keys}
+    engine.check(answers)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        engine.check(answers)
+    single_us = (time.perf_counter() - t0) / repeat * 1e6
+    print(f"单条 check(): {single_us:.0f} µs")
+
+    results = {"single_us": single_us}
+    for n in batch_sizes:
+        V = (rng.random((n, len(engine.keys))) < 0.4).astype(np.float64)
+        engine.check_matrix(V)
+        t0 = time.perf_counter()
+        for _ in range(max(1, repeat // 10)):
+            engine.check_matrix(V)
+        per_row = (time.perf_counter() - t0) / max(1, repeat // 10) / n * 1e6
+        print(f"批量 check_matrix(N={n}): {per_row:.1f} µs/行")
+        results[f"batch_{n}_us_per_row"] = per_row
+    return results
+
+
+def memory_report(replicas=4, model_dir=None):
+    import copy
+    import migraine_core as core
+    from migraine_core import weights
+
+    import torch  # noqa: F401  先导入，下面的进程内存增量只反映模型本身
+
+    model_dir = model_dir or core.MODEL_DIR
+    mb = lambda n: f"{n / 2**20:.1f}MB" if n is not None else "n/a"
+    print(f"\n===== 模型内存 ({model_dir}) =====")
+
+    rss0 = weights.rss_bytes()
+    assets = core.load_assets(model_dir, warmup=False, share_weights=False)
+    m48, mlt = assets.model_48h, assets.model_longterm
+    rss1 = weights.rss_bytes()
+    before = weights.weight_bytes(m48, mlt)
+    print(f"加载两个模型 (不共享)：权重 {mb(before)}，进程内存 +{mb(rss1 - rss0) if rss0 else 'n/a'}")
+
+    report = weights.share_backbone_weights(m48, mlt)
+    rss2 = weights.rss_bytes()
+    print(f"共享底座权重后：权重 {mb(report['bytes_after'])} ({report['tensors_shared']} 个张量共享)，"
+          f"进程内存 +{mb(rss2 - rss0) if rss0 else 'n/a'}")
+
+    results = {"weights_before": before, "weights_after": report["bytes_after"]}
+    for name, clone in (("deepcopy", copy.deepcopy), ("共享权重", weights.clone_sharing_weights)):
+        weights.release_free_memory()
+        rss_a = weights.rss_bytes()
+        pool = core.ModelPool.from_models(m48, mlt, size=replicas, clone=clone)
+        objs = [m for r in pool._free.queue for m in (r.model_48h, r.model_longterm)]
+        rss_b = weights.rss_bytes()
+        total = weights.weight_bytes(*objs)
+        print(f"{replicas} 个副本 ({name})：权重 {mb(total)}，进程内存 +{mb(rss_b - rss_a) if rss_a else 'n/a'}")
+        results[f"pool_{clone.__name__}"] = total
+        del pool, objs
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migraine AI 性能基准")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_imp = sub.add_parser("importtime", help="冷启动导入耗时报告")
+    p_imp.add_argument("--module", action="append",
+                       help="要测量的模块 (可重复)，默认 app / logic_processor / database_manager")
+    p_imp.add_argument("--top", type=int, default=15, help="显示累计耗时最高的前 N 个模块")
+
+    p_fraud = sub.add_parser("fraud", help="反作弊引擎延迟")
+    p_fraud.add_argument("--index-fill", type=int, default=5000, help="预先填入近期索引的条数")
+
+    p_mem = sub.add_parser("memory", help="底座权重共享前后的内存占用")
+    p_mem.add_argument("--replicas", type=int, default=4, help="模型副本池大小")
+    p_mem.add_argument("--model-dir", default=None, help="模型目录，默认 models/")
+
+    args = parser.parse_args()
+    if args.cmd == "memory":
+        memory_report(args.replicas, args.model_dir)
+    elif args.cmd == "fraud":
+        fraud_report(index_fill=args.index_fill)
+    elif args.cmd == "importtime":
+        for module in args.module or ["app", "logic_processor", "database_manager"]:
+            importtime_report(module, top=args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -62,11 +62,22 @@
 #     return df
 
 
-import pandas as pd
+import os
 import json
-from datetime import datetime
-from supabase import create_client, Client
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
 import streamlit as st
+import questionnaire_schema as qs
+import answer_key_orders
+from migraine_core.cache import TTLCache
+from migraine_core.resilience import CircuitBreaker, JsonlSpool
+from migraine_core.score_index import ScoreIndex
+from migraine_core.similar import SymptomBitsetIndex
+# supabase 客户端与 pandas 只在提交 / 管理导出时才用到，改为首次使用时再导入，加快冷启动
 
 
 # 从 Streamlit 的云端保密区读取密码，不直接写在代码里
@@ -74,6 +85,7 @@ import streamlit as st
 # 但为了让你本地双击也能跑，这里加个容错
 def get_db_client():
     try:
+        from supabase import create_client
         url = st.secrets["SUPABASE_URL"]
         key = st.secrets["SUPABASE_KEY"]
         return create_client(url, key)
@@ -83,51 +95,528 @@ def get_db_client():
 
 def init_db():
     # 云数据库不需要本地初始化文件，直接跳过
+    # (表结构见 migrations/，在 Supabase SQL Editor 中执行)
     pass
 
 
+# 每次评估追加一行 (migrations/001_assessments.sql)；每个手机号最新一次评估通过视图读取
+ASSESSMENTS_TABLE = "assessments"
+LATEST_VIEW = "latest_assessments"
+HISTORY_PAGE_SIZE = 50
+
+
+# ================= 云数据库调用保护 =================
+# 每类操作的超时 (秒)，可用环境变量覆盖；超时后调用方立即返回，不再跟着 HTTP 客户端一起等
+DB_TIMEOUTS = {
+    "save": float(os.environ.get("MIGRAINE_DB_TIMEOUT_SAVE", "3")),      # 提交时保存一条记录
+    "query": float(os.environ.get("MIGRAINE_DB_TIMEOUT_QUERY", "3")),    # 页面上的单次查询 (历史 / 长期画像)
+    "export": float(os.environ.get("MIGRAINE_DB_TIMEOUT_EXPORT", "30")),  # 管理员导出
+    "stream": float(os.environ.get("MIGRAINE_DB_TIMEOUT_STREAM", "30")),  # iter_records 的每一批
+    "replay": float(os.environ.get("MIGRAINE_DB_TIMEOUT_REPLAY", "15")),  # 本地队列补写的每一批
+}
+# 连续失败 (含超时) 达到阈值后熔断；熔断期间的写入直接进本地队列，读取直接失败
+DB_BREAKER = CircuitBreaker(failure_threshold=int(os.environ.get("MIGRAINE_DB_BREAKER_FAILURES", "3")),
+                            reset_timeout=float(os.environ.get("MIGRAINE_DB_BREAKER_RESET", "30")),
+                            name="Supabase")
+# 写入失败时的本地持久化队列；恢复后按批补写 (client_id 唯一约束保证补写不会产生重复行)
+SPOOL = JsonlSpool(os.environ.get("MIGRAINE_DB_SPOOL", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "spool", "assessments.jsonl")))
+SPOOL_BATCH_SIZE = 100
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="db")
+_replay_lock = threading.Lock()
+
+
+def _db_call(op, fn):
+    """经熔断器与超时执行一次数据库操作；熔断中抛 CircuitOpen，超时抛 OperationTimeout。
+    成功说明云端可用，顺带在后台补写本地队列"""
+    result = DB_BREAKER.call(fn, _DB_EXECUTOR, DB_TIMEOUTS[op])
+    _maybe_replay()
+    return result
+
+
+def _insert_assessments(supabase, rows):
+    return (supabase.table(ASSESSMENTS_TABLE)
+            .upsert(rows, on_conflict="client_id", ignore_duplicates=True).execute())
+
+
+def replay_spool():
+    """把本地队列中的记录按批补写到云端 (同一时刻只有一个补写任务)，返回补写条数。
+    补写的记录保留原始 created_at (临床时间)，但 id 在写入时才分配，lca_online 按 id 续读时照样会吸收它们"""
+    if not _replay_lock.acquire(blocking=False):
+        return 0
+    try:
+        supabase = get_db_client()
+        if not supabase or not os.path.exists(SPOOL.path):
+            return 0
+        n = SPOOL.drain(lambda batch: DB_BREAKER.call(lambda: _insert_assessments(supabase, batch),
+                                                      _DB_EXECUTOR, DB_TIMEOUTS["replay"]),
+                        batch_size=SPOOL_BATCH_SIZE)
+        if n:
+            print(f"✅ 本地队列已补写 {n} 条记录至云端")
+        return n
+    except Exception as e:
+        print(f"⚠️ 本地队列补写中断，稍后重试: {e}")
+        return 0
+    finally:
+        _replay_lock.release()
+
+
+def _maybe_replay():
+    if os.path.exists(SPOOL.path) and not _replay_lock.locked():
+        threading.Thread(target=replay_spool, name="db-spool-replay", daemon=True).start()
+
+# 老用户的长期画像：多久以内的算“近期” (可直接沿用)，以及进程内缓存的有效期
+PROFILE_MAX_AGE_DAYS = 90
+PROFILE_CACHE = TTLCache(ttl=600, max_entries=10000)
+
+
+# ================= input_data 紧凑编码 =================
+# 旧格式：{题目原文: 数值}，每行都重复几十个很长的中文 key。
+# v1 格式：{"v": 1, "k": 题目顺序指纹, "a": 48h 是/否位, "m": 48h 缺失位, "l": 长期题 3 bit 频率码, "x": 其它}
+#   - 题目顺序按指纹登记在 answer_key_orders.py (只增不改，与模型特征列文件无关)，48h 题与长期题各一段；
+#   - 48h：每题 1 bit (是=1)，另有一段同长度的缺失掩码；
+#   - 长期：每题 3 bit，频率 0/0.25/0.5/0.75/1 编码为 0..4，7 表示未作答；
+#   - 位串按小端位序打包成字节后存十六进制；不在上述题目表里或取值不规整的作答原样放进 "x"。
+# 没有 "v" 字段的行按旧格式读取。每行按自己的指纹解码；指纹未登记的行单独报错 / 留空，而不是错位。
+ENCODING_VERSION = 1
+LONGTERM_MISSING_CODE = 7
+
+
+def _pack_hex(bits):
+    """N×B 的 0/1 矩阵 -> 每行一个十六进制串 (小端位序)"""
+    packed = np.packbits(np.asarray(bits, dtype=bool), axis=1, bitorder="little")
+    return [row.tobytes().hex() for row in packed]
+
+
+def _unpack_hex(hex_list, n_bits):
+    """_pack_hex 的逆运算：一次把 N 个十六进制串拼起来解码 -> N×n_bits 的 uint8 矩阵"""
+    n_bytes = (n_bits + 7) // 8
+    raw = np.frombuffer(bytes.fromhex("".join(hex_list)), dtype=np.uint8).reshape(len(hex_list), n_bytes)
+    return np.unpackbits(raw, axis=1, count=n_bits, bitorder="little")
+
+
+class AnswerCodec:
+    """一种题目顺序下的 v1 编解码；题目顺序按指纹登记在 answer_key_orders.py 中，不随模型特征列变化"""
+
+    def __init__(self, keys_48h, keys_longterm):
+        self.keys_48h = tuple(keys_48h)
+        self.keys_longterm = tuple(keys_longterm)
+        self.keys = self.keys_48h + self.keys_longterm
+        self.col = {k: i for i, k in enumerate(self.keys)}
+        self.fingerprint = hashlib.sha1("\n".join(self.keys).encode("utf-8")).hexdigest()[:8]
+        n48, nlt = len(self.keys_48h), len(self.keys_longterm)
+        self._hex_len = {"a": 2 * ((n48 + 7) // 8), "m": 2 * ((n48 + 7) // 8), "l": 2 * ((3 * nlt + 7) // 8)}
+
+    def accepts(self, obj):
+        """obj 是否为本布局写出的、各段长度完整的 v1 对象"""
+        return obj.get("k") == self.fingerprint and all(
+            isinstance(obj.get(f), str) and len(obj[f]) == n for f, n in self._hex_len.items())
+
+    # ---------- 编码 ----------
+    def encode(self, data_dict):
+        """作答字典 -> v1 紧凑对象"""
+        v48 = np.array([data_dict.get(k, np.nan) for k in self.keys_48h], dtype=np.float64)
+        vlt = np.array([data_dict.get(k, np.nan) for k in self.keys_longterm], dtype=np.float64)
+        missing = np.isnan(v48)
+        codes = np.where(np.isnan(vlt), LONGTERM_MISSING_CODE, np.rint(np.nan_to_num(vlt) * 4)).astype(np.uint8)
+
+        # 不规整的取值 (不是 0/1、不在频率档位上) 与未知题目原样保留
+        odd_48h = ~missing & (v48 != 0) & (v48 != 1)
+        odd_lt = ~np.isnan(vlt) & ((codes > 4) | (codes / 4 != vlt))
+        extra = {k: data_dict[k] for k, odd in zip(self.keys_48h, odd_48h) if odd}
+        extra.update({k: data_dict[k] for k, odd in zip(self.keys_longterm, odd_lt) if odd})
+        known = set(self.keys)
+        extra.update({k: v for k, v in data_dict.items() if k not in known and not _is_nan(v)})
+        codes[odd_lt] = LONGTERM_MISSING_CODE
+
+        bits_lt = (codes[:, None] >> np.arange(3, dtype=np.uint8)) & 1
+        obj = {
+            "v": ENCODING_VERSION,
+            "k": self.fingerprint,
+            "a": _pack_hex((v48 == 1)[None, :])[0],
+            "m": _pack_hex((missing | odd_48h)[None, :])[0],
+            "l": _pack_hex(bits_lt.reshape(1, -1))[0],
+        }
+        if extra:
+            obj["x"] = extra
+        return obj
+
+    # ---------- 解码 ----------
+    def decode_many(self, objs):
+        """v1 紧凑对象列表 -> N×题目数 的数值矩阵 (列顺序 = self.keys，未作答为 NaN)，全程向量化。
+        objs 须全部通过 accepts 检查 (按指纹分组见 decode_answers_frame)"""
+        bad = [o.get("k") for o in objs if not self.accepts(o)]
+        if bad:
+            raise ValueError(f"input_data 不是题目顺序 {self.fingerprint} 的完整 v1 编码 (指纹 {sorted(set(map(str, bad)))})")
+        n48, nlt = len(self.keys_48h), len(self.keys_longterm)
+        answers = _unpack_hex([o["a"] for o in objs], n48).astype(np.float64)
+        answers[_unpack_hex([o["m"] for o in objs], n48).astype(bool)] = np.nan
+
+        bits_lt = _unpack_hex([o["l"] for o in objs], 3 * nlt).reshape(len(objs), nlt, 3)
+        codes = bits_lt @ np.array([1, 2, 4], dtype=np.uint8)
+        longterm = np.where(codes == LONGTERM_MISSING_CODE, np.nan, codes / 4)
+
+        V = np.concatenate([answers, longterm], axis=1)
+        for i, o in enumerate(objs):
+            for k, value in o.get("x", {}).items():
+                if k in self.col:
+                    V[i, self.col[k]] = value
+        return V
+
+    def decode(self, obj):
+        V = self.decode_many([obj])[0]
+        out = {k: v for k, v in zip(self.keys, V.tolist()) if not np.isnan(v)}
+        out.update({k: v for k, v in obj.get("x", {}).items() if k not in out})
+        return out
+
+
+def _is_nan(value):
+    return isinstance(value, float) and np.isnan(value)
+
+
+# 指纹 -> 编解码器 (每种登记过的题目顺序一个)；新记录按 answer_key_orders.CURRENT 编码
+ANSWER_CODECS = {}
+for _fingerprint, _orders in answer_key_orders.KEY_ORDERS.items():
+    ANSWER_CODECS[_fingerprint] = AnswerCodec(*_orders)
+    if ANSWER_CODECS[_fingerprint].fingerprint != _fingerprint:
+        raise RuntimeError(f"answer_key_orders.py 中登记的题目顺序与指纹 {_fingerprint} 不符 (已登记的顺序不能修改)")
+ANSWER_CODEC = ANSWER_CODECS[answer_key_orders.CURRENT]
+
+
+def _codec_for(obj):
+    """v1 对象对应的编解码器；指纹未登记或内容不完整时返回 None"""
+    codec = ANSWER_CODECS.get(obj.get("k"))
+    return codec if codec is not None and codec.accepts(obj) else None
+
+
+def encode_answers(data_dict):
+    return ANSWER_CODEC.encode(data_dict)
+
+
+def _as_object(input_data):
+    if isinstance(input_data, str):
+        return json.loads(input_data)
+    return input_data or {}
+
+
+def decode_answers(input_data):
+    """数据库中的 input_data (v1 紧凑格式或旧 JSON 格式) -> 作答字典"""
+    obj = _as_object(input_data)
+    if obj.get("v") == ENCODING_VERSION:
+        codec = _codec_for(obj)
+        if codec is None:
+            raise ValueError(f"无法解码的 input_data (题目顺序指纹 {obj.get('k')} 未登记或内容不完整)")
+        return codec.decode(obj)
+    return {k: v for k, v in obj.items() if not _is_nan(v)}
+
+
+def decode_answers_frame(values):
+    """批量解码 input_data 列 -> DataFrame (行顺序不变，列为题目)。
+    v1 行按题目顺序指纹分组、每组向量化解码，旧格式行用 json_normalize；
+    无法解码的行 (指纹未登记、内容损坏) 保留为全空行并打印警告，不影响同批其它行"""
+    import pandas as pd
+
+    objs = [_as_object(v) for v in values]
+    compact = np.array([o.get("v") == ENCODING_VERSION for o in objs], dtype=bool)
+    parts = []
+    groups, bad = {}, []
+    for i in np.flatnonzero(compact):
+        codec = _codec_for(objs[i])
+        if codec is None:
+            bad.append(i)
+        else:
+            groups.setdefault(codec.fingerprint, []).append(i)
+    if bad:
+        print(f"⚠️ {len(bad)} 条记录的 input_data 无法解码 (指纹 {sorted({str(objs[i].get('k')) for i in bad})})，已留空")
+        parts.append(pd.DataFrame(index=bad))
+    for fingerprint, index in groups.items():
+        codec = ANSWER_CODECS[fingerprint]
+        rows = [objs[i] for i in index]
+        frame = pd.DataFrame(codec.decode_many(rows), columns=list(codec.keys), index=index)
+        # 不在该布局题目表里的作答 (很少见) 单独成列
+        extra = [{k: v for k, v in o.get("x", {}).items() if k not in codec.col} for o in rows]
+        if any(extra):
+            frame = frame.join(pd.DataFrame(extra, index=index))
+        parts.append(frame)
+    if (~compact).any():
+        legacy = pd.json_normalize([o for o, c in zip(objs, compact) if not c])
+        legacy.index = np.flatnonzero(~compact)
+        parts.append(legacy)
+    if not parts:
+        return pd.DataFrame(index=range(len(objs)))
+    return pd.concat(parts).sort_index()
+
+
 def save_record(info, data_dict, result):
     supabase = get_db_client()
     if not supabase:
         print("❌ 数据库连接失败：未配置 Secrets")
         return
 
+    created_at = datetime.now().isoformat()
     data_payload = {
         "phone": info['phone'],
         "patient_name": info['name'],
         "age": info['age'],
         "gender": info['gender'],
         "history": info['history'],
-        "input_data": data_dict,  # Supabase 会自动处理 JSON
+        "input_data": encode_answers(data_dict),  # v1 紧凑编码，见 AnswerCodec
         "risk_score": float(result['risk_prob_display']),
         "risk_level": result['risk_level'],
-        "created_at": datetime.now().isoformat()
+        "created_at": created_at,
+        # 长期画像的填写时间：沿用上次画像时是原画像的时间，本次重新填写时就是提交时间 (见 migrations/003)
+        "profile_answered_at": (info.get('profile_answered_at') or created_at) if info['history'] else None,
+        "client_id": uuid.uuid4().hex  # 幂等写入：超时后补写同一条记录不会重复
     }
 
-    # 使用 upsert 实现 "有则更新，无则插入"
+    # 只追加，不覆盖同一手机号的旧记录 (“最新一次”由 latest_assessments 视图提供)。
+    # 超时 / 熔断 / 其它错误时写入本地队列，云端恢复后批量补写；提交流程最多等待 DB_TIMEOUTS["save"] 秒
     try:
-        supabase.table("patient_records").upsert(data_payload).execute()
+        _db_call("save", lambda: _insert_assessments(supabase, [data_payload]))
         print("✅ 数据已同步至云端")
     except Exception as e:
-        print(f"❌ 云端存储失败: {e}")
+        SPOOL.append(data_payload)
+        print(f"⚠️ 云端存储失败，已暂存至本地队列: {e}")
+
+    # 长期画像可能已更新，下次查询时重新读取
+    if info['history']:
+        PROFILE_CACHE.invalidate((info['phone'], info['name']))
+
+    # 写入成功后增量更新分数索引与相似患者索引
+    SCORE_INDEX.add(data_payload["risk_score"], info['history'], info['gender'])
+    SIMILAR_INDEX.add(data_dict, result['risk_level'])
+
+
+# 管理员导出可选的列；input_data 导出时展开为各题作答 (紧凑编码无法在数据库端按题投影)
+EXPORT_COLUMNS = ("phone", "patient_name", "age", "gender", "history",
+                  "risk_score", "risk_level", "created_at", "input_data")
+
+
+def filter_query(query, start=None, end=None, risk_levels=None, gender=None, history=None):
+    """把导出筛选条件翻译成数据库端的过滤 (PostgREST)：
+    start / end 为 created_at 范围 (date 按整天计、含当天；datetime / ISO 字符串按时刻)，
+    risk_levels 为风险等级列表，gender / history 为 None 时不筛选"""
+    if start is not None:
+        query = query.gte("created_at", start.isoformat() if hasattr(start, "isoformat") else start)
+    if end is not None:
+        if hasattr(end, "isoformat") and not isinstance(end, datetime):
+            query = query.lt("created_at", (end + timedelta(days=1)).isoformat())
+        else:
+            query = query.lte("created_at", end.isoformat() if hasattr(end, "isoformat") else end)
+    if risk_levels:
+        risk_levels = list(risk_levels)
+        query = query.eq("risk_level", risk_levels[0]) if len(risk_levels) == 1 \
+            else query.in_("risk_level", risk_levels)
+    if gender is not None:
+        query = query.eq("gender", gender)
+    if history is not None:
+        query = query.eq("history", bool(history))
+    return query
 
 
-def get_all_data():
+def get_all_data(columns=None, start=None, end=None, risk_levels=None, gender=None, history=None,
+                 latest_only=True):
+    """管理员导出。筛选条件与列投影都在数据库端执行，只传输需要的行和列 (筛选参数见 filter_query)；
+    columns 为 None 时导出全部列；latest_only 为 True 时只取每个手机号最新一次评估 (与原先 upsert 的语义一致)，
+    否则导出全部历史评估"""
+    import pandas as pd
+
+    if columns is not None:
+        unknown = [c for c in columns if c not in EXPORT_COLUMNS]
+        if unknown:
+            raise ValueError(f"未知的导出列: {unknown}")
+        columns = [c for c in EXPORT_COLUMNS if c in columns]  # 保持固定列顺序
+        if not columns:
+            return pd.DataFrame()
+
     supabase = get_db_client()
     if not supabase:
         return pd.DataFrame()
 
     try:
-        # 获取所有数据
-        response = supabase.table("patient_records").select("*").execute()
+        query = supabase.table(LATEST_VIEW if latest_only else ASSESSMENTS_TABLE) \
+            .select("*" if columns is None else ",".join(columns))
+        query = filter_query(query, start, end, risk_levels, gender, history)
+        response = _db_call("export", query.order("created_at", desc=True).execute)
         data = response.data
-        df = pd.DataFrame(data)
+        df = pd.DataFrame(data, columns=columns)
 
-        # 展平 JSON
+        # 展平作答 (紧凑编码的行批量解码，旧 JSON 行照常展开)
         if not df.empty and 'input_data' in df.columns:
-            json_df = pd.json_normalize(df['input_data'])
+            json_df = decode_answers_frame(df['input_data'].tolist())
             df = df.drop(columns=['input_data']).join(json_df)
         return df
     except Exception as e:
         st.error(f"读取失败: {e}")
         return pd.DataFrame()
+
+
+def last_record_id(until):
+    """created_at 不晚于 until 的记录中最大的 id；没有时返回 None (把旧的按时间记录的水位线换算成 id)"""
+    supabase = get_db_client()
+    if not supabase:
+        raise RuntimeError("数据库连接失败：未配置 Secrets")
+    query = (supabase.table(ASSESSMENTS_TABLE).select("id").lte("created_at", until)
+             .order("id", desc=True).limit(1))
+    rows = _db_call("query", query.execute).data
+    return rows[0]["id"] if rows else None
+
+
+def iter_records(after_id=None, chunk_size=500, columns="*", until=None):
+    """按 id 递增分块流式读取记录 (主键上的 keyset 分页)，供离线任务增量处理。
+    id 由数据库在写入时分配、单调递增：本地队列事后补写的记录 created_at 较早，但 id 仍排在后面，
+    因此以上一批最后一行的 id 作为 after_id 续读不会漏掉它们。until 为 created_at 上限 (含)"""
+    supabase = get_db_client()
+    if not supabase:
+        raise RuntimeError("数据库连接失败：未配置 Secrets")
+    if columns != "*" and "id" not in columns.split(","):
+        columns = "id," + columns
+
+    last_id = after_id
+    while True:
+        query = supabase.table(ASSESSMENTS_TABLE).select(columns)
+        if last_id is not None:
+            query = query.gt("id", int(last_id))
+        if until is not None:
+            query = query.lte("created_at", until)
+        rows = _db_call("stream", query.order("id").limit(chunk_size).execute).data
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+def get_history(phone, name, since=None, until=None, before=None, limit=HISTORY_PAGE_SIZE,
+                columns="created_at,risk_score,risk_level"):
+    """同一手机号且姓名一致的历次评估，按时间倒序分页 (命中 (phone, created_at desc) 索引)。
+    手机号未经验证，姓名作为第二个条件 (与 get_latest_profile 相同)。
+    since / until 为时间范围；翻页时把上一页最后一行的 created_at 作为 before 传入。数据库不可用时返回 []"""
+    supabase = get_db_client()
+    if not supabase:
+        return []
+
+    query = supabase.table(ASSESSMENTS_TABLE).select(columns).eq("phone", phone).eq("patient_name", name)
+    if since is not None:
+        query = query.gte("created_at", since)
+    if until is not None:
+        query = query.lte("created_at", until)
+    if before is not None:
+        query = query.lt("created_at", before)
+    try:
+        return _db_call("query", query.order("created_at", desc=True).limit(limit).execute).data
+    except Exception as e:
+        print(f"❌ 历史记录读取失败: {e}")
+        return []
+
+
+def _fetch_latest_profile(phone, name):
+    supabase = get_db_client()
+    if not supabase:
+        return None
+    since = (datetime.now() - timedelta(days=PROFILE_MAX_AGE_DAYS)).isoformat()
+    # 有效期按画像的填写时间算，而不是记录的提交时间：沿用画像生成的新记录不会让它续期
+    query = (supabase.table(ASSESSMENTS_TABLE).select("profile_answered_at,input_data")
+             .eq("phone", phone).eq("patient_name", name).eq("history", True).gte("profile_answered_at", since)
+             .order("profile_answered_at", desc=True).limit(1))
+    rows = _db_call("query", query.execute).data
+    if not rows:
+        return None
+    answers = decode_answers(rows[0]["input_data"])
+    longterm = {k: v for k, v in answers.items() if k in qs.SCHEMA_LONGTERM.by_key}
+    if not longterm:
+        return None
+    return {"answered_at": rows[0]["profile_answered_at"], "answers": longterm}
+
+
+def get_latest_profile(phone, name):
+    """该手机号 (validate_phone 规范化后的格式) 且姓名一致、填写于 PROFILE_MAX_AGE_DAYS 天内的最近一次长期画像：
+    {"answered_at": 画像填写时间, "answers"}，没有时返回 None。
+    手机号未经验证，姓名作为第二个条件，两者都对上才返回；返回的作答不应直接显示给填写者。
+    经由 PROFILE_CACHE：同一 (手机号, 姓名) 在有效期内只查一次库 (“没有”也会被缓存)；查询出错时返回 None 且不缓存"""
+    try:
+        return PROFILE_CACHE.get_or_create((phone, name), lambda: _fetch_latest_profile(phone, name))
+    except Exception as e:
+        print(f"❌ 长期画像读取失败: {e}")
+        return None
+
+
+# ================= 结果页用到的内存索引 =================
+# PPC 分数索引 (人群百分位) 与 48h 症状位向量索引 (相似患者)，进程内所有会话共享一份。
+# 启动时在后台线程从数据库批量构建一次 (一次遍历同时填充两个索引，只取 created_at 不晚于启动时刻的记录)，
+# 启动之后保存的记录由 save_record 增量写入，两部分不会重复计数。
+SCORE_INDEX = ScoreIndex()
+SIMILAR_INDEX = SymptomBitsetIndex()
+_index_thread = None
+_index_lock = threading.Lock()
+
+
+def _load_lca_assets():
+    """相似患者索引按 LCA 类别分桶用的参数；读取失败时不分桶"""
+    try:
+        import joblib
+        import lca_online
+        from migraine_core.assets import MODEL_DIR
+
+        _, path = lca_online.latest_params_path(MODEL_DIR)
+        return joblib.load(path)
+    except Exception as e:
+        print(f"[System] 未能读取 LCA 参数，相似患者检索不分桶: {e}")
+        return None
+
+
+def _build_indexes(until):
+    import numpy as np
+
+    scores, history, genders, answers, levels = [], [], [], [], []
+    try:
+        columns = "created_at,risk_score,risk_level,history,gender,input_data"
+        for rows in iter_records(chunk_size=1000, columns=columns, until=until):
+            for r in rows:
+                try:
+                    decoded = decode_answers(r.get("input_data"))
+                except ValueError as e:
+                    # 单条记录无法解码时跳过，不影响其它记录
+                    print(f"[System] 跳过记录 {r.get('id')}: {e}")
+                    continue
+                scores.append(np.nan if r.get("risk_score") is None else r["risk_score"])
+                history.append(bool(r.get("history")))
+                genders.append(r.get("gender") or "")
+                answers.append(decoded)
+                levels.append(r.get("risk_level") or "")
+        SCORE_INDEX.build(scores, history, genders)
+        SIMILAR_INDEX.build(answers, levels)
+        print(f"[System] 索引构建完成：{len(scores)} 条记录，分数 {SCORE_INDEX.stats()}，相似患者 {SIMILAR_INDEX.stats()}")
+    except Exception as e:
+        print(f"[System] 索引构建失败 (结果页不显示百分位与相似患者): {e}")
+
+
+def preload_indexes():
+    """在后台线程批量构建分数索引与相似患者索引 (幂等)"""
+    global _index_thread
+    with _index_lock:
+        if _index_thread is None:
+            _maybe_replay()  # 上次运行遗留在本地队列中的记录
+            SIMILAR_INDEX.lca_assets = _load_lca_assets()
+            _index_thread = threading.Thread(target=_build_indexes, args=(datetime.now().isoformat(),),
+                                             name="record-index", daemon=True)
+            _index_thread.start()
+
+
+def _indexes_ready():
+    return _index_thread is not None and not _index_thread.is_alive()
+
+
+def get_percentile(score, has_history, gender):
+    """score 在同组 (是否有病史 × 性别) 已评分记录中的百分位；索引尚未就绪或样本不足时返回 None"""
+    if not _indexes_ready():
+        return None
+    return SCORE_INDEX.percentile(score, has_history, gender)
+
+
+def find_similar(answers, k=20):
+    """48h 症状最相似的 k 条既往记录及其风险等级分布 (见 SymptomBitsetIndex.query)；索引尚未就绪时返回 None"""
+    if not _indexes_ready():
+        return None
+    return SIMILAR_INDEX.query(answers, k)
@@ -4,11 +4,18 @@
 
 import os
 import shutil
+import time
+import argparse
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import pandas as pd
 import numpy as np
 import joblib
 import torch # 必须引入 torch
 import json
+from asset_manifest import file_sha256, describe_file, load_manifest, update_manifest, is_unchanged, MODEL_FEATURE_FILES
+from migraine_core.lca import VERSIONED_PARAMS_FMT
 
 # ================= 🔴 请核对你的 E 盘路径 🔴 =================
 # 你的项目根目录
@@ -29,80 +36,438 @@ MAX_ITER = 300
 TOL = 1e-4
 ALPHA_SMOOTH = 1.0
 RANDOM_STATE = 2025
+N_INIT = 8  # 随机重启次数，取对数似然最高的一次
+N_JOBS = None  # 并行进程数，None = 使用全部 CPU 核心
 # ===================================================================
 
 # 目标输出目录 (自动创建在当前文件夹下的 models)
 DEST_DIR = os.path.join(os.path.dirname(__file__), "models")
 os.makedirs(DEST_DIR, exist_ok=True)
 
+# 原始 Excel 的列式缓存目录 (按源文件内容哈希区分版本，源文件变了会自动重新转换)
+CACHE_DIR = os.path.join(os.path.dirname(__file__), ".cache")
+MISSING_FLAG_COL = "本次48h症状是否全部缺失"
+XLSX_CHUNK_ROWS = 5000
+
 
 # --- 把你的 LCA 核心算法搬过来 ---
-def lca_em(X, n_classes, max_iter=300, tol=1e-4, random_state=None, alpha_smooth=1.0):
+# E-step 全部用 float32 矩阵乘法完成：
+#   log p(x|k) = X @ log(theta).T + (1-X) @ log(1-theta).T
+#              = X @ (log(theta) - log(1-theta)).T + sum_d log(1-theta)
+# 不再构造 N×K×D 的三维广播张量，内存从 O(NKD) 降到 O(NK)。
+def _lca_log_joint(X, pi, theta):
+    log_theta = np.log(theta + 1e-12)
+    log_1_minus_theta = np.log(1 - theta + 1e-12)
+    log_px_given_k = X @ (log_theta - log_1_minus_theta).T + log_1_minus_theta.sum(axis=1)[None, :]
+    return log_px_given_k + np.log(pi + 1e-12)[None, :]
+
+
+def _lca_em_single(X, n_classes, max_iter=300, tol=1e-4, random_state=None, alpha_smooth=1.0):
+    """单次随机初始化的 EM，返回参数 + 收敛记录"""
     rng = np.random.RandomState(random_state)
+    X = np.asarray(X, dtype=np.float32)
     N, D = X.shape
-    pi = np.ones(n_classes) / n_classes
-    theta = rng.uniform(0.25, 0.75, size=(n_classes, D))
-    X1 = X
-    X0 = 1 - X1
+    pi = np.full(n_classes, 1.0 / n_classes, dtype=np.float32)
+    theta = rng.uniform(0.25, 0.75, size=(n_classes, D)).astype(np.float32)
     prev_ll = None
+    converged = False
+    history = []
 
     for it in range(max_iter):
+        t0 = time.perf_counter()
         # E-step
-        log_theta = np.log(theta + 1e-12)
-        log_1_minus_theta = np.log(1 - theta + 1e-12)
-        log_px_given_k = (X1[:, None, :] * log_theta[None, :, :] + X0[:, None, :] * log_1_minus_theta[None, :, :]).sum(
-            axis=2)
-        log_pi = np.log(pi + 1e-12)
-        log_joint = log_px_given_k + log_pi[None, :]
+        log_joint = _lca_log_joint(X, pi, theta)
         max_log = np.max(log_joint, axis=1, keepdims=True)
         log_sum_exp = max_log + np.log(np.sum(np.exp(log_joint - max_log), axis=1, keepdims=True) + 1e-12)
-        log_gamma = log_joint - log_sum_exp
-        gamma = np.exp(log_gamma)
-        ll = log_sum_exp.sum()
-        if prev_ll is not None and np.abs(ll - prev_ll) < tol: break
+        gamma = np.exp(log_joint - log_sum_exp)
+        # 对数似然用 float64 累加，避免大样本下 float32 求和的精度损失
+        ll = float(log_sum_exp.sum(dtype=np.float64))
+        delta = None if prev_ll is None else abs(ll - prev_ll)
+        # float32 下 LL 的舍入噪声约为 |LL|·1e-7，收敛阈值不低于这个噪声底
+        if delta is not None and delta < max(tol, abs(ll) * 1e-7):
+            history.append({"iter": it, "ll": ll, "delta": delta, "seconds": time.perf_counter() - t0})
+            converged = True
+            break
         prev_ll = ll
 
         # M-step
         Nk = gamma.sum(axis=0)
         pi = Nk / N
-        theta = (gamma.T @ X1 + alpha_smooth) / (Nk[:, None] + 2 * alpha_smooth)
+        theta = (gamma.T @ X + alpha_smooth) / (Nk[:, None] + 2 * alpha_smooth)
+        history.append({"iter": it, "ll": ll, "delta": delta, "seconds": time.perf_counter() - t0})
+
+    return {
+        "pi": pi.astype(np.float64),
+        "theta": theta.astype(np.float64),
+        "ll": ll,
+        "n_iter": len(history),
+        "converged": converged,
+        "random_state": random_state,
+        "history": history,
+    }
 
-    return pi, theta
 
+def _lca_em_worker(args):
+    X, kwargs = args
+    return _lca_em_single(X, **kwargs)
 
-def train_and_export_lca():
+
+def lca_fit(X, n_classes, max_iter=300, tol=1e-4, random_state=None, alpha_smooth=1.0, n_init=1, n_jobs=None):
+    """多次随机重启（进程池并行），保留对数似然最高的一次；返回 (best, all_runs)"""
+    base_seed = 0 if random_state is None else random_state
+    jobs = [
+        (X, dict(n_classes=n_classes, max_iter=max_iter, tol=tol, random_state=base_seed + i,
+                 alpha_smooth=alpha_smooth))
+        for i in range(n_init)
+    ]
+
+    if n_init == 1 or n_jobs == 1:
+        runs = [_lca_em_worker(job) for job in jobs]
+    else:
+        max_workers = min(n_init, n_jobs or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            runs = list(pool.map(_lca_em_worker, jobs))
+
+    best = max(runs, key=lambda r: r["ll"])
+    return best, runs
+
+
+def lca_em(X, n_classes, max_iter=300, tol=1e-4, random_state=None, alpha_smooth=1.0, n_init=1, n_jobs=None):
+    best, _ = lca_fit(X, n_classes, max_iter=max_iter, tol=tol, random_state=random_state,
+                      alpha_smooth=alpha_smooth, n_init=n_init, n_jobs=n_jobs)
+    return best["pi"], best["theta"]
+
+
+# ================= 原始数据列式缓存 (Excel -> Parquet) =================
+# 解析 XLSX 是导出流程里最慢的一步，而 LCA 只需要 _48h 列和缺失标记列。
+# 首次运行时用 openpyxl 只读模式逐行流式读取工作表，每 XLSX_CHUNK_ROWS 行写一个 Parquet 分片；
+# 之后的运行直接按列投影读取 Parquet，不再碰 Excel。
+def _dedupe_header(header):
+    # 与 pandas.read_excel 的列名规则保持一致：空表头 -> Unnamed: i，重复列名 -> name.1, name.2 ...
+    seen = {}
+    names = []
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _normalize_chunk(df):
+    """把 openpyxl 读出的 object 列整理成 Parquet 能写入的单一类型"""
+    for c in df.columns:
+        col = df[c]
+        if col.dtype != object:
+            continue
+        non_null = col[col.notna()]
+        if non_null.map(lambda v: isinstance(v, (bool, int, float))).all():
+            df[c] = col.astype("float64")
+        elif non_null.map(lambda v: hasattr(v, "year")).all():
+            df[c] = pd.to_datetime(col, errors="coerce")
+        else:
+            df[c] = col.map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def convert_excel_to_parquet(src_path, sheet_name, dst_dir, chunk_rows=XLSX_CHUNK_ROWS):
+    """流式转换单个工作表，写完后再原子地把临时目录改名为 dst_dir"""
+    from openpyxl import load_workbook
+
+    tmp_dir = dst_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    wb = load_workbook(src_path, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet_name].iter_rows(values_only=True)
+        columns = _dedupe_header(next(rows))
+        parts, buf, n_rows = [], [], 0
+
+        def _flush():
+            part = f"part-{len(parts):05d}.parquet"
+            _normalize_chunk(pd.DataFrame(buf, columns=columns)).to_parquet(os.path.join(tmp_dir, part), index=False)
+            parts.append(part)
+            buf.clear()
+
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            buf.append(tuple(row[:len(columns)]) + (None,) * (len(columns) - len(row)))
+            n_rows += 1
+            if len(buf) >= chunk_rows:
+                _flush()
+        if buf or not parts:
+            _flush()
+    finally:
+        wb.close()
+
+    meta = {"sheet": sheet_name, "columns": columns, "n_rows": n_rows, "parts": parts}
+    with open(os.path.join(tmp_dir, "_meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(dst_dir, ignore_errors=True)
+    os.replace(tmp_dir, dst_dir)
+    return meta
+
+
+def ensure_raw_cache(src_path=RAW_DATA_PATH, sheet_name=SHEET_NAME):
+    """返回 (缓存目录, meta)；源文件内容哈希未变时直接复用"""
+    digest = hashlib.sha256((file_sha256(src_path) + "\0" + sheet_name).encode("utf-8")).hexdigest()[:16]
+    cache_dir = os.path.join(CACHE_DIR, f"{os.path.splitext(os.path.basename(src_path))[0]}_{digest}")
+    meta_path = os.path.join(cache_dir, "_meta.json")
+
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return cache_dir, json.load(f)
+
+    print(f"   首次读取该版本数据，正在转换为 Parquet 缓存: {cache_dir} ...")
+    t0 = time.perf_counter()
+    meta = convert_excel_to_parquet(src_path, sheet_name, cache_dir)
+    print(f"   转换完成：{meta['n_rows']} 行，{len(meta['parts'])} 个分片，耗时 {time.perf_counter() - t0:.1f}s")
+    return cache_dir, meta
+
+
+def load_raw_columns(select):
+    """按列投影读取原始数据；select 为列名判定函数"""
+    cache_dir, meta = ensure_raw_cache()
+    columns = [c for c in meta["columns"] if select(c)]
+    frames = [pd.read_parquet(os.path.join(cache_dir, p), columns=columns) for p in meta["parts"]]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def load_symptom_matrix():
+    """读取原始数据并提取 48h 症状矩阵，返回 (X, symptom_cols)"""
     print(f"1. 正在读取原始数据: {RAW_DATA_PATH} ...")
     if not os.path.exists(RAW_DATA_PATH):
         raise FileNotFoundError(f"❌ 找不到原始数据: {RAW_DATA_PATH}")
 
-    df = pd.read_excel(RAW_DATA_PATH, sheet_name=SHEET_NAME)
+    df = load_raw_columns(lambda c: c.endswith("_48h") or c == MISSING_FLAG_COL)
 
     # 过滤无效数据
-    if "本次48h症状是否全部缺失" in df.columns:
-        df = df[~(df["本次48h症状是否全部缺失"] == True)].copy()
+    if MISSING_FLAG_COL in df.columns:
+        df = df[~(df[MISSING_FLAG_COL] == True)].copy()
 
     # 提取症状列
     symptom_cols = [c for c in df.columns if c.endswith("_48h")]
-    print(f"   提取到 {len(symptom_cols)} 个症状特征，正在进行 LCA 训练 (K={N_CLASSES_LCA})...")
-
-    X = df[symptom_cols].fillna(0).values.astype(int)
+    X = df[symptom_cols].fillna(0).values.astype(np.float32)
+    return X, symptom_cols
 
-    # 现场训练
-    pi, theta = lca_em(X, n_classes=N_CLASSES_LCA, max_iter=MAX_ITER, tol=TOL, random_state=RANDOM_STATE,
-                       alpha_smooth=ALPHA_SMOOTH)
 
-    # 保存参数
+def save_lca_params(pi, theta, symptom_cols, n_classes, X):
     lca_assets = {
         "pi": pi,
         "theta": theta,
         "symptom_cols": symptom_cols,
-        "n_classes": N_CLASSES_LCA
+        "n_classes": n_classes
     }
 
     save_path = os.path.join(DEST_DIR, "lca_params.pkl")
     joblib.dump(lca_assets, save_path)
+    update_manifest(DEST_DIR, {
+        "lca_params.pkl": describe_file(save_path, n_classes=n_classes, n_symptoms=len(symptom_cols))
+    })
     print(f"✅ LCA 训练完成，参数已保存至: {save_path}")
 
+    # lca_online.py 增量更新过的目录里有 lca_params.vNNNN.pkl，预测端总是加载版本号最大的那个：
+    # 重训的参数必须以更高的版本号发布，否则旧的在线版本会一直盖过它，下次增量也会接着旧版本编号
+    from lca_online import compute_suffstats, save_suffstats, latest_params_path, _atomic_dump
+    version, _ = latest_params_path(DEST_DIR)
+    if version:
+        version += 1
+        versioned_path = os.path.join(DEST_DIR, VERSIONED_PARAMS_FMT.format(version))
+        _atomic_dump(dict(lca_assets, version=version, n_total=int(len(X))), versioned_path)
+        print(f"   已有在线增量版本，重训参数同时发布为: {versioned_path}")
+
+    # 保存充分统计量 (版本号与上面发布的参数一致)，供 lca_online.py 增量吸收新记录 (不需要再跑全量数据)
+    stats = compute_suffstats(X, pi, theta)
+    stats.update({"alpha_smooth": ALPHA_SMOOTH, "version": version, "watermark": None})
+    save_suffstats(stats, DEST_DIR)
+    return save_path
+
+
+def train_and_export_lca():
+    X, symptom_cols = load_symptom_matrix()
+    print(f"   提取到 {len(symptom_cols)} 个症状特征，正在进行 LCA 训练 (K={N_CLASSES_LCA})...")
+
+    # 现场训练 (多次随机重启并行)
+    t0 = time.perf_counter()
+    best, runs = lca_fit(X, n_classes=N_CLASSES_LCA, max_iter=MAX_ITER, tol=TOL, random_state=RANDOM_STATE,
+                         alpha_smooth=ALPHA_SMOOTH, n_init=N_INIT, n_jobs=N_JOBS)
+    elapsed = time.perf_counter() - t0
+    pi, theta = best["pi"], best["theta"]
+    for r in runs:
+        flag = "✔" if r["converged"] else "✘"
+        print(f"   seed={r['random_state']}: LL={r['ll']:.2f}, iters={r['n_iter']}, converged={flag}")
+    print(f"   最优 seed={best['random_state']} (LL={best['ll']:.2f})，总耗时 {elapsed:.1f}s")
+
+    # 保存参数与充分统计量
+    save_lca_params(pi, theta, symptom_cols, N_CLASSES_LCA, X)
+
+    # 训练日志：每次重启的逐轮耗时与收敛情况 (仅供诊断，预测端不读取)
+    train_log = {
+        "n_samples": int(X.shape[0]),
+        "n_features": int(X.shape[1]),
+        "n_classes": N_CLASSES_LCA,
+        "n_init": N_INIT,
+        "best_random_state": best["random_state"],
+        "total_seconds": elapsed,
+        "runs": [{k: r[k] for k in ("random_state", "ll", "n_iter", "converged", "history")} for r in runs],
+    }
+    log_path = os.path.join(DEST_DIR, "lca_train_log.json")
+    with open(log_path, "w", encoding="utf-8") as f:
+        json.dump(train_log, f, ensure_ascii=False, indent=2)
+    print(f"   训练日志已保存至: {log_path}")
+
+
+# ================= LCA 类别数扫描 (K 选择) =================
+# 对 K = 2..k_max 每个 K 跑多个随机种子，计算 BIC / AIC / 熵，用于复核 K=6 的结论。
+# 症状矩阵只放一份在共享内存里，各工作进程按名字挂载，不再给每个任务 pickle 一份副本。
+_SWEEP_SHM = None
+_SWEEP_X = None
+
+
+def _attach_shared_memory(name):
+    try:
+        # Python 3.13+: 子进程只挂载不登记，避免 resource_tracker 退出时误删共享内存
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _sweep_init(shm_name, shape, dtype):
+    global _SWEEP_SHM, _SWEEP_X
+    _SWEEP_SHM = _attach_shared_memory(shm_name)
+    _SWEEP_X = np.ndarray(shape, dtype=dtype, buffer=_SWEEP_SHM.buf)
+
+
+def lca_fit_metrics(X, pi, theta, ll):
+    """模型选择指标：BIC / AIC 越小越好，熵 (relative entropy) 越接近 1 分类越清晰"""
+    N, D = X.shape
+    K = len(pi)
+    log_joint = _lca_log_joint(X, pi.astype(np.float32), theta.astype(np.float32))
+    max_log = np.max(log_joint, axis=1, keepdims=True)
+    log_gamma = log_joint - (max_log + np.log(np.sum(np.exp(log_joint - max_log), axis=1, keepdims=True)))
+    gamma = np.exp(log_gamma)
+
+    n_params = (K - 1) + K * D
+    class_entropy = -float(np.sum(gamma * log_gamma, dtype=np.float64))
+    return {
+        "n_params": n_params,
+        "bic": -2 * ll + n_params * np.log(N),
+        "aic": -2 * ll + 2 * n_params,
+        "entropy": 1.0 - class_entropy / (N * np.log(K)),
+        "min_class_share": float(np.bincount(gamma.argmax(axis=1), minlength=K).min() / N),
+    }
+
+
+def _sweep_worker(args):
+    n_classes, random_state = args
+    run = _lca_em_single(_SWEEP_X, n_classes, max_iter=MAX_ITER, tol=TOL, random_state=random_state,
+                         alpha_smooth=ALPHA_SMOOTH)
+    run.pop("history")
+    run.update(lca_fit_metrics(_SWEEP_X, run["pi"], run["theta"], run["ll"]))
+    run["n_classes"] = n_classes
+    return run
+
+
+def sweep_lca_classes(X, k_max, n_seeds=5, n_jobs=None, k_min=2):
+    """并行扫描 K = k_min..k_max，返回全部拟合结果 (list of dict)"""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    # 大 K 的任务更慢，先提交，尾部负载更均衡
+    jobs = [(k, RANDOM_STATE + s) for k in range(k_max, k_min - 1, -1) for s in range(n_seeds)]
+
+    shm = shared_memory.SharedMemory(create=True, size=X.nbytes)
+    try:
+        np.ndarray(X.shape, dtype=X.dtype, buffer=shm.buf)[:] = X
+        max_workers = min(len(jobs), n_jobs or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_sweep_init,
+                                 initargs=(shm.name, X.shape, X.dtype.str)) as pool:
+            runs = []
+            for run in pool.map(_sweep_worker, jobs):
+                runs.append(run)
+                print(f"   K={run['n_classes']} seed={run['random_state']}: "
+                      f"LL={run['ll']:.2f}, BIC={run['bic']:.1f}, entropy={run['entropy']:.3f}")
+    finally:
+        shm.close()
+        shm.unlink()
+    return runs
+
+
+def write_sweep_report(runs, out_dir):
+    """写出对比表 (CSV) 与曲线图 (HTML)，返回每个 K 的最优拟合表"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    cols = ["n_classes", "random_state", "ll", "bic", "aic", "entropy", "min_class_share", "n_iter", "converged"]
+    df_runs = pd.DataFrame([{c: r[c] for c in cols} for r in runs]).sort_values(["n_classes", "random_state"])
+    df_best = df_runs.loc[df_runs.groupby("n_classes")["ll"].idxmax()].reset_index(drop=True)
+
+    os.makedirs(out_dir, exist_ok=True)
+    df_runs.to_csv(os.path.join(out_dir, "lca_sweep_runs.csv"), index=False, encoding="utf-8-sig")
+    df_best.to_csv(os.path.join(out_dir, "lca_sweep_summary.csv"), index=False, encoding="utf-8-sig")
+
+    fig = make_subplots(rows=1, cols=2, subplot_titles=("信息准则 (越小越好)", "分类熵 (越接近 1 越好)"))
+    fig.add_trace(go.Scatter(x=df_best["n_classes"], y=df_best["bic"], mode="lines+markers", name="BIC"), 1, 1)
+    fig.add_trace(go.Scatter(x=df_best["n_classes"], y=df_best["aic"], mode="lines+markers", name="AIC"), 1, 1)
+    fig.add_trace(go.Scatter(x=df_best["n_classes"], y=df_best["entropy"], mode="lines+markers", name="Entropy"), 1, 2)
+    fig.update_xaxes(title_text="K", dtick=1)
+    fig.write_html(os.path.join(out_dir, "lca_sweep.html"), include_plotlyjs="cdn")
+
+    print(df_best[["n_classes", "ll", "bic", "aic", "entropy", "min_class_share"]].to_string(index=False))
+    print(f"   扫描报告已保存至: {out_dir}")
+    return df_best
+
+
+def expected_lca_classes():
+    """TabPFN 特征列要求的 LCA 类别数 (与 asset_manifest.check_consistency 的口径一致)：
+    数 models/feat_cols_*.json 里的 LCA_class_prob_* 列；不含这类列的特征文件不约束 K。
+    返回 (K, 问题说明)：特征文件缺失 / 读不了 / 相互矛盾时 K 为 None"""
+    counts = {}
+    for fname in MODEL_FEATURE_FILES.values():
+        path = os.path.join(DEST_DIR, fname)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cols = json.load(f)
+        except (OSError, ValueError) as e:
+            return None, f"无法读取 {fname}: {e}"
+        n_lca = sum(1 for c in cols if str(c).startswith("LCA_class_prob_"))
+        if n_lca:
+            counts[fname] = n_lca
+    if not counts:
+        return None, "特征列中没有 LCA_class_prob_* 列"
+    if len(set(counts.values())) > 1:
+        return None, f"各特征文件的 LCA 类别数不一致: {counts}"
+    return next(iter(counts.values())), ""
+
+
+def run_lca_sweep(k_max, n_seeds=5, n_jobs=None, export_best=False, force=False):
+    X, symptom_cols = load_symptom_matrix()
+    print(f"   提取到 {len(symptom_cols)} 个症状特征，开始扫描 K=2..{k_max} (每个 K {n_seeds} 个种子)...")
+
+    runs = sweep_lca_classes(X, k_max, n_seeds=n_seeds, n_jobs=n_jobs)
+    df_best = write_sweep_report(runs, os.path.join(DEST_DIR, "lca_sweep"))
+
+    best_k = int(df_best.loc[df_best["bic"].idxmin(), "n_classes"])
+    print(f"   BIC 最优: K={best_k}")
+    if not export_best:
+        return
+
+    # TabPFN 的特征列 LCA_class_prob_* 按线上 LCA 的类别数生成，K 变了必须重训 TabPFN
+    expected_k, problem = expected_lca_classes()
+    if expected_k is None and not force:
+        print(f"   ⚠️ 无法从 TabPFN 特征列确定 LCA 类别数 ({problem})，未导出。"
+              f"确认要导出请加 --force 并重训 TabPFN。")
+        return
+    if expected_k is not None and best_k != expected_k and not force:
+        print(f"   ⚠️ BIC 最优 K={best_k} 与 TabPFN 特征列的 LCA_class_prob_* 个数 K={expected_k} 不一致，"
+              f"未导出。确认要导出请加 --force 并重训 TabPFN。")
+        return
+    winner = max((r for r in runs if r["n_classes"] == best_k), key=lambda r: r["ll"])
+    save_lca_params(winner["pi"], winner["theta"], symptom_cols, best_k, X)
+
 
 # def copy_models():
 #     print("2. 正在复制 TabPFN 模型文件...")
@@ -123,30 +488,52 @@ def train_and_export_lca():
 #             print(f"⚠️ 警告: 文件未找到，跳过: {src}")
 
 
+def _convert_model(src, dst_path):
+    """在子进程中把 TabPFN 模型转为 CPU 版并重新保存，返回写入清单的元信息"""
+    # 1. 加载模型（如果本地有显卡，它会先加载到显卡）
+    model = joblib.load(src)
+
+    # 2. 【关键】强制将 TabPFN 内部的 torch 模型转为 CPU
+    # TabPFN 的结构通常是 model.model 是底座
+    if hasattr(model, 'model'):
+        model.model.to('cpu')
+
+    # 3. 重新保存（此时保存的是 CPU 版本的权重）
+    joblib.dump(model, dst_path)
+    n_in = getattr(model, "n_features_in_", None)
+    return {"n_features_in": None if n_in is None else int(n_in), "estimator": type(model).__name__}
+
+
 def copy_models():
     print("2. 正在转换并处理 TabPFN 模型至 CPU 模式...")
+    manifest = load_manifest(DEST_DIR)
+    artifacts = {}
 
     files_to_process = [
         (os.path.join(TABPFN_DIR, "models", "tabpfn.pkl"), "tabpfn_longterm.pkl"),
         (os.path.join(TABPFN_48H_DIR, "models", "tabpfn_48h_only.pkl"), "tabpfn_48h_only.pkl")
     ]
 
+    # 源文件哈希没变、目标文件完好的模型直接跳过；需要转换的两个模型并行处理
+    pending = []
     for src, dst_name in files_to_process:
-        if os.path.exists(src):
-            print(f"   正在处理: {dst_name} ...")
-            # 1. 加载模型（如果本地有显卡，它会先加载到显卡）
-            model = joblib.load(src)
-
-            # 2. 【关键】强制将 TabPFN 内部的 torch 模型转为 CPU
-            # TabPFN 的结构通常是 model.model 是底座
-            if hasattr(model, 'model'):
-                model.model.to('cpu')
-
-            # 3. 重新保存（此时保存的是 CPU 版本的权重）
-            joblib.dump(model, os.path.join(DEST_DIR, dst_name))
-            print(f"   ✅ 已转换并导出 CPU 版: {dst_name}")
-        else:
+        if not os.path.exists(src):
             print(f"   ⚠️ 警告: 文件未找到: {src}")
+            continue
+        src_sha = file_sha256(src)
+        if is_unchanged(manifest, dst_name, src_sha, os.path.join(DEST_DIR, dst_name)):
+            print(f"   ⏭️ 未变化，跳过: {dst_name}")
+            continue
+        pending.append((src, dst_name, src_sha))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=len(pending)) as pool:
+            futures = [(dst_name, src_sha, pool.submit(_convert_model, src, os.path.join(DEST_DIR, dst_name)))
+                       for src, dst_name, src_sha in pending]
+            for dst_name, src_sha, fut in futures:
+                info = fut.result()
+                artifacts[dst_name] = describe_file(os.path.join(DEST_DIR, dst_name), source_sha256=src_sha, **info)
+                print(f"   ✅ 已转换并导出 CPU 版: {dst_name}")
 
     # 剩下的非模型文件继续用复制即可
     other_files = [
@@ -155,15 +542,110 @@ def copy_models():
         (CKPT_PATH, "tabpfn-v2.5-regressor-v2.5_default.ckpt")
     ]
     for src, dst_name in other_files:
-        if os.path.exists(src):
-            shutil.copy(src, os.path.join(DEST_DIR, dst_name))
-            print(f"   ✅ 已复制: {dst_name}")
+        if not os.path.exists(src):
+            continue
+        dst_path = os.path.join(DEST_DIR, dst_name)
+        src_sha = file_sha256(src)
+        if is_unchanged(manifest, dst_name, src_sha, dst_path):
+            print(f"   ⏭️ 未变化，跳过: {dst_name}")
+            continue
+        shutil.copy(src, dst_path)
+        extra = {"source_sha256": src_sha}
+        if dst_name.endswith(".json"):
+            with open(dst_path, "r", encoding="utf-8") as f:
+                extra["n_features"] = len(json.load(f))
+        artifacts[dst_name] = describe_file(dst_path, **extra)
+        print(f"   ✅ 已复制: {dst_name}")
+
+    if artifacts:
+        update_manifest(DEST_DIR, artifacts)
+        print(f"   资产清单已更新: {os.path.join(DEST_DIR, 'manifest.json')}")
+
+
+# ================= 级联推理的廉价模型 =================
+# 以 TabPFN 在原始数据上的输出为目标蒸馏岭回归 (输入为同一特征向量，含 LCA 后验)，
+# 并在留出的校准集上确定 conformal 区间半宽；预测端用它决定哪些请求需要升级到 TabPFN。
+CASCADE_MAX_ROWS = 4000   # 蒸馏用的最大行数 (TabPFN 需要对这些行各推理一次)
+CASCADE_COVERAGE = 0.95   # 区间覆盖率
+CASCADE_RIDGE = 1.0       # 岭回归惩罚系数
+
+
+def export_cascade_surrogates():
+    print("3. 正在蒸馏级联推理的廉价模型...")
+    import lca_online
+    from questionnaire_schema import FeatureLayout
+    from migraine_core.assets import load_model_file
+    from migraine_core.cascade import CASCADE_FILES, fit_surrogate
+    from migraine_core.predictor import _fill_lca_features
+
+    lca_assets = joblib.load(os.path.join(DEST_DIR, "lca_params.pkl"))
+    targets = {False: ("feat_cols_48h.json", "tabpfn_48h_only.pkl"),
+               True: ("feat_cols_longterm.json", "tabpfn_longterm.pkl")}
+    layouts = {}
+    for has_history, (cols_name, model_name) in targets.items():
+        cols_path, model_path = os.path.join(DEST_DIR, cols_name), os.path.join(DEST_DIR, model_name)
+        if not (os.path.exists(cols_path) and os.path.exists(model_path)):
+            print(f"   ⚠️ 缺少 {cols_name} 或 {model_name}，跳过 {CASCADE_FILES[has_history]}")
+            continue
+        with open(cols_path, "r", encoding="utf-8") as f:
+            layouts[has_history] = FeatureLayout(json.load(f))
+    if not layouts:
+        return
+
+    needed = set(lca_assets["symptom_cols"]).union(*(l.value_cols for l in layouts.values()))
+    df = load_raw_columns(lambda c: c in needed or c == MISSING_FLAG_COL)
+    if MISSING_FLAG_COL in df.columns:
+        df = df[~(df[MISSING_FLAG_COL] == True)]
+    if len(df) > CASCADE_MAX_ROWS:
+        df = df.sample(CASCADE_MAX_ROWS, random_state=RANDOM_STATE)
+    df = df.reset_index(drop=True).apply(pd.to_numeric, errors="coerce")
+
+    S = df.reindex(columns=lca_assets["symptom_cols"]).to_numpy(dtype=np.float64)
+    gamma = lca_online.lca_posterior(np.nan_to_num(S, nan=0.0), lca_assets["pi"], lca_assets["theta"])
+    lca_class = gamma.argmax(axis=1)
+
+    artifacts = {}
+    for has_history, layout in layouts.items():
+        name = CASCADE_FILES[has_history]
+        X = _fill_lca_features(layout, layout.encode_frame(df), gamma, lca_class).astype(np.float32)
+        model = load_model_file(os.path.join(DEST_DIR, targets[has_history][1]))
+        t0 = time.perf_counter()
+        y = np.asarray(model.predict(X), dtype=np.float64).reshape(len(X), -1)[:, 0]
+        params = fit_surrogate(X, y, alpha=CASCADE_RIDGE, coverage=CASCADE_COVERAGE, random_state=RANDOM_STATE)
+        dst_path = os.path.join(DEST_DIR, name)
+        joblib.dump(params, dst_path)
+        artifacts[name] = describe_file(dst_path, n_features=params["n_features"], q=params["q"],
+                                        coverage=CASCADE_COVERAGE)
+        print(f"   ✅ {name}: {len(X)} 行 (TabPFN 推理 {time.perf_counter() - t0:.1f}s)，区间半宽 {params['q']:.3f}，"
+              f"校准集升级率 {params['calib_escalation_rate']:.1%}，未升级行等级不一致率 "
+              f"{params['calib_disagreement_rate']:.1%}")
+
+    update_manifest(DEST_DIR, artifacts)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="训练 LCA 并导出模型资产")
+    parser.add_argument("--sweep", type=int, metavar="K_MAX",
+                        help="扫描 K=2..K_MAX 的 LCA 类别数 (只做模型选择，不搬运 TabPFN)")
+    parser.add_argument("--seeds", type=int, default=5, help="扫描时每个 K 的随机种子数")
+    parser.add_argument("--jobs", type=int, default=N_JOBS, help="并行进程数，默认使用全部 CPU 核心")
+    parser.add_argument("--export-best", action="store_true", help="扫描后导出 BIC 最优的 LCA 参数")
+    parser.add_argument("--force", action="store_true", help="即使最优 K 与线上 K 不一致也导出")
+    parser.add_argument("--cascade-only", action="store_true",
+                        help="只重新蒸馏级联推理的廉价模型 (LCA 参数与 TabPFN 模型已导出)")
+    args = parser.parse_args()
+
     try:
+        if args.sweep:
+            run_lca_sweep(args.sweep, n_seeds=args.seeds, n_jobs=args.jobs,
+                          export_best=args.export_best, force=args.force)
+            return
+        if args.cascade_only:
+            export_cascade_surrogates()
+            return
         train_and_export_lca()
         copy_models()
+        export_cascade_surrogates()
         print("\n🎉 恭喜！所有资产已准备就绪。")
         print("现在你可以运行启动脚本了。")
     except Exception as e:
@@ -0,0 +1,154 @@
+# lca_online.py
+# 作用：LCA 参数的在线增量更新 (incremental / mini-batch EM)
+# 运行方式：python lca_online.py [--chunk-size 500] [--decay 1.0]
+#
+# 原理：Bernoulli LCA 的 M-step 只依赖两组充分统计量
+#   Nk[k]    = Σ_i γ_ik          (每个类别的加权样本数)
+#   Sk[k, d] = Σ_i γ_ik · x_id   (每个类别、每个症状的加权阳性数)
+# 训练时 (export_assets_local.py) 把它们保存在 lca_params.pkl 旁边；
+# 之后新记录按块从数据库流式读出，只对新块做 E-step，把统计量累加进去再做一次 M-step，
+# 最后写出带版本号的参数文件 lca_params.vNNNN.pkl，预测端发现新版本后热加载。
+
+import os
+import argparse
+import joblib
+import numpy as np
+from migraine_core.lca import lca_posterior, VERSIONED_PARAMS_FMT
+from migraine_core.lca import latest_params_path as _latest_params_path
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "models")
+SUFFSTATS_NAME = "lca_suffstats.pkl"
+
+
+def compute_suffstats(X, pi, theta):
+    gamma = lca_posterior(X, pi, theta)
+    return {
+        "Nk": gamma.sum(axis=0),
+        "Sk": gamma.T @ np.asarray(X, dtype=np.float64),
+        "n_total": int(len(X)),
+    }
+
+
+def bootstrap_suffstats(lca_assets, prior_weight):
+    """旧版导出没有保存统计量时，用现有参数折算成 prior_weight 个伪样本"""
+    Nk = np.asarray(lca_assets["pi"], dtype=np.float64) * prior_weight
+    return {
+        "Nk": Nk,
+        "Sk": np.asarray(lca_assets["theta"], dtype=np.float64) * Nk[:, None],
+        "n_total": int(prior_weight),
+        "alpha_smooth": 1.0,
+        "version": 0,
+        "watermark": None,
+    }
+
+
+def params_from_suffstats(stats):
+    """M-step：由充分统计量得到 (pi, theta)，平滑方式与训练时一致"""
+    Nk, Sk, alpha = stats["Nk"], stats["Sk"], stats.get("alpha_smooth", 1.0)
+    pi = Nk / Nk.sum()
+    theta = (Sk + alpha) / (Nk[:, None] + 2 * alpha)
+    return pi, theta
+
+
+def fold_in(stats, X_chunk, decay=1.0):
+    """吸收一个新数据块：用当前参数做 E-step，累加统计量 (decay < 1 时旧统计量按比例遗忘)"""
+    pi, theta = params_from_suffstats(stats)
+    chunk = compute_suffstats(X_chunk, pi, theta)
+    stats["Nk"] = decay * stats["Nk"] + chunk["Nk"]
+    stats["Sk"] = decay * stats["Sk"] + chunk["Sk"]
+    stats["n_total"] += chunk["n_total"]
+    return stats
+
+
+# ================= 版本化参数文件 =================
+def _atomic_dump(obj, path):
+    tmp_path = path + ".tmp"
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def latest_params_path(model_dir=MODEL_DIR):
+    """见 migraine_core.lca.latest_params_path (默认读本仓库的 models 目录)"""
+    return _latest_params_path(model_dir)
+
+
+def load_suffstats(model_dir=MODEL_DIR):
+    path = os.path.join(model_dir, SUFFSTATS_NAME)
+    return joblib.load(path) if os.path.exists(path) else None
+
+
+def save_suffstats(stats, model_dir=MODEL_DIR):
+    _atomic_dump(stats, os.path.join(model_dir, SUFFSTATS_NAME))
+
+
+def write_versioned_params(lca_assets, stats, version, model_dir=MODEL_DIR):
+    pi, theta = params_from_suffstats(stats)
+    assets = dict(lca_assets, pi=pi, theta=theta, version=version, n_total=stats["n_total"])
+    path = os.path.join(model_dir, VERSIONED_PARAMS_FMT.format(version))
+    # 先写参数再写统计量：中途失败时统计量仍对应上一个版本，下次会重新吸收这批记录
+    _atomic_dump(assets, path)
+    save_suffstats(dict(stats, version=version), model_dir)
+    return path
+
+
+def records_to_matrix(records, symptom_cols):
+    """把数据库记录的 input_data 转成症状矩阵；没有任何 48h 作答的记录会被丢弃"""
+    import database_manager as db
+
+    # input_data 可能是紧凑编码或旧 JSON，统一批量解码
+    df = db.decode_answers_frame([r.get("input_data") for r in records])
+    df = df.reindex(columns=symptom_cols)
+    df = df[df.notna().any(axis=1)]
+    return df.fillna(0).values.astype(np.float64)
+
+
+def run_update(chunk_size=500, decay=1.0, prior_weight=1000, model_dir=MODEL_DIR):
+    import database_manager as db
+
+    version, params_path = latest_params_path(model_dir)
+    lca_assets = joblib.load(params_path)
+    symptom_cols = lca_assets["symptom_cols"]
+
+    stats = load_suffstats(model_dir)
+    if stats is None:
+        print(f"⚠️ 未找到 {SUFFSTATS_NAME}，用当前参数折算 {prior_weight} 个伪样本作为先验")
+        stats = bootstrap_suffstats(lca_assets, prior_weight)
+
+    # 水位线是已吸收的最大记录 id (写入顺序)，而不是 created_at：补写的记录时间较早但 id 较新，不会漏掉
+    watermark = stats.get("watermark")
+    if isinstance(watermark, (tuple, list)):  # 旧版水位线 (created_at, id)
+        watermark = watermark[1]
+    elif isinstance(watermark, str):  # 更早的水位线只有 created_at
+        watermark = db.last_record_id(watermark)
+    print(f"1. 当前 LCA 版本 v{version} (累计样本 {stats['n_total']})，增量读取 id > {watermark} 的新记录...")
+    n_new = 0
+    for records in db.iter_records(after_id=watermark, chunk_size=chunk_size, columns="id,input_data"):
+        X_chunk = records_to_matrix(records, symptom_cols)
+        if len(X_chunk):
+            fold_in(stats, X_chunk, decay=decay)
+            n_new += len(X_chunk)
+        watermark = records[-1]["id"]
+        print(f"   已吸收 {n_new} 条新记录 (截至 id {watermark})")
+
+    if n_new == 0:
+        print("✅ 没有新记录，参数保持不变。")
+        return None
+
+    stats["watermark"] = watermark
+    path = write_versioned_params(lca_assets, stats, version + 1, model_dir)
+    print(f"✅ 已写出新版本参数: {path}")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用数据库中的新记录增量更新 LCA 参数")
+    parser.add_argument("--chunk-size", type=int, default=500, help="每次从数据库读取的记录数")
+    parser.add_argument("--decay", type=float, default=1.0, help="旧统计量的保留比例 (<1 时逐步遗忘旧数据)")
+    parser.add_argument("--prior-weight", type=int, default=1000,
+                        help="没有统计量文件时，现有参数折算的伪样本数")
+    args = parser.parse_args()
+    run_update(chunk_size=args.chunk_size, decay=args.decay, prior_weight=args.prior_weight)
+
+
+if __name__ == "__main__":
+    main()
@@ -134,216 +134,89 @@
 #
 # predictor = MigrainePredictor()
 
-
 # logic_processor.py
-import os
-# 必须在 import torch 之前设置！
-os.environ["CUDA_VISIBLE_DEVICES"] = ""
-os.environ["USE_CUDA"] = "FALSE"
-import joblib
-import numpy as np
-import pandas as pd
-import json
+# 作用：评分核心 (migraine_core) 的 Streamlit 适配层。
+# 模型资产放进 st.cache_resource (整个服务进程、所有会话共享)，预测器在后台线程预加载。
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st  # 新增引用
-import torch # 确保文件顶部引入了 torch
-from functools import partial
-
-# ---------------------------------------------------------
-# 关键修改 1: 删除 os.environ["TABPFN_OFFLINE"] = "1"
-# 我们需要它在线，以便自动去 GitHub 下载模型底座
-# ---------------------------------------------------------
+import migraine_core as core
 
 # 模型文件夹相对路径
-MODEL_DIR = os.path.join(os.path.dirname(__file__), "models")
+MODEL_DIR = core.MODEL_DIR
 
 
-# ---------------------------------------------------------
-# 关键修改 2: 定义缓存加载函数
-# 这个函数整个应用生命周期只运行一次，负责下载和加载模型
-# ---------------------------------------------------------
 @st.cache_resource(show_spinner="正在云端初始化 AI 模型 (首次运行需下载官方底座)...")
-def load_cached_resources():
-    print("[System] 开始加载模型资源...")
+def _st_cached(key, _factory):
+    # key 参与 Streamlit 的缓存哈希；_factory 以下划线开头，不参与哈希
+    return _factory()
 
-    # 定义加载辅助函数
-    # def _load_joblib_local(name):
-    #     path = os.path.join(MODEL_DIR, name)
-    #     if os.path.exists(path):
-    #         return joblib.load(path)
-    #     raise FileNotFoundError(f"Model file missing: {path}")
-    def _load_joblib_local(name):
-        path = os.path.join(MODEL_DIR, name)
-        if os.path.exists(path):
-            # 魔法：临时重定向 torch.load，强制它使用 map_location='cpu'
-            # 这样无论模型之前是在哪保存的，加载时都会被踢到 CPU
-            original_load = torch.load
-            torch.load = partial(original_load, map_location='cpu')
-            try:
-                model = joblib.load(path)
-                return model
-            finally:
-                # 任务完成后还原 torch.load，避免影响其他逻辑
-                torch.load = original_load
-        raise FileNotFoundError(f"Model file missing: {path}")
 
-    def _load_json_local(name):
-        path = os.path.join(MODEL_DIR, name)
-        if os.path.exists(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return []
+class StreamlitCache:
+    """core 缓存接口的 Streamlit 实现：get_or_create 交给 st.cache_resource"""
 
-    # 1. 加载所有文件
-    # lca_assets = _load_joblib_local("lca_params.pkl")
-    # model_48h = _load_joblib_local("tabpfn_48h_only.pkl")
-    # model_longterm = _load_joblib_local("tabpfn_longterm.pkl")
-    lca_assets = _load_joblib_local("lca_params.pkl")
-    model_48h = _load_joblib_local("tabpfn_48h_only.pkl")
-    model_longterm = _load_joblib_local("tabpfn_longterm.pkl")
+    def get_or_create(self, key, factory):
+        return _st_cached(key, factory)
 
-    # ===================== 【关键修改 2：强制注入 CPU 属性】 =====================
-    # 强制告诉 TabPFN 实例不要去管显卡，哪怕它内部代码想去检测
-    for m in [model_48h, model_longterm]:
-        if hasattr(m, 'device'):
-            m.device = torch.device('cpu')
-        if hasattr(m, 'to'):
-            m.to('cpu')
+    def clear(self):
+        _st_cached.clear()
 
 
-    feat_cols_48h = _load_json_local("feat_cols_48h.json")
-    feat_cols_longterm = _load_json_local("feat_cols_longterm.json")
+STREAMLIT_CACHE = StreamlitCache()
 
-    # 2. 【关键】执行一次“假预测”来触发 TabPFN 下载
-    # 当第一次调用 predict 时，TabPFN 会检测本地有没有 .ckpt 文件
-    # 如果没有，它会自动下载。我们将这个过程放在缓存里，
-    # 这样部署后只需要慢一次，后续所有用户都很快。
-    print("[System] 正在预热 TabPFN (触发自动下载)...")
-    try:
-        # 创建一个全 0 的假数据进行预热，维度适配 model_48h
-        dummy_X = np.zeros((1, len(feat_cols_48h)))
-        model_48h.predict(dummy_X)
-        print("[System] TabPFN 预热完成。")
-    except Exception as e:
-        print(f"[System] 预热过程出现非致命警告 (通常可忽略): {e}")
 
-    return lca_assets, model_48h, model_longterm, feat_cols_48h, feat_cols_longterm
+def load_cached_resources():
+    """整个应用生命周期只加载一次，返回 (lca_assets, model_48h, model_longterm, feat_cols_48h, feat_cols_longterm)"""
+    return core.get_assets(MODEL_DIR, cache=STREAMLIT_CACHE)
 
 
-class MigrainePredictor:
+class MigrainePredictor(core.MigrainePredictor):
     def __init__(self):
-        # ---------------------------------------------------------
-        # 关键修改 3: __init__ 不再干重活，直接拿缓存
-        # ---------------------------------------------------------
+        # __init__ 不再干重活，直接拿缓存
         print("[System] Fetching models from cache...")
-        (
-            self.lca_assets,
-            self.model_48h,
-            self.model_longterm,
-            self.feat_cols_48h,
-            self.feat_cols_longterm
-        ) = load_cached_resources()
-
+        super().__init__(load_cached_resources(), model_dir=MODEL_DIR)
         print("[System] Predictor ready.")
 
-    def anti_fraud_check(self, df_input):
-        """反作弊检测: 返回 (is_fraud, reason)"""
-        vals = df_input.select_dtypes(include=[np.number]).values.flatten()
-        vals = vals[~np.isnan(vals)]
-
-        if len(vals) == 0: return True, "数据为空"
-        if np.var(vals) < 0.01: return True, "检测到所有选项填写一致，请认真填写。"
-        if vals.mean() > 0.95: return True, "检测到症状勾选比例异常过高(>95%)，请确认。"
-
-        return False, None
-
-    def calculate_lca_posterior(self, user_df):
-        """LCA 在线推理"""
-        pi = self.lca_assets['pi']
-        theta = self.lca_assets['theta']
-        symptom_cols = self.lca_assets['symptom_cols']
-
-        # 确保只取 symptom_cols，且顺序一致
-        X = pd.DataFrame()
-        for col in symptom_cols:
-            if col in user_df.columns:
-                X[col] = user_df[col]
-            else:
-                X[col] = 0  # 缺失补0
-        X = X.fillna(0).values
 
-        # EM Algorithm: E-step
-        log_theta = np.log(theta + 1e-12)
-        log_1_minus_theta = np.log(1 - theta + 1e-12)
-
-        log_px_given_k = (
-                X[:, None, :] * log_theta[None, :, :] +
-                (1 - X)[:, None, :] * log_1_minus_theta[None, :, :]
-        )
-        log_px_given_k = log_px_given_k.sum(axis=2)
-
-        log_pi = np.log(pi + 1e-12)
-        log_joint = log_px_given_k + log_pi[None, :]
-
-        max_log = np.max(log_joint, axis=1, keepdims=True)
-        log_sum_exp = max_log + np.log(np.sum(np.exp(log_joint - max_log), axis=1, keepdims=True))
-        gamma = np.exp(log_joint - log_sum_exp)
-
-        return gamma[0]
-
-    def predict(self, user_data_dict, has_history=False):
-        df = pd.DataFrame([user_data_dict])
-
-        # 1. 确定使用哪套特征列
-        all_cols = self.feat_cols_longterm if has_history else self.feat_cols_48h
-
-        # 2. 补全列 & Missing Mask
-        for c in all_cols:
-            if c not in df.columns:
-                df[c] = np.nan
-
-        # 生成 missing mask
-        long_cols = [c for c in df.columns if c.endswith("_长期")]
-        for c in long_cols:
-            df[c + "_missingmask"] = df[c].isna().astype(float)
-
-        df = df.fillna(0)  # TabPFN 需要 0 填充
-
-        # 3. LCA 推理
-        gamma = self.calculate_lca_posterior(df)
-        lca_class_id = np.argmax(gamma)
+# ---------------------------------------------------------
+# 后台预加载：封面页一渲染就在后台线程里开始加载模型，
+# 用户填写问卷期间模型已在准备；真正需要推理时 get_predictor() 才会等待。
+# ---------------------------------------------------------
+_predictor_future = None
+_predictor_lock = threading.Lock()
 
-        # 注入 LCA 特征
-        for k in range(len(gamma)):
-            df[f"LCA_class_prob_{k}"] = gamma[k]
-            # 如果特征列里需要 One-Hot，也加上
-            col_onehot = f"LCA_class_{k}"
-            if col_onehot in all_cols:
-                df[col_onehot] = 1 if k == lca_class_id else 0
 
-        # 4. 按正确顺序提取特征
-        try:
-            X = df[all_cols].values.astype(np.float32)
-        except KeyError as e:
-            return {"error": f"Internal Error: Feature mismatch {e}"}
+def preload():
+    """在后台线程开始构建 MigrainePredictor (幂等)，返回 Future"""
+    global _predictor_future
+    with _predictor_lock:
+        if _predictor_future is None:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-preload")
+            _predictor_future = executor.submit(MigrainePredictor)
+            executor.shutdown(wait=False)
+        return _predictor_future
 
-        # 5. 推理
-        model = self.model_longterm if has_history else self.model_48h
 
-        # 注意：TabPFN 可能返回 (N_samples,) 或 (N_samples, 1)
-        raw_score = model.predict(X)
+def get_predictor(timeout=None):
+    """取得全局预测器；尚未加载完成时阻塞等待，加载失败时抛出异常并允许下次重试"""
+    global _predictor_future
+    future = preload()
+    try:
+        return future.result(timeout)
+    except Exception:
+        with _predictor_lock:
+            if _predictor_future is future and future.done():
+                _predictor_future = None
+        raise
 
-        # 简单兼容处理
-        if isinstance(raw_score, (list, np.ndarray)):
-            raw_score = raw_score[0]
 
-        raw_score = np.clip(raw_score, 0, 1)
+# 提交幂等登记表 (进程内、所有会话共享)：同一会话的同一份作答只推理、保存一次
+SUBMISSIONS = core.SubmissionRegistry(ttl=120)
 
-        return {
-            "raw_score": raw_score,
-            "lca_probs": gamma,
-            "lca_class": lca_class_id
-        }
 
+def __getattr__(name):
+    # 兼容旧写法 `from logic_processor import predictor`：首次访问时才加载
+    if name == "predictor":
+        return get_predictor()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# 初始化（Streamlit 运行时会自动触发上面的缓存函数）
-predictor = MigrainePredictor()
@@ -0,0 +1,33 @@
+# migraine_core
+# 作用：不依赖 Streamlit 的评分核心，供网页端 (logic_processor)、批量任务与进程池 worker 共用。
+#   cache     : 可插拔资源缓存 (默认进程内缓存；另有带过期时间的 TTLCache)
+#   assets    : 模型资产加载与校验
+#   predictor : MigrainePredictor (显式传入资产构造)
+#   scoring   : PPC 拉伸与符合度等级
+#   fraud     : 反作弊引擎 (批量规则 + 近似重复索引)
+#   bits      : 二值作答的位向量工具 (打包、popcount、汉明距离)
+#   lca       : LCA 后验 (批量 E-step) 与最新版本参数文件查找
+#   pool      : 模型副本池 (checkout / checkin，限时等待，繁忙度指标)
+#   weights   : TabPFN 底座权重去重 (两个模型及各副本共享同一份只读权重)
+#   admission : 推理准入控制 (并发上限 + 有界 FIFO 队列 + 排队位置 / 预计等待)
+#   cascade   : 级联推理 (廉价模型 + conformal 区间，跨等级阈值才升级到 TabPFN)
+#   score_index : PPC 分数的分组有序索引 (人群百分位查询)
+#   similar   : 48h 症状位向量索引 (汉明距离 top-k 相似患者，按 LCA 类别分桶)
+#   submission: 提交幂等 (同一会话的同一份作答只推理、保存一次)
+#   resilience: 外部调用保护 (超时、熔断器、写入失败时的本地持久化队列)
+#   worker    : 进程池 worker 初始化 (支持 fork 继承父进程已加载的模型)
+
+from migraine_core.cache import ProcessCache, TTLCache, NoCache, DEFAULT_CACHE
+from migraine_core.assets import MODEL_DIR, ModelAssets, load_assets, get_assets
+from migraine_core.fraud import FraudEngine, FraudResult, anti_fraud_matrix
+from migraine_core.bits import pack_rows, popcount, hamming_matrix
+from migraine_core.lca import lca_posterior, latest_params_path
+from migraine_core.pool import ModelPool, ModelReplica, PoolTimeout
+from migraine_core.admission import AdmissionController, ServerBusy, Ticket
+from migraine_core.cascade import Cascade, Surrogate, fit_surrogate
+from migraine_core.score_index import ScoreIndex
+from migraine_core.similar import SymptomBitsetIndex
+from migraine_core.submission import SubmissionRegistry, idempotency_key
+from migraine_core.resilience import CircuitBreaker, CircuitOpen, OperationTimeout, JsonlSpool
+from migraine_core.predictor import MigrainePredictor
+from migraine_core.scoring import stretch_prob, stretch_probs, concordance_level, CONCORDANCE_LEVELS
@@ -0,0 +1,154 @@
+# migraine_core/admission.py
+# 作用：推理前的准入控制。
+# 同时推理的请求数有上限，超出的请求进入先进先出的等待队列；队列也有上限，满了立即返回“繁忙，请稍后重试”，
+# 而不是让所有人同时启动 TabPFN、把 CPU 挤爆后一起卡住。
+# 排队中的请求可以随时查询自己的队列位置与预计等待时间 (按平均推理耗时的 EWMA 估算)，供界面展示。
+
+import math
+import time
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+class ServerBusy(RuntimeError):
+    """等待队列已满 (或排队超时)，请稍后重试"""
+
+
+class Ticket:
+    """一次推理的排队凭证；用完必须 release() (或作为 with 上下文使用)"""
+
+    def __init__(self, controller, ticket_id):
+        self.controller = controller
+        self.id = ticket_id
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self.released = False
+
+    @property
+    def admitted(self):
+        return self.admitted_at is not None
+
+    def position(self):
+        """0 表示已获准推理；n >= 1 表示在等待队列中排第 n 位"""
+        return self.controller.position(self)
+
+    def estimated_wait(self):
+        return self.controller.estimated_wait(self)
+
+    def wait(self, timeout=None):
+        return self.controller.wait(self, timeout)
+
+    def release(self):
+        self.controller.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency=1, max_queue=16, ewma_alpha=0.2, initial_service_s=2.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.ewma_alpha = ewma_alpha
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._running = 0
+        self._ids = itertools.count(1)
+
+        self._service_s = initial_service_s  # 单次推理耗时的 EWMA
+        self._wait_s = 0.0                   # 排队耗时的 EWMA
+        self._max_wait_s = 0.0
+        self._admitted = 0
+        self._rejected = 0
+        self._completed = 0
+
+    # ---------- 排队 ----------
+    def enqueue(self):
+        """申请推理名额：有空位立即获准，否则排队；队列已满抛 ServerBusy"""
+        with self._cond:
+            ticket = Ticket(self, next(self._ids))
+            if self._running < self.max_concurrency and not self._queue:
+                self._admit(ticket)
+            elif len(self._queue) >= self.max_queue:
+                self._rejected += 1
+                raise ServerBusy(f"当前排队人数已满 ({self.max_queue} 人)，请稍后重试")
+            else:
+                self._queue.append(ticket)
+            return ticket
+
+    def _admit(self, ticket):
+        ticket.admitted_at = time.monotonic()
+        waited = ticket.admitted_at - ticket.enqueued_at
+        self._running += 1
+        self._admitted += 1
+        self._wait_s += self.ewma_alpha * (waited - self._wait_s)
+        self._max_wait_s = max(self._max_wait_s, waited)
+
+    def _admit_waiting(self):
+        while self._queue and self._running < self.max_concurrency:
+            self._admit(self._queue.popleft())
+        self._cond.notify_all()
+
+    def wait(self, ticket, timeout=None):
+        """阻塞到获准或超时，返回是否已获准"""
+        with self._cond:
+            return self._cond.wait_for(lambda: ticket.admitted, timeout)
+
+    def release(self, ticket):
+        """推理结束 (或放弃排队) 时调用，可重复调用"""
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.admitted:
+                self._running -= 1
+                self._completed += 1
+                self._service_s += self.ewma_alpha * (time.monotonic() - ticket.admitted_at - self._service_s)
+            else:
+                self._queue.remove(ticket)
+            self._admit_waiting()
+
+    @contextmanager
+    def admit(self, timeout=None):
+        """排队 + 等待 + 用完释放；等待超时抛 ServerBusy"""
+        ticket = self.enqueue()
+        try:
+            if not ticket.wait(timeout):
+                raise ServerBusy(f"排队超过 {timeout:.0f} 秒，请稍后重试")
+            yield ticket
+        finally:
+            ticket.release()
+
+    # ---------- 查询 ----------
+    def position(self, ticket):
+        with self._cond:
+            if ticket.admitted or ticket.released:
+                return 0
+            return self._queue.index(ticket) + 1
+
+    def estimated_wait(self, ticket):
+        """预计还要等待的秒数：前面每轮放行 max_concurrency 人，每轮按平均推理耗时计"""
+        position = self.position(ticket)
+        if position == 0:
+            return 0.0
+        return math.ceil(position / self.max_concurrency) * self._service_s
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": len(self._queue),
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "avg_service_ms": self._service_s * 1000,
+                "avg_wait_ms": self._wait_s * 1000,
+                "max_wait_ms": self._max_wait_s * 1000,
+            }
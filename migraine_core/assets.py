@@ -0,0 +1,109 @@
+# migraine_core/assets.py
+# 作用：从 models/ 加载 LCA 参数与两个 TabPFN 模型 (不依赖 Streamlit)，并做清单/一致性校验与预热
+
+import os
+# 必须在 import torch 之前设置！
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+os.environ["USE_CUDA"] = "FALSE"
+from collections import namedtuple
+from functools import partial
+import joblib
+import numpy as np
+import asset_manifest
+import questionnaire_schema as qs
+from migraine_core.cache import DEFAULT_CACHE
+from migraine_core.weights import share_backbone_weights, rss_bytes
+from migraine_core.lca import latest_params_path
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+
+# 字段顺序与旧版 load_cached_resources() 的返回值一致，可以直接按元组解包
+ModelAssets = namedtuple(
+    "ModelAssets", ["lca_assets", "model_48h", "model_longterm", "feat_cols_48h", "feat_cols_longterm"])
+
+
+def load_model_file(path):
+    """joblib 加载；涉及 torch 的模型一律映射到 CPU"""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model file missing: {path}")
+    import torch
+
+    # 魔法：临时重定向 torch.load，强制它使用 map_location='cpu'
+    # 这样无论模型之前是在哪保存的，加载时都会被踢到 CPU
+    original_load = torch.load
+    torch.load = partial(original_load, map_location='cpu')
+    try:
+        return joblib.load(path)
+    finally:
+        # 任务完成后还原 torch.load，避免影响其他逻辑
+        torch.load = original_load
+
+
+def load_assets(model_dir=MODEL_DIR, warmup=True, share_weights=True):
+    """加载全部模型资产，返回 ModelAssets；资产缺失或互相不一致时抛 RuntimeError"""
+    print("[System] 开始加载模型资源...")
+    import torch
+
+    # 先做廉价的清单校验 (只看文件是否存在、大小是否一致)，有问题在加载大模型之前就失败
+    manifest = asset_manifest.load_manifest(model_dir)
+    if manifest is None:
+        print("[System] 未找到 manifest.json，跳过资产校验 (请重新运行 export_assets_local.py 生成)")
+    else:
+        problems = asset_manifest.verify_files(model_dir, manifest)
+        if problems:
+            raise RuntimeError("模型资产与 manifest.json 不一致:\n" + "\n".join(problems))
+
+    # LCA 参数优先使用在线更新写出的最新版本
+    _, lca_path = latest_params_path(model_dir)
+    lca_assets = load_model_file(lca_path)
+    model_48h = load_model_file(os.path.join(model_dir, "tabpfn_48h_only.pkl"))
+    model_longterm = load_model_file(os.path.join(model_dir, "tabpfn_longterm.pkl"))
+
+    # 强制告诉 TabPFN 实例不要去管显卡，哪怕它内部代码想去检测
+    for m in [model_48h, model_longterm]:
+        if hasattr(m, 'device'):
+            m.device = torch.device('cpu')
+        if hasattr(m, 'to'):
+            m.to('cpu')
+
+    # 两个模型的预训练底座权重相同时只保留一份 (长期模型指向 48h 模型的张量)
+    if share_weights:
+        rss_before = rss_bytes()
+        report = share_backbone_weights(model_48h, model_longterm)
+        if report["tensors_shared"]:
+            rss_after = rss_bytes()
+            rss_text = f"，进程内存 {rss_before / 2**20:.0f}MB -> {rss_after / 2**20:.0f}MB" if rss_before and rss_after else ""
+            print(f"[System] 共享底座权重：{report['modules_shared']} 个模块 / {report['tensors_shared']} 个张量，"
+                  f"权重占用 {report['bytes_before'] / 2**20:.1f}MB -> {report['bytes_after'] / 2**20:.1f}MB{rss_text}")
+
+    # 特征列已由 questionnaire_schema 在 import 时编译好，这里直接复用同一份
+    feat_cols_48h = qs.LAYOUT_48H.feat_cols
+    feat_cols_longterm = qs.LAYOUT_LONGTERM.feat_cols
+
+    # 资产之间的结构一致性：特征列数 vs 模型输入宽度，LCA 类别数 vs LCA_class_prob_* 列
+    problems = asset_manifest.check_consistency(
+        lca_assets,
+        {"tabpfn_48h_only.pkl": model_48h, "tabpfn_longterm.pkl": model_longterm},
+        {"tabpfn_48h_only.pkl": feat_cols_48h, "tabpfn_longterm.pkl": feat_cols_longterm},
+    )
+    if problems:
+        raise RuntimeError("模型资产之间不一致:\n" + "\n".join(problems))
+
+    if warmup:
+        # 第一次 predict 时 TabPFN 会检测本地有没有底座 .ckpt 文件，没有就自动下载；
+        # 放在加载阶段做一次“假预测”，之后的真实请求不再承担这部分延迟
+        print("[System] 正在预热 TabPFN (触发自动下载)...")
+        try:
+            model_48h.predict(np.zeros((1, len(feat_cols_48h))))
+            print("[System] TabPFN 预热完成。")
+        except Exception as e:
+            print(f"[System] 预热过程出现非致命警告 (通常可忽略): {e}")
+
+    return ModelAssets(lca_assets, model_48h, model_longterm, feat_cols_48h, feat_cols_longterm)
+
+
+def get_assets(model_dir=MODEL_DIR, cache=None, warmup=True, share_weights=True):
+    """经由缓存取得模型资产：同一个缓存、同一个模型目录只加载一次"""
+    cache = DEFAULT_CACHE if cache is None else cache
+    key = ("assets", os.path.abspath(model_dir))
+    return cache.get_or_create(key, partial(load_assets, model_dir, warmup, share_weights))
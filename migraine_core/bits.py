@@ -0,0 +1,35 @@
+# migraine_core/bits.py
+# 作用：二值作答的位向量工具 (纯 NumPy)，反作弊的近似重复检测与相似患者检索共用：
+#   pack_rows      : N×D 布尔矩阵 -> N×W uint64 位向量 (每题 1 bit)
+#   popcount       : uint64 数组逐元素数 1 的个数
+#   hamming_matrix : 两组位向量两两之间的汉明距离
+
+import numpy as np
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def n_words(n_bits):
+    return (n_bits + 63) // 64
+
+
+def pack_rows(positive, words=None):
+    """N×D 布尔矩阵 -> N×W uint64 位向量 (W 默认按 D 计算，不足 64 位的部分补 0)"""
+    positive = np.asarray(positive, dtype=bool)
+    words = n_words(positive.shape[1]) if words is None else words
+    packed = np.packbits(positive, axis=1)
+    padded = np.zeros((len(positive), words * 8), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return padded.view(np.uint64)
+
+
+def popcount(words):
+    """uint64 数组逐元素 popcount (NumPy >= 2.0 用 bitwise_count，否则查表)"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    return _POPCOUNT8[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1)
+
+
+def hamming_matrix(a, b):
+    """a: N×W, b: M×W (uint64 位向量) -> N×M 汉明距离"""
+    return popcount(a[:, None, :] ^ b[None, :, :]).sum(axis=2, dtype=np.int32)
@@ -0,0 +1,90 @@
+# migraine_core/cache.py
+# 作用：可插拔的资源缓存。核心层只依赖 get_or_create(key, factory) 这一个接口，
+# 默认用进程内缓存；Streamlit 端由 logic_processor 换成基于 st.cache_resource 的实现。
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class ProcessCache:
+    """进程内缓存：同一个 key 只构建一次，并发调用方等待同一次构建"""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get_or_create(self, key, factory):
+        if key in self._items:
+            return self._items[key]
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._items:
+                self._items[key] = factory()
+            return self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._key_locks.clear()
+
+
+class TTLCache:
+    """带过期时间与容量上限的进程内缓存 (数据库查询结果用)：过期或被 invalidate 的 key 下次重新构建，
+    超出容量时淘汰最久未使用的 key。factory 抛出的异常不缓存"""
+
+    def __init__(self, ttl=600.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items = OrderedDict()  # key -> (过期时刻, 值)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_create(self, key, factory):
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] > now:
+                self._items.move_to_end(key)
+                self._hits += 1
+                return item[1]
+            self._misses += 1
+        # 构建放在锁外 (通常是一次网络请求)；同一 key 并发未命中时可能各查一次，结果相同
+        value = factory()
+        self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "hits": self._hits, "misses": self._misses}
+
+
+class NoCache:
+    """不缓存：每次都重新构建 (测试或一次性脚本用)"""
+
+    def get_or_create(self, key, factory):
+        return factory()
+
+    def clear(self):
+        pass
+
+
+DEFAULT_CACHE = ProcessCache()
@@ -0,0 +1,165 @@
+# migraine_core/cascade.py
+# 作用：级联推理。界面只用分数在三个符合度等级之间做选择 (拉伸后 >0.6 / >0.35 / 其余)，
+# 离等级边界很远的提交不必每次都跑 TabPFN。
+# 廉价模型 (岭回归，输入与 TabPFN 相同的特征向量，其中已含 LCA 后验) 先给出分数和 split-conformal 区间；
+# 区间拉伸后落在同一个等级内就直接采用，跨过等级阈值才升级到 TabPFN。
+# 廉价模型由 export_assets_local.py 以 TabPFN 的输出为目标蒸馏得到 (models/cascade_*.pkl)。
+# 未升级的请求按 shadow_rate 抽检 (同时跑 TabPFN)，用来估计廉价模型与 TabPFN 的等级不一致率。
+
+import os
+import math
+import threading
+from collections import namedtuple
+import joblib
+import numpy as np
+from migraine_core.scoring import stretch_probs, CONCORDANCE_LEVELS
+
+# has_history -> 廉价模型文件名
+CASCADE_FILES = {False: "cascade_48h.pkl", True: "cascade_longterm.pkl"}
+
+# 等级阈值 (拉伸后的概率)，与 concordance_level 一致：严格大于阈值才进入更高等级
+BAND_THRESHOLDS = np.array(sorted(lower for lower, _, _ in CONCORDANCE_LEVELS if np.isfinite(lower)))
+
+
+def band_index(raw_score):
+    """原始分数 -> 等级编号 (0 = 低相关，越大越相关)"""
+    return np.searchsorted(BAND_THRESHOLDS, stretch_probs(raw_score), side="left")
+
+
+def needs_escalation(lo, hi):
+    """区间两端落在不同等级 (区间跨过了阈值) 时需要升级"""
+    return band_index(lo) != band_index(hi)
+
+
+# ===== 训练 (export_assets_local.py 调用) =====
+def _ridge(X, y, alpha):
+    """带截距的岭回归闭式解，截距不参与惩罚"""
+    x_mean, y_mean = X.mean(axis=0), y.mean()
+    Xc = X - x_mean
+    coef = np.linalg.solve(Xc.T @ Xc + alpha * np.eye(X.shape[1]), Xc.T @ (y - y_mean))
+    return coef, float(y_mean - x_mean @ coef)
+
+
+def fit_surrogate(X, y, alpha=1.0, coverage=0.95, calib_frac=0.25, random_state=0):
+    """X: N×F 特征矩阵，y: TabPFN 在同一批行上的输出。
+    拟合集上训练岭回归，校准集上取绝对残差的 conformal 分位数作为区间半宽；返回可 pickle 的参数字典"""
+    X = np.asarray(X, dtype=np.float64)
+    y = np.clip(np.asarray(y, dtype=np.float64), 0, 1)
+    order = np.random.default_rng(random_state).permutation(len(X))
+    n_calib = max(1, int(len(X) * calib_frac))
+    calib, fit = order[:n_calib], order[n_calib:]
+
+    coef, intercept = _ridge(X[fit], y[fit], alpha)
+    est = np.clip(X[calib] @ coef + intercept, 0, 1)
+    resid = np.sort(np.abs(y[calib] - est))
+    # 有限样本修正：取第 ceil((n+1)·coverage) 小的残差
+    q = float(resid[min(n_calib, math.ceil((n_calib + 1) * coverage)) - 1])
+
+    # 校准集上的诊断：升级比例，以及未升级行中与 TabPFN 等级不一致的比例
+    escalate = needs_escalation(np.clip(est - q, 0, 1), np.clip(est + q, 0, 1))
+    kept = ~escalate
+    disagree = (band_index(est[kept]) != band_index(y[calib][kept])).mean() if kept.any() else 0.0
+    return {
+        "coef": coef.astype(np.float32),
+        "intercept": intercept,
+        "q": q,
+        "coverage": coverage,
+        "alpha": alpha,
+        "n_features": X.shape[1],
+        "n_fit": len(fit),
+        "n_calib": n_calib,
+        "calib_escalation_rate": float(escalate.mean()),
+        "calib_disagreement_rate": float(disagree),
+    }
+
+
+# ===== 推理 =====
+class Surrogate:
+    """廉价模型：线性打分 + 固定半宽的 conformal 区间"""
+
+    def __init__(self, params):
+        self.params = params
+        self.coef = np.asarray(params["coef"], dtype=np.float64)
+        self.intercept = params["intercept"]
+        self.q = params["q"]
+        self.n_features = params["n_features"]
+
+    def predict_interval(self, X):
+        """返回 (分数, 区间下界, 区间上界)，均截断到 [0, 1]"""
+        est = np.asarray(X, dtype=np.float64) @ self.coef + self.intercept
+        return np.clip(est, 0, 1), np.clip(est - self.q, 0, 1), np.clip(est + self.q, 0, 1)
+
+
+# estimate: 廉价模型分数；escalate: 区间跨阈值需要升级的行；shadow: 未升级但被抽检的行
+Screen = namedtuple("Screen", ["estimate", "escalate", "shadow"])
+
+
+class Cascade:
+    """按模型 (has_history) 持有廉价模型，负责分流与指标统计；线程安全"""
+
+    def __init__(self, surrogates, shadow_rate=0.05, random_state=None):
+        self.surrogates = dict(surrogates)
+        self.shadow_rate = shadow_rate
+        self._rng = np.random.default_rng(random_state)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._escalated = 0
+        self._shadow_checked = 0
+        self._disagreements = 0
+
+    @classmethod
+    def from_model_dir(cls, model_dir, layouts, **kwargs):
+        """加载 models/cascade_*.pkl；layouts: {has_history: FeatureLayout}，用于校验输入宽度。
+        一个可用的廉价模型都没有时返回 None"""
+        surrogates = {}
+        for has_history, name in CASCADE_FILES.items():
+            path = os.path.join(model_dir, name)
+            if not os.path.exists(path):
+                continue
+            surrogate = Surrogate(joblib.load(path))
+            if surrogate.n_features != len(layouts[has_history]):
+                print(f"[System] 忽略 {name}: 输入宽度 {surrogate.n_features} 与特征列数 {len(layouts[has_history])} 不一致")
+                continue
+            surrogates[has_history] = surrogate
+        if not surrogates:
+            print("[System] 未找到可用的级联廉价模型，全部请求使用 TabPFN")
+            return None
+        print(f"[System] 级联推理已启用：{', '.join(CASCADE_FILES[h] for h in surrogates)}")
+        return cls(surrogates, **kwargs)
+
+    def screen(self, X, has_history):
+        """对同一模型的 N 行做分流；该模型没有廉价模型时返回 None (全部走 TabPFN)"""
+        surrogate = self.surrogates.get(bool(has_history))
+        if surrogate is None:
+            return None
+        est, lo, hi = surrogate.predict_interval(X)
+        escalate = needs_escalation(lo, hi)
+        with self._lock:
+            shadow = ~escalate & (self._rng.random(len(est)) < self.shadow_rate)
+        return Screen(est, escalate, shadow)
+
+    def record(self, screen, model_score=None):
+        """记录一次分流结果；model_score 为 TabPFN 分数 (与 screen 等长，未跑的行为 NaN)"""
+        n_disagree = 0
+        if screen.shadow.any() and model_score is not None:
+            rows = screen.shadow
+            n_disagree = int((band_index(screen.estimate[rows]) != band_index(model_score[rows])).sum())
+        with self._lock:
+            self._requests += len(screen.estimate)
+            self._escalated += int(screen.escalate.sum())
+            self._shadow_checked += int(screen.shadow.sum())
+            self._disagreements += n_disagree
+
+    def stats(self):
+        with self._lock:
+            return {
+                "models": [CASCADE_FILES[h] for h in self.surrogates],
+                "requests": self._requests,
+                "escalated": self._escalated,
+                "escalation_rate": self._escalated / max(self._requests, 1),
+                "shadow_rate": self.shadow_rate,
+                "shadow_checked": self._shadow_checked,
+                "disagreements": self._disagreements,
+                # 抽检样本中廉价模型与 TabPFN 落在不同等级的比例 (未升级请求的误判率估计)
+                "disagreement_rate": self._disagreements / max(self._shadow_checked, 1),
+            }
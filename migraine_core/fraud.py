@@ -0,0 +1,189 @@
+# migraine_core/fraud.py
+# 作用：反作弊检测 (纯 NumPy，按批处理)。
+# 输入为 N×D 作答矩阵 (列顺序 = 48h 问卷 schema.keys，NaN 表示未作答)，一次计算所有行的全部规则；
+# 近似重复检测把作答压成位向量 (每题 1 bit)，与一个容量有限的近期提交环形索引比较汉明距离。
+
+import threading
+from collections import namedtuple
+import numpy as np
+import questionnaire_schema as qs
+from migraine_core.bits import n_words, pack_rows, hamming_matrix
+
+# 规则名 -> 提示文案；同时命中多条时按这里的顺序取第一条作为原因
+RULE_MESSAGES = {
+    "empty": "数据为空",
+    "low_variance": "检测到所有选项填写一致，请认真填写。",
+    "high_mean": "检测到症状勾选比例异常过高(>95%)，请确认。",
+    "straight_line": "检测到多个章节内的题目作答完全相同，请确认。",
+    "gender_conflict": "性别为男性，但填写了女性生理周期相关题目。",
+    "menstrual_conflict": "“月经性偏头痛”与“非月经性偏头痛”两题都勾选了“是”，请确认。",
+    "near_duplicate": "与近期的另一份提交几乎完全相同。",
+}
+# 默认拦截的规则；近似重复只做标记 (同一用户保存失败后重新提交是正常情况)，
+# 章节内直线作答也只做标记 (症状明显的用户整节勾选“是”很常见，尚未用真实提交校验过阈值)，
+# 月经两题同时为“是”也只做标记 (见 MENSTRUAL_PAIR)
+DEFAULT_BLOCKING_RULES = ("empty", "low_variance", "high_mean", "gender_conflict")
+
+# 月经性 / 非月经性偏头痛两题：题面实际都在问“现在是否处于生理期”，
+# 用户不确定自己属于哪类时两题都答“是”是合理的，尚未用真实提交确认它代表作答异常
+MENSTRUAL_PAIR = ("如果您是“月经性偏头痛”，请填写  月经期和月经期附近 是否头痛_48h",
+                  "如果您不是“月经性偏头痛”，请填写  月经期和月经期附近 是否头痛(无月经者不填)_48h")
+
+DUPLICATE_BLOCK_ROWS = 256  # 近似重复比较时每块的行数，控制 N×M 中间结果的内存
+
+
+FraudResult = namedtuple("FraudResult", ["is_fraud", "reasons", "flags"])
+
+
+def answer_stats(V):
+    """逐行统计 (忽略 NaN)：返回 (作答数, 均值, 方差)"""
+    V = np.asarray(V, dtype=np.float64)
+    answered = ~np.isnan(V)
+    n = answered.sum(axis=1)
+    safe_n = np.maximum(n, 1)
+    mean = np.where(answered, V, 0.0).sum(axis=1) / safe_n
+    var = np.where(answered, (V - mean[:, None]) ** 2, 0.0).sum(axis=1) / safe_n
+    return n, mean, var
+
+
+def anti_fraud_matrix(V):
+    """原有三条规则的批量版 (与 MigrainePredictor.anti_fraud_check 一致)
+    V: N×D 作答矩阵 (NaN 不计入)；返回 (is_fraud 布尔数组, 原因列表)"""
+    n, mean, var = answer_stats(V)
+    reasons = np.full(len(n), None, dtype=object)
+    # 按单条检测的判断顺序倒序赋值，同时命中多条规则时保留排在前面的原因
+    reasons[mean > 0.95] = RULE_MESSAGES["high_mean"]
+    reasons[var < 0.01] = RULE_MESSAGES["low_variance"]
+    reasons[n == 0] = RULE_MESSAGES["empty"]
+    is_fraud = (n == 0) | (var < 0.01) | (mean > 0.95)
+    return is_fraud, list(reasons)
+
+
+class FraudEngine:
+    """48h 问卷的反作弊引擎：check_matrix 批量检测，check 单条检测；近期提交索引线程安全"""
+
+    def __init__(self, schema=qs.SCHEMA_48H, index_capacity=5000, duplicate_distance=1,
+                 duplicate_min_positive=5, straight_line_sections=3, straight_line_min_questions=3,
+                 blocking_rules=DEFAULT_BLOCKING_RULES):
+        self.keys = list(schema.keys)
+        self.col = {k: i for i, k in enumerate(self.keys)}
+        self.female_only = np.array([schema.by_key[k].female_only for k in self.keys])
+        # 参与“章节内直线作答”判断的章节 (女性专属章节不计，题目太少的章节不计)
+        self.section_cols = [np.array([self.col[q.key] for q in s.questions])
+                             for s in schema.sections
+                             if len(s.questions) >= straight_line_min_questions
+                             and not any(q.female_only for q in s.questions)]
+        self.menstrual_cols = tuple(self.col[k] for k in MENSTRUAL_PAIR if k in self.col)
+        self.straight_line_sections = straight_line_sections
+        self.duplicate_distance = duplicate_distance
+        self.duplicate_min_positive = duplicate_min_positive
+        self.blocking_rules = tuple(blocking_rules)
+
+        # 近期提交索引：环形缓冲区，每行是打包后的位向量
+        self.index_capacity = index_capacity
+        self._n_words = n_words(len(self.keys))
+        self._index = np.zeros((index_capacity, self._n_words), dtype=np.uint64)
+        self._index_size = 0
+        self._index_pos = 0
+        self._lock = threading.Lock()
+
+    # ---------- 编码 ----------
+    def to_matrix(self, answers_list):
+        """作答字典列表 -> N×D 矩阵 (列顺序 = self.keys)"""
+        return np.array([[a.get(k, np.nan) for k in self.keys] for a in answers_list], dtype=np.float64)
+
+    def _positive_bits(self, V, hidden):
+        """勾选“是”的题目 -> 打包成 uint64 位向量 (每行 W 个字)"""
+        positive = (np.nan_to_num(V, nan=0.0) > 0.5) & ~hidden
+        return positive, pack_rows(positive, self._n_words)
+
+    # ---------- 检测 ----------
+    def check_matrix(self, V, genders=None, remember=False):
+        """批量检测。V: N×D (列顺序 = self.keys)；genders: 长度 N 的性别数组 (默认全部按女性)"""
+        V = np.asarray(V, dtype=np.float64)
+        N = len(V)
+        male = np.zeros(N, dtype=bool) if genders is None else (np.asarray(genders) == "男")
+        hidden = male[:, None] & self.female_only[None, :]
+        answered = ~np.isnan(V) & ~hidden
+
+        # 基础统计：与网页端一致，可见但未作答的题目按 0 计入，男性看不到的题目不计入
+        n, mean, var = answer_stats(np.where(hidden, np.nan, np.nan_to_num(V, nan=0.0)))
+        positive, bits = self._positive_bits(V, hidden)
+
+        flags = {
+            "empty": answered.sum(axis=1) == 0,
+            "low_variance": (var < 0.01) & (n > 0),
+            "high_mean": mean > 0.95,
+            "straight_line": self._straight_line(V),
+            "gender_conflict": male & (np.nan_to_num(V[:, self.female_only], nan=0.0) > 0.5).any(axis=1),
+            "menstrual_conflict": (np.all(V[:, list(self.menstrual_cols)] > 0.5, axis=1)
+                                   if len(self.menstrual_cols) == 2 else np.zeros(N, dtype=bool)),
+            "near_duplicate": self._near_duplicate(bits, positive.sum(axis=1)),
+        }
+        if remember:
+            self.remember_bits(bits[positive.sum(axis=1) >= self.duplicate_min_positive])
+
+        is_fraud = np.zeros(N, dtype=bool)
+        for rule in self.blocking_rules:
+            is_fraud |= flags[rule]
+        reasons = [None] * N
+        for rule in RULE_MESSAGES:
+            for i in np.flatnonzero(flags[rule]):
+                if reasons[i] is None and (rule in self.blocking_rules or not is_fraud[i]):
+                    reasons[i] = RULE_MESSAGES[rule]
+        return FraudResult(is_fraud, reasons, flags)
+
+    def check(self, answers, gender="女", remember=False):
+        """单条检测，返回 (is_fraud, reason)；只命中非拦截规则时 is_fraud 为 False 但 reason 非空"""
+        res = self.check_matrix(self.to_matrix([answers]), [gender], remember=remember)
+        return bool(res.is_fraud[0]), res.reasons[0]
+
+    def _straight_line(self, V):
+        """章节内直线作答：一节的题目全部作答且答案完全相同 (全“是”或全“否”)，
+        达到 straight_line_sections 节时标记"""
+        if not self.section_cols:
+            return np.zeros(len(V), dtype=bool)
+        # 有未作答题目时 max / min 为 NaN，比较结果为 False
+        same = np.stack([V[:, cols].max(axis=1) == V[:, cols].min(axis=1) for cols in self.section_cols], axis=1)
+        return same.sum(axis=1) >= min(self.straight_line_sections, len(self.section_cols))
+
+    def _near_duplicate(self, bits, n_positive):
+        """与索引中的近期提交、以及同一批中更早的行比较汉明距离"""
+        eligible = n_positive >= self.duplicate_min_positive
+        dup = np.zeros(len(bits), dtype=bool)
+        if not eligible.any():
+            return dup
+        with self._lock:
+            index = self._index[:self._index_size].copy()
+        rows = np.flatnonzero(eligible)
+        cand = bits[rows]
+        for start in range(0, len(rows), DUPLICATE_BLOCK_ROWS):
+            block = cand[start:start + DUPLICATE_BLOCK_ROWS]
+            hit = np.zeros(len(block), dtype=bool)
+            if len(index):
+                hit |= (hamming_matrix(block, index) <= self.duplicate_distance).any(axis=1)
+            # 同一批中更早的 (同样满足条件的) 行
+            earlier = cand[:start + len(block)]
+            close = hamming_matrix(block, earlier) <= self.duplicate_distance
+            hit |= np.tril(close, k=start - 1).any(axis=1)
+            dup[rows[start:start + len(block)]] = hit
+        return dup
+
+    # ---------- 索引 ----------
+    def remember_bits(self, bits):
+        with self._lock:
+            for row in bits[-self.index_capacity:]:
+                self._index[self._index_pos] = row
+                self._index_pos = (self._index_pos + 1) % self.index_capacity
+                self._index_size = min(self._index_size + 1, self.index_capacity)
+
+    def remember(self, V, genders=None):
+        V = np.asarray(V, dtype=np.float64)
+        male = np.zeros(len(V), dtype=bool) if genders is None else (np.asarray(genders) == "男")
+        positive, bits = self._positive_bits(V, male[:, None] & self.female_only[None, :])
+        self.remember_bits(bits[positive.sum(axis=1) >= self.duplicate_min_positive])
+
+    def clear_index(self):
+        with self._lock:
+            self._index_size = 0
+            self._index_pos = 0
@@ -0,0 +1,35 @@
+# migraine_core/lca.py
+# 作用：LCA (潜在类别分析) 的推理部分，预测端、相似患者检索与离线脚本共用：
+#   lca_posterior      : 批量 E-step，作答矩阵 -> 类别后验
+#   latest_params_path : 模型目录中最新版本的 LCA 参数文件 (lca_online.py 写出的 lca_params.vNNNN.pkl)
+
+import os
+import re
+import glob
+import numpy as np
+
+BASE_PARAMS_NAME = "lca_params.pkl"
+VERSIONED_PARAMS_FMT = "lca_params.v{:04d}.pkl"
+_VERSION_RE = re.compile(r"lca_params\.v(\d+)\.pkl$")
+
+
+def lca_posterior(X, pi, theta):
+    """批量 E-step：返回 N×K 的类别后验 γ (矩阵乘法实现，不构造三维张量)"""
+    X = np.asarray(X, dtype=np.float64)
+    log_theta = np.log(theta + 1e-12)
+    log_1_minus_theta = np.log(1 - theta + 1e-12)
+    log_joint = X @ (log_theta - log_1_minus_theta).T + log_1_minus_theta.sum(axis=1)[None, :]
+    log_joint += np.log(pi + 1e-12)[None, :]
+    max_log = np.max(log_joint, axis=1, keepdims=True)
+    log_sum_exp = max_log + np.log(np.sum(np.exp(log_joint - max_log), axis=1, keepdims=True))
+    return np.exp(log_joint - log_sum_exp)
+
+
+def latest_params_path(model_dir):
+    """返回 (版本号, 路径)：优先最新的 lca_params.vNNNN.pkl，没有则回退到 lca_params.pkl"""
+    best = (0, os.path.join(model_dir, BASE_PARAMS_NAME))
+    for path in glob.glob(os.path.join(model_dir, "lca_params.v*.pkl")):
+        m = _VERSION_RE.search(os.path.basename(path))
+        if m and int(m.group(1)) > best[0]:
+            best = (int(m.group(1)), path)
+    return best
@@ -0,0 +1,91 @@
+# migraine_core/pool.py
+# 作用：模型副本池。TabPFN / torch 模型对象在推理时会修改内部状态，多个会话同时调用同一个对象并不安全；
+# 这里把 (48h 模型, 长期模型) 作为一个副本，推理前 checkout、结束后 checkin，
+# 同一时刻每个副本只被一个线程使用。副本数决定并行度，取不到副本时最多等待 timeout 秒。
+
+import copy
+import time
+import queue
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+ModelReplica = namedtuple("ModelReplica", ["replica_id", "model_48h", "model_longterm"])
+
+
+class PoolTimeout(RuntimeError):
+    """在限定时间内没有空闲的模型副本"""
+
+
+class ModelPool:
+    def __init__(self, replicas, timeout=30.0):
+        if not replicas:
+            raise ValueError("模型副本池至少需要 1 个副本")
+        self.size = len(replicas)
+        self.timeout = timeout
+        self._free = queue.LifoQueue()  # 后进先出：低负载时总用同一个 (缓存最热的) 副本
+        for replica in replicas:
+            self._free.put(replica)
+
+        self._lock = threading.Lock()
+        self._created_at = time.monotonic()
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_s = 0.0
+        self._max_wait_s = 0.0
+        self._busy_s = 0.0
+
+    @classmethod
+    def from_models(cls, model_48h, model_longterm, size=1, timeout=30.0, clone=copy.deepcopy):
+        """副本 0 使用传入的模型本身，其余副本由 clone 复制"""
+        replicas = [ModelReplica(0, model_48h, model_longterm)]
+        for i in range(1, max(1, size)):
+            replicas.append(ModelReplica(i, clone(model_48h), clone(model_longterm)))
+        return cls(replicas, timeout)
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        t0 = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            replica = self._free.get(timeout=timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"{timeout:.0f}s 内没有空闲的模型副本 (共 {self.size} 个)") from None
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        t1 = time.monotonic()
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_s += t1 - t0
+            self._max_wait_s = max(self._max_wait_s, t1 - t0)
+        try:
+            yield replica
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self._busy_s += time.monotonic() - t1
+            self._free.put(replica)
+
+    def stats(self):
+        with self._lock:
+            uptime = max(time.monotonic() - self._created_at, 1e-9)
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": self._wait_s / max(self._checkouts, 1) * 1000,
+                "max_wait_ms": self._max_wait_s * 1000,
+                # 自启动以来副本处于使用中的时间占比
+                "utilization": self._busy_s / (self.size * uptime),
+            }
@@ -0,0 +1,264 @@
+# migraine_core/predictor.py
+# 作用：偏头痛前驱期预测器 (纯 Python，不依赖 Streamlit)。
+# 资产由调用方显式传入，或通过 from_model_dir() 经可插拔缓存加载。
+
+import os
+import time
+import threading
+import contextlib
+import joblib
+import numpy as np
+import questionnaire_schema as qs
+from migraine_core.assets import MODEL_DIR, get_assets
+from migraine_core.fraud import FraudEngine, anti_fraud_matrix
+from migraine_core.pool import ModelPool
+from migraine_core.admission import AdmissionController
+from migraine_core.cascade import Cascade
+from migraine_core.weights import clone_sharing_weights
+from migraine_core.lca import lca_posterior, latest_params_path
+
+# 每隔多少秒检查一次是否有 lca_online.py 写出的新版本 LCA 参数
+LCA_RELOAD_INTERVAL = 60
+
+# 模型副本数 (= 同时进行推理的请求数) 与取副本的最长等待时间，可用环境变量覆盖
+MODEL_POOL_SIZE = int(os.environ.get("MIGRAINE_MODEL_POOL_SIZE", "1"))
+MODEL_POOL_TIMEOUT = float(os.environ.get("MIGRAINE_MODEL_POOL_TIMEOUT", "30"))
+# 准入控制：同时推理的请求数 (默认等于副本数) 与等待队列上限
+MAX_CONCURRENCY = int(os.environ.get("MIGRAINE_MAX_CONCURRENCY", "0")) or None
+MAX_QUEUE = int(os.environ.get("MIGRAINE_MAX_QUEUE", "16"))
+# 级联推理：先用廉价模型打分，区间跨过等级阈值才跑 TabPFN (需要 export_assets_local.py 导出的 cascade_*.pkl)
+CASCADE_MODE = os.environ.get("MIGRAINE_CASCADE", "0") == "1"
+# 未升级的请求中同时跑 TabPFN 做抽检的比例 (用于统计不一致率)
+CASCADE_SHADOW_RATE = float(os.environ.get("MIGRAINE_CASCADE_SHADOW_RATE", "0.05"))
+
+
+def _fill_lca_features(layout, X, gamma, lca_class):
+    """把 LCA 概率与 One-Hot 写进特征矩阵对应的列 (X: N×F，原地修改)"""
+    for k, idx in layout.lca_prob_idx.items():
+        X[:, idx] = gamma[:, k]
+    for k, idx in layout.lca_onehot_idx.items():
+        X[:, idx] = lca_class == k
+    return X
+
+
+def attribution_sections(has_history=False, gender="女"):
+    """参与归因的章节：用户实际看到的 48h 章节，有病史时再加上长期问卷的章节"""
+    sections = list(qs.SCHEMA_48H.visible_sections(gender))
+    if has_history:
+        sections += list(qs.SCHEMA_LONGTERM.visible_sections(gender))
+    return sections
+
+
+def masked_variants(user_data, sections):
+    """[原始作答, 去掉第 1 节, 去掉第 2 节, ...]：被去掉的章节按未作答 (NaN) 处理"""
+    variants = [dict(user_data)]
+    for section in sections:
+        variant = dict(user_data)
+        variant.update({q.key: np.nan for q in section.questions})
+        variants.append(variant)
+    return variants
+
+
+class MigrainePredictor:
+    def __init__(self, assets, model_dir=MODEL_DIR, lca_reload_interval=LCA_RELOAD_INTERVAL,
+                 pool_size=MODEL_POOL_SIZE, pool_timeout=MODEL_POOL_TIMEOUT,
+                 max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE,
+                 cascade=CASCADE_MODE, cascade_shadow_rate=CASCADE_SHADOW_RATE):
+        (
+            self.lca_assets,
+            self.model_48h,
+            self.model_longterm,
+            self.feat_cols_48h,
+            self.feat_cols_longterm
+        ) = assets
+        self.model_dir = model_dir
+        self.lca_reload_interval = lca_reload_interval
+        self.layout_48h = qs.LAYOUT_48H
+        self.layout_longterm = qs.LAYOUT_LONGTERM
+        self.lca_version = self.lca_assets.get("version", 0)
+        self._lca_checked_at = time.monotonic()
+        self._lca_lock = threading.Lock()
+        self.fraud_engine = FraudEngine()
+        # 所有推理都经由副本池：副本 0 就是上面的 model_48h / model_longterm，
+        # 其余副本复制各自的上下文数据，但复用同一份 torch 权重
+        self.model_pool = ModelPool.from_models(self.model_48h, self.model_longterm, pool_size, pool_timeout,
+                                                clone=clone_sharing_weights)
+        # 交互式调用方 (网页) 在 predict 之前经由它排队，可查询排队位置与预计等待时间
+        self.admission = AdmissionController(max_concurrency or pool_size, max_queue)
+        # 级联模式关闭或没有廉价模型时为 None
+        self.cascade = (Cascade.from_model_dir(model_dir, {False: self.layout_48h, True: self.layout_longterm},
+                                               shadow_rate=cascade_shadow_rate) if cascade else None)
+
+    @classmethod
+    def from_model_dir(cls, model_dir=MODEL_DIR, cache=None, warmup=True, **kwargs):
+        return cls(get_assets(model_dir, cache=cache, warmup=warmup), model_dir=model_dir, **kwargs)
+
+    def _maybe_reload_lca(self):
+        """热加载 lca_online.py 写出的新版本 LCA 参数，无需重启服务"""
+        now = time.monotonic()
+        if now - self._lca_checked_at < self.lca_reload_interval or not self._lca_lock.acquire(blocking=False):
+            return
+        try:
+            self._lca_checked_at = now
+            version, path = latest_params_path(self.model_dir)
+            if version <= self.lca_version:
+                return
+            assets = joblib.load(path)
+            # 类别数和症状列必须与 TabPFN 训练时一致，否则 LCA_class_prob_* 特征无法对齐
+            if (assets.get("n_classes") != self.lca_assets.get("n_classes")
+                    or list(assets["symptom_cols"]) != list(self.lca_assets["symptom_cols"])):
+                print(f"[System] 忽略不兼容的 LCA 参数 v{version}: 类别数或症状列与当前模型不一致")
+                self.lca_version = version
+                return
+            self.lca_assets = assets
+            self.lca_version = version
+            print(f"[System] LCA 参数已热加载至 v{version}")
+        except Exception as e:
+            print(f"[System] LCA 参数热加载失败，继续使用 v{self.lca_version}: {e}")
+        finally:
+            self._lca_lock.release()
+
+    def anti_fraud_check(self, df_input):
+        """反作弊检测 (旧接口，只含基础三条规则): 返回 (is_fraud, reason)
+        新代码请用 self.fraud_engine.check(answers, gender)"""
+        vals = df_input.select_dtypes(include=[np.number]).to_numpy(dtype=np.float64).reshape(1, -1)
+        is_fraud, reasons = anti_fraud_matrix(vals)
+        return bool(is_fraud[0]), reasons[0]
+
+    def calculate_lca_posterior(self, user_data):
+        """LCA 在线推理 (user_data: 作答字典)"""
+        lca_assets = self.lca_assets  # 取一次快照，热加载时不会读到新旧混合的参数
+
+        # 按 symptom_cols 顺序取值，缺失补 0
+        x = np.array([user_data.get(c, np.nan) for c in lca_assets['symptom_cols']], dtype=np.float64)
+        x = np.nan_to_num(x, nan=0.0)
+
+        # EM Algorithm: E-step
+        gamma = lca_posterior(x[None, :], lca_assets['pi'], lca_assets['theta'])
+
+        return gamma[0]
+
+    def _score_variants(self, variants, has_history, admit=None):
+        """同一用户的若干份作答 (第 0 份为原始作答) 合并成一次推理。
+        返回 (raw_score 数组, LCA 后验 N×K, 分数来源)；级联模式下由第 0 份的区间决定整批走廉价模型还是 TabPFN。
+        admit: 可选，返回上下文管理器的函数 (如领取准入名额)，只在真正需要跑 TabPFN 时调用"""
+        self._maybe_reload_lca()
+        lca_assets = self.lca_assets  # 取一次快照，热加载时不会读到新旧混合的参数
+
+        # 1. 确定使用哪套特征布局
+        layout = self.layout_longterm if has_history else self.layout_48h
+
+        # 2. 作答 -> 特征矩阵 (缺失补 0，长期题同时写 missing mask)
+        x = np.stack([layout.encode(v) for v in variants])
+
+        # 3. LCA 推理 (按 symptom_cols 顺序取值，缺失补 0；EM 的 E-step)
+        S = np.array([[v.get(c, np.nan) for c in lca_assets['symptom_cols']] for v in variants], dtype=np.float64)
+        gamma = lca_posterior(np.nan_to_num(S, nan=0.0), lca_assets['pi'], lca_assets['theta'])
+
+        # 4. 注入 LCA 特征 (概率 + 特征列里需要的 One-Hot)
+        if any(k >= gamma.shape[1] for k in layout.lca_prob_idx):
+            raise ValueError(f"Feature mismatch, LCA 只有 {gamma.shape[1]} 个类别")
+        X = _fill_lca_features(layout, x, gamma, gamma.argmax(axis=1)).astype(np.float32)
+
+        # 5. 级联：原始作答的区间不跨等级阈值 (且未被抽检) 时整批使用廉价模型，不占用模型副本
+        screen = self.cascade.screen(X[:1], has_history) if self.cascade else None
+        if screen is not None and not (screen.escalate[0] or screen.shadow[0]):
+            self.cascade.record(screen)
+            return self.cascade.surrogates[bool(has_history)].predict_interval(X)[0], gamma, "cascade"
+
+        # 6. 推理 (先领取准入名额，再从副本池取一个空闲副本，超时抛 PoolTimeout)
+        with admit() if admit is not None else contextlib.nullcontext():
+            with self.model_pool.checkout() as replica:
+                model = replica.model_longterm if has_history else replica.model_48h
+
+                # 注意：TabPFN 可能返回 (N_samples,) 或 (N_samples, 1)
+                raw_score = np.asarray(model.predict(X), dtype=np.float64).reshape(len(X), -1)[:, 0]
+
+        raw_score = np.clip(raw_score, 0, 1)
+        if screen is not None:
+            self.cascade.record(screen, raw_score[:1])
+        return raw_score, gamma, "tabpfn"
+
+    def predict(self, user_data_dict, has_history=False, admit=None):
+        try:
+            raw_score, gamma, source = self._score_variants([user_data_dict], has_history, admit)
+        except ValueError as e:
+            return {"error": f"Internal Error: {e}"}
+
+        return {
+            "raw_score": raw_score[0],
+            "lca_probs": gamma[0],
+            "lca_class": np.argmax(gamma[0]),
+            "source": source
+        }
+
+    def predict_with_attribution(self, user_data_dict, has_history=False, gender="女", admit=None):
+        """predict + 章节归因：逐节把作答置为未作答后重新打分，所有扰动与原始作答在同一次批量推理中完成。
+        结果另含 attribution: {章节标题: 原始分数 - 去掉该节后的分数} (正值表示该节推高了分数)"""
+        sections = attribution_sections(has_history, gender)
+        try:
+            raw_score, gamma, source = self._score_variants(masked_variants(user_data_dict, sections), has_history,
+                                                            admit)
+        except ValueError as e:
+            return {"error": f"Internal Error: {e}"}
+
+        return {
+            "raw_score": raw_score[0],
+            "lca_probs": gamma[0],
+            "lca_class": np.argmax(gamma[0]),
+            "source": source,
+            "attribution": {s.title: float(raw_score[0] - raw_score[i + 1]) for i, s in enumerate(sections)}
+        }
+
+    def predict_batch(self, df, has_history):
+        """批量推理：df 的列为题目 key (数值，NaN 表示未作答)，has_history 为逐行布尔数组。
+        同一模型的行合并成一次 model.predict 调用；返回 raw_score / lca_probs / lca_class 三个数组"""
+        self._maybe_reload_lca()
+        lca_assets = self.lca_assets
+        has_history = np.asarray(has_history, dtype=bool)
+
+        # LCA：一次矩阵运算得到全部行的后验
+        S = df.reindex(columns=lca_assets['symptom_cols']).to_numpy(dtype=np.float64)
+        gamma = lca_posterior(np.nan_to_num(S, nan=0.0), lca_assets['pi'], lca_assets['theta'])
+        lca_class = gamma.argmax(axis=1)
+
+        # 先在池外拼好两个模型各自的特征矩阵，副本只在真正推理时占用
+        jobs = []
+        for flag, layout in ((False, self.layout_48h), (True, self.layout_longterm)):
+            rows = np.flatnonzero(has_history == flag)
+            if len(rows) == 0:
+                continue
+            if any(k >= gamma.shape[1] for k in layout.lca_prob_idx):
+                raise ValueError(f"Feature mismatch: LCA 只有 {gamma.shape[1]} 个类别")
+            X = _fill_lca_features(layout, layout.encode_frame(df.iloc[rows]), gamma[rows], lca_class[rows])
+            X = X.astype(np.float32)
+            # 级联：区间不跨等级阈值的行直接采用廉价模型分数，只把其余行交给 TabPFN
+            screen = self.cascade.screen(X, flag) if self.cascade else None
+            run = np.ones(len(rows), dtype=bool) if screen is None else (screen.escalate | screen.shadow)
+            jobs.append((flag, rows, X, screen, run))
+
+        raw_score = np.full(len(df), np.nan)
+        from_model = np.zeros(len(df), dtype=bool)
+        for flag, rows, X, screen, run in jobs:
+            if screen is not None:
+                raw_score[rows[~run]] = screen.estimate[~run]
+        if any(run.any() for *_, run in jobs):
+            with self.model_pool.checkout() as replica:
+                for flag, rows, X, screen, run in jobs:
+                    if not run.any():
+                        continue
+                    model = replica.model_longterm if flag else replica.model_48h
+                    score = np.asarray(model.predict(X[run]), dtype=np.float64).reshape(int(run.sum()), -1)[:, 0]
+                    raw_score[rows[run]] = score
+                    from_model[rows[run]] = True
+        raw_score = np.clip(raw_score, 0, 1)
+        for flag, rows, X, screen, run in jobs:
+            if screen is not None:
+                self.cascade.record(screen, raw_score[rows])
+
+        return {
+            "raw_score": raw_score,
+            "lca_probs": gamma,
+            "lca_class": lca_class,
+            "source": np.where(from_model, "tabpfn", "cascade"),
+        }
@@ -0,0 +1,167 @@
+# migraine_core/resilience.py
+# 作用：外部依赖 (云数据库) 调用的保护措施，与具体客户端无关：
+#   run_with_timeout : 在线程池中执行一次调用，调用方最多等待 timeout 秒
+#   CircuitBreaker   : 连续失败达到阈值后熔断，冷却期内直接拒绝；冷却结束放行一次试探，成功则恢复
+#   JsonlSpool       : 本地持久化队列 (JSONL，每条写入后 fsync)，依赖恢复后按批回放
+
+import os
+import json
+import time
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+
+
+class CircuitOpen(RuntimeError):
+    """熔断中，调用被直接拒绝"""
+
+
+class OperationTimeout(TimeoutError):
+    """调用超过了限定时间 (后台线程可能仍在等待底层请求返回)"""
+
+
+def run_with_timeout(executor, fn, timeout):
+    future = executor.submit(fn)
+    try:
+        return future.result(timeout)
+    except FutureTimeout:
+        future.cancel()
+        raise OperationTimeout(f"操作超过 {timeout:.1f}s 未完成") from None
+
+
+class CircuitBreaker:
+    """closed -> (连续失败 failure_threshold 次) -> open -> (reset_timeout 秒后) -> half_open -> 成功则 closed"""
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0, name="db"):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._trips = 0
+        self._rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if now - self._opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        """是否放行本次调用；half_open 时同一时刻只放行一个试探请求"""
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print(f"[System] {self.name} 熔断恢复")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+                if self._opened_at is None:
+                    self._trips += 1
+                    print(f"[System] {self.name} 连续失败 {self._failures} 次，熔断 {self.reset_timeout:.0f}s")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def call(self, fn, executor=None, timeout=None):
+        """经熔断器 (与可选的超时) 执行 fn；熔断中抛 CircuitOpen"""
+        if not self.allow():
+            raise CircuitOpen(f"{self.name} 暂时不可用 (熔断中)")
+        try:
+            result = fn() if executor is None else run_with_timeout(executor, fn, timeout)
+        except BaseException:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"state": self._state(time.monotonic()), "consecutive_failures": self._failures,
+                    "trips": self._trips, "rejected": self._rejected}
+
+
+class JsonlSpool:
+    """追加写的本地队列：append 一条写一行并 fsync；drain 按批交给 handler，成功的批次从文件中移除"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._read())
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # 写到一半被中断的行：丢弃
+                    print(f"[System] 跳过损坏的队列行: {line[:80]}")
+        return records
+
+    def _rewrite(self, records):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for r in records:
+                f.write(json.dumps(r, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def drain(self, handler, batch_size=100):
+        """按批回放；handler(batch) 抛异常时停止，未回放的记录保留。返回成功回放的条数。
+        回放期间不持锁 (新记录照常追加到文件末尾)，结束后只删除文件开头已回放的部分"""
+        with self._lock:
+            records = self._read()
+        done = 0
+        try:
+            while done < len(records):
+                batch = records[done:done + batch_size]
+                handler(batch)
+                done += len(batch)
+        finally:
+            if done:
+                with self._lock:
+                    rest = self._read()[done:]
+                    if rest:
+                        self._rewrite(rest)
+                    else:
+                        os.remove(self.path)
+        return done
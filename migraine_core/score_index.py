@@ -0,0 +1,99 @@
+# migraine_core/score_index.py
+# 作用：已评分记录的 PPC 分数索引，回答“这个分数在同组人群中排第几百分位”。
+# 按 (是否有病史, 性别) 分组，每组一个有序数组；新分数先进入小缓冲区，攒够一批再归并进有序数组，
+# 查询 = 有序数组上两次二分 + 扫一遍小缓冲区，不需要每次从数据库重新统计。
+# 索引只依赖 NumPy，数据来源 (数据库批量构建 / 每次保存时增量写入) 由调用方负责。
+
+import threading
+import numpy as np
+
+MERGE_THRESHOLD = 256    # 缓冲区攒够多少条归并一次
+MIN_GROUP_SIZE = 20      # 同组记录少于这个数时不给出百分位 (样本太少没有意义)
+
+
+def group_key(has_history, gender):
+    return bool(has_history), str(gender)
+
+
+class _Group:
+    __slots__ = ("sorted", "pending")
+
+    def __init__(self, scores=()):
+        self.sorted = np.sort(np.asarray(scores, dtype=np.float64))
+        self.pending = []
+
+    def merge(self):
+        if self.pending:
+            new = np.sort(np.asarray(self.pending, dtype=np.float64))
+            self.sorted = np.insert(self.sorted, np.searchsorted(self.sorted, new), new)
+            self.pending = []
+
+    def __len__(self):
+        return len(self.sorted) + len(self.pending)
+
+
+class ScoreIndex:
+    """分组有序分数索引；线程安全"""
+
+    def __init__(self, merge_threshold=MERGE_THRESHOLD, min_group_size=MIN_GROUP_SIZE):
+        self.merge_threshold = merge_threshold
+        self.min_group_size = min_group_size
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    # ---------- 写入 ----------
+    def build(self, scores, has_history, genders):
+        """批量构建 (三个等长序列)，与已有内容合并"""
+        scores = np.asarray(scores, dtype=np.float64)
+        has_history = np.asarray(has_history, dtype=bool)
+        genders = np.asarray(genders, dtype=object).astype(str)
+        valid = ~np.isnan(scores)
+        groups = {}
+        for flag in (False, True):
+            for gender in np.unique(genders):
+                rows = valid & (has_history == flag) & (genders == gender)
+                if rows.any():
+                    groups[group_key(flag, gender)] = scores[rows]
+        with self._lock:
+            for key, values in groups.items():
+                group = self._groups.get(key)
+                if group is None:
+                    self._groups[key] = _Group(values)
+                else:
+                    group.pending.extend(values.tolist())
+                    group.merge()
+
+    def add(self, score, has_history, gender):
+        """保存一条新记录后调用"""
+        if score is None or np.isnan(score):
+            return
+        with self._lock:
+            group = self._groups.setdefault(group_key(has_history, gender), _Group())
+            group.pending.append(float(score))
+            if len(group.pending) >= self.merge_threshold:
+                group.merge()
+
+    # ---------- 查询 ----------
+    def percentile(self, score, has_history, gender):
+        """score 在同组中的百分位 (0~100，并列取中位排名)；同组样本不足时返回 None"""
+        with self._lock:
+            group = self._groups.get(group_key(has_history, gender))
+            if group is None or len(group) < self.min_group_size:
+                return None
+            s = group.sorted
+            below = np.searchsorted(s, score, side="left")
+            equal = np.searchsorted(s, score, side="right") - below
+            for v in group.pending:
+                below += v < score
+                equal += v == score
+            return 100.0 * (below + 0.5 * equal) / len(group)
+
+    def group_size(self, has_history, gender):
+        with self._lock:
+            group = self._groups.get(group_key(has_history, gender))
+            return 0 if group is None else len(group)
+
+    def stats(self):
+        with self._lock:
+            return {f"{'history' if h else 'no_history'}/{g}": len(group)
+                    for (h, g), group in sorted(self._groups.items())}
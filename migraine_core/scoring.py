@@ -0,0 +1,33 @@
+# migraine_core/scoring.py
+# 作用：模型原始分数 -> 前驱期表型符合度 (PPC) 与等级文案，网页端与批量打分共用同一套阈值
+
+import numpy as np
+
+# 训练集 raw_score 的分位区间，拉伸到 [0.05, 0.95]
+STRETCH_Q_LOW, STRETCH_Q_HIGH = 0.23, 0.76
+
+# (下限, 等级, 说明)：从高到低匹配，prob 严格大于下限即命中
+CONCORDANCE_LEVELS = (
+    (0.6, "Highly Concordant (高度相关)", "您的当前生理指征与偏头痛前驱期模式呈现高度一致性。"),
+    (0.35, "Moderately Concordant (中度相关)", "检测到部分符合前驱期特征的生理信号。"),
+    (-np.inf, "Low Concordance (低相关)", "目前的指征未显示明显的前驱期模式特征。"),
+)
+
+
+def stretch_prob(p):
+    p_norm = (p - STRETCH_Q_LOW) / (STRETCH_Q_HIGH - STRETCH_Q_LOW)
+    return float(np.clip(0.05 + p_norm * 0.90, 0.05, 0.95))
+
+
+def stretch_probs(p):
+    """stretch_prob 的向量版"""
+    p_norm = (np.asarray(p, dtype=np.float64) - STRETCH_Q_LOW) / (STRETCH_Q_HIGH - STRETCH_Q_LOW)
+    return np.clip(0.05 + p_norm * 0.90, 0.05, 0.95)
+
+
+def concordance_level(prob):
+    """返回 (等级, 说明文案)"""
+    for lower, level_text, msg_text in CONCORDANCE_LEVELS:
+        if prob > lower:
+            return level_text, msg_text
+    return CONCORDANCE_LEVELS[-1][1:]
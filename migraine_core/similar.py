@@ -0,0 +1,130 @@
+# migraine_core/similar.py
+# 作用：相似患者检索。48h 问卷的症状全是二值题，每条记录打包成一个 uint64 位向量 (每题 1 bit)，
+# 与查询向量异或后 popcount 即为汉明距离；可按 LCA 类别分桶，只在同一潜在类别内检索。
+# 取前 k 个时不做全量排序：先对距离做直方图 (距离只有 0..题数 这几种取值) 找出第 k 近的距离，再取出候选。
+# 数据来源 (启动时批量构建、每次保存时增量写入) 由调用方负责。
+
+import threading
+import numpy as np
+import questionnaire_schema as qs
+from migraine_core.bits import n_words, pack_rows, popcount
+from migraine_core.lca import lca_posterior
+
+INITIAL_CAPACITY = 1024
+
+
+class _Bucket:
+    """一个分桶：位向量与风险等级编号，按容量倍增的数组 (追加为均摊 O(1))"""
+    __slots__ = ("bits", "levels", "size")
+
+    def __init__(self, n_words):
+        self.bits = np.zeros((INITIAL_CAPACITY, n_words), dtype=np.uint64)
+        self.levels = np.zeros(INITIAL_CAPACITY, dtype=np.int16)
+        self.size = 0
+
+    def extend(self, bits, levels):
+        need = self.size + len(bits)
+        if need > len(self.bits):
+            capacity = max(need, 2 * len(self.bits))
+            self.bits = np.resize(self.bits, (capacity, self.bits.shape[1]))
+            self.levels = np.resize(self.levels, capacity)
+        self.bits[self.size:need] = bits
+        self.levels[self.size:need] = levels
+        self.size = need
+
+
+class SymptomBitsetIndex:
+    """48h 症状位向量索引；线程安全。lca_assets 为 None 时不分桶"""
+
+    def __init__(self, lca_assets=None, schema=qs.SCHEMA_48H):
+        self.keys = list(schema.keys)
+        self.n_words = n_words(len(self.keys))
+        self.lca_assets = lca_assets
+        self._levels = []          # 风险等级文案 <-> 编号
+        self._level_code = {}
+        self._buckets = {}         # LCA 类别 (不分桶时为 None) -> _Bucket
+        self._lock = threading.Lock()
+
+    # ---------- 编码 ----------
+    def encode(self, answers_list):
+        """作答字典列表 -> (N×W uint64 位向量, LCA 类别数组或 None)；勾选“是”为 1，否 / 未作答为 0"""
+        V = np.array([[a.get(k, np.nan) for k in self.keys] for a in answers_list], dtype=np.float64)
+        bits = pack_rows(np.nan_to_num(V, nan=0.0) > 0.5, self.n_words)
+        classes = None
+        if self.lca_assets is not None:
+            S = np.array([[a.get(c, np.nan) for c in self.lca_assets['symptom_cols']] for a in answers_list],
+                         dtype=np.float64).reshape(len(answers_list), -1)
+            gamma = lca_posterior(np.nan_to_num(S, nan=0.0), self.lca_assets['pi'], self.lca_assets['theta'])
+            classes = gamma.argmax(axis=1)
+        return bits, classes
+
+    def _code(self, level):
+        code = self._level_code.get(level)
+        if code is None:
+            code = self._level_code[level] = len(self._levels)
+            self._levels.append(level)
+        return code
+
+    # ---------- 写入 ----------
+    def build(self, answers_list, risk_levels):
+        """批量写入 (启动时从数据库构建)"""
+        if not len(answers_list):
+            return
+        bits, classes = self.encode(answers_list)
+        with self._lock:
+            levels = np.array([self._code(level) for level in risk_levels], dtype=np.int16)
+            if classes is None:
+                self._bucket(None).extend(bits, levels)
+                return
+            for c in np.unique(classes):
+                rows = classes == c
+                self._bucket(int(c)).extend(bits[rows], levels[rows])
+
+    def add(self, answers, risk_level):
+        """保存一条新记录后调用"""
+        self.build([answers], [risk_level])
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.n_words)
+        return bucket
+
+    # ---------- 查询 ----------
+    def query(self, answers, k=20):
+        """返回最相似的 k 条既往记录：{"lca_class", "n_searched", "distances", "risk_levels", "distribution"}
+        distribution 为这 k 条记录的风险等级占比；分桶时只在同一 LCA 类别内检索。桶为空时返回 None"""
+        bits, classes = self.encode([answers])
+        key = None if classes is None else int(classes[0])
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or bucket.size == 0:
+                return None
+            # 数组只会追加 (扩容时换成新数组)，持锁取当前视图即可在锁外计算
+            index_bits, index_levels, n = bucket.bits[:bucket.size], bucket.levels[:bucket.size], bucket.size
+            levels = list(self._levels)
+
+        dist = popcount(index_bits ^ bits[0]).sum(axis=1, dtype=np.int32) if self.n_words > 1 \
+            else popcount(index_bits[:, 0] ^ bits[0, 0]).astype(np.int32)
+        k = min(k, n)
+        # 第 k 近的距离 d*：距离 < d* 的全部入选，= d* 的优先取较新的记录 (数组靠后)
+        cum = np.cumsum(np.bincount(dist, minlength=len(self.keys) + 1))
+        d_k = int(np.searchsorted(cum, k))
+        closer = np.flatnonzero(dist < d_k)
+        ties = np.flatnonzero(dist == d_k)[::-1][:k - len(closer)]
+        rows = np.concatenate([closer[np.argsort(dist[closer], kind="stable")], ties])
+
+        codes = index_levels[rows]
+        counts = np.bincount(codes, minlength=len(levels))
+        return {
+            "lca_class": key,
+            "n_searched": n,
+            "distances": dist[rows],
+            "risk_levels": [levels[c] for c in codes],
+            "distribution": {levels[c]: float(counts[c] / len(rows)) for c in np.flatnonzero(counts)},
+        }
+
+    def stats(self):
+        with self._lock:
+            return {("all" if key is None else f"class_{key}"): b.size for key, b in sorted(
+                self._buckets.items(), key=lambda kv: -1 if kv[0] is None else kv[0])}
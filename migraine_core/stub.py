@@ -0,0 +1,30 @@
+# migraine_core/stub.py
+# 作用：本地联调用的替身模型。使用真实的 LCA 参数与特征列，但 TabPFN 换成不依赖 torch 的简单模型，
+# 没有模型文件 / 没装 torch 的机器也能启动 api_server.py --stub 做接口测试。
+
+import joblib
+import numpy as np
+import questionnaire_schema as qs
+from migraine_core.assets import MODEL_DIR, ModelAssets
+from migraine_core.lca import latest_params_path
+
+
+class StubModel:
+    """TabPFN 的替身：输出特征均值 (有界、确定性，只用于联调)"""
+
+    def __init__(self, n_features):
+        self.n_features_in_ = n_features
+
+    def predict(self, X):
+        return np.asarray(X, dtype=np.float64).mean(axis=1)
+
+
+def stub_assets(model_dir=MODEL_DIR):
+    _, lca_path = latest_params_path(model_dir)
+    return ModelAssets(
+        joblib.load(lca_path),
+        StubModel(len(qs.LAYOUT_48H)),
+        StubModel(len(qs.LAYOUT_LONGTERM)),
+        qs.LAYOUT_48H.feat_cols,
+        qs.LAYOUT_LONGTERM.feat_cols,
+    )
@@ -0,0 +1,89 @@
+# migraine_core/submission.py
+# 作用：提交幂等。双击“生成分析报告”、浏览器重试、页面 rerun 都可能让同一份作答被提交多次；
+# 每次提交带一个由 (会话, 作答向量, ...) 算出的幂等键，同一个键在短时间内只真正执行一次：
+# 正在执行时后来者等待同一次执行的结果，执行完成后的有效期内直接返回缓存的结果。
+# 执行失败 (包括排队已满等) 不缓存，之后的重试会重新执行。
+
+import json
+import math
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def idempotency_key(session_id, answers, *extra):
+    """会话 + 作答字典 (+ 其它影响结果的字段，如是否有病史、性别) -> 幂等键。
+    作答按 key 排序；NaN 与缺失的题目视为相同"""
+    items = sorted((k, float(v)) for k, v in answers.items()
+                   if v is not None and not (isinstance(v, float) and math.isnan(v)))
+    payload = json.dumps([session_id, items, list(extra)], ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("done", "result", "error", "finished_at")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SubmissionRegistry:
+    """进程内的短期提交登记表；线程安全"""
+
+    def __init__(self, ttl=120.0, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._executed = 0
+        self._coalesced = 0
+
+    def run(self, key, fn):
+        """同一 key 只执行一次 fn()：执行中的后来者等待并拿到同一个结果 (或同一个异常)"""
+        with self._lock:
+            self._evict(time.monotonic())
+            entry = self._entries.get(key)
+            leader = entry is None
+            if leader:
+                entry = self._entries[key] = _Entry()
+                self._executed += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            entry.done.wait()
+            if entry.error is not None:
+                raise entry.error
+            return entry.result
+
+        try:
+            entry.result = fn()
+        except BaseException as e:
+            entry.error = e
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            raise
+        finally:
+            entry.finished_at = time.monotonic()
+            entry.done.set()
+        return entry.result
+
+    def _evict(self, now):
+        """删除过期的已完成条目；超出容量时从最早的已完成条目开始删 (执行中的条目不删)"""
+        for key in [k for k, e in self._entries.items()
+                    if e.finished_at is not None and now - e.finished_at > self.ttl]:
+            del self._entries[key]
+        if len(self._entries) > self.max_entries:
+            for key in [k for k, e in self._entries.items() if e.finished_at is not None]:
+                del self._entries[key]
+                if len(self._entries) <= self.max_entries:
+                    break
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "executed": self._executed, "coalesced": self._coalesced}
@@ -0,0 +1,128 @@
+# migraine_core/weights.py
+# 作用：TabPFN 底座权重去重。
+# 48h 模型和长期模型是分别 pickle 的两个 TabPFNRegressor，各自带着一份相同的预训练 transformer 权重。
+# 加载后逐个比较两边的 torch 参数 / buffer，完全相同的让第二个模型直接指向第一个模型的张量 (只读、共享存储)，
+# 各模型自己的上下文数据 (训练样本、预处理器) 不动。模型副本池复制副本时也复用同一份权重。
+# 没有 torch 模块的对象 (如替身模型) 上所有函数都是空操作。
+
+import os
+import sys
+import copy
+import ctypes
+
+
+def _torch():
+    return sys.modules.get("torch")
+
+
+def iter_modules(obj, max_depth=3):
+    """在估计器的属性图里找出所有 torch.nn.Module，返回 [(属性路径, 模块)]"""
+    torch = _torch()
+    if torch is None:
+        return []
+    found, seen = [], set()
+
+    def _walk(value, path, depth):
+        if id(value) in seen:
+            return
+        seen.add(id(value))
+        if isinstance(value, torch.nn.Module):
+            found.append((path, value))
+        elif isinstance(value, (list, tuple)):
+            for i, item in enumerate(value):
+                _walk(item, f"{path}[{i}]", depth)
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                _walk(item, f"{path}[{key!r}]", depth)
+        elif depth < max_depth and hasattr(value, "__dict__") and not isinstance(value, type):
+            for key, item in vars(value).items():
+                _walk(item, f"{path}.{key}" if path else key, depth + 1)
+
+    _walk(obj, "", 0)
+    return found
+
+
+def iter_tensors(obj):
+    """估计器里所有 torch 模块的参数与 buffer"""
+    for _, module in iter_modules(obj):
+        yield from module.parameters()
+        yield from module.buffers()
+
+
+def weight_bytes(*objs):
+    """这些对象的 torch 张量实际占用的字节数 (共享同一存储的只算一次)"""
+    storages = {}
+    for obj in objs:
+        for t in iter_tensors(obj):
+            storage = t.untyped_storage()
+            storages[storage.data_ptr()] = storage.nbytes()
+    return sum(storages.values())
+
+
+def _named_tensors(module):
+    return dict(module.named_parameters(), **dict(module.named_buffers()))
+
+
+def share_backbone_weights(primary, other):
+    """让 other 中与 primary 值完全相同的参数 / buffer 指向 primary 的张量；返回统计信息"""
+    torch = _torch()
+    report = {"modules_shared": 0, "tensors_shared": 0,
+              "bytes_before": weight_bytes(primary, other), "bytes_after": None}
+    if torch is None:
+        report["bytes_after"] = report["bytes_before"]
+        return report
+
+    sources = [_named_tensors(m) for _, m in iter_modules(primary)]
+    with torch.no_grad():
+        for _, module in iter_modules(other):
+            n_shared = 0
+            for k, t in _named_tensors(module).items():
+                # 按参数名逐个比较：输入层宽度不同、或微调过的层 (形状 / 值不同) 保持独立，其余照样共享
+                for src in sources:
+                    s = src.get(k)
+                    if (s is not None and s.shape == t.shape and s.dtype == t.dtype
+                            and s.data_ptr() != t.data_ptr() and torch.equal(s, t)):
+                        t.data = s.data
+                        n_shared += 1
+                        break
+            report["tensors_shared"] += n_shared
+            report["modules_shared"] += n_shared > 0
+
+    # 推理专用：权重一律只读，避免任何一方意外原地修改共享张量
+    for t in iter_tensors(primary):
+        t.requires_grad_(False)
+    for t in iter_tensors(other):
+        t.requires_grad_(False)
+    report["bytes_after"] = weight_bytes(primary, other)
+    release_free_memory()
+    return report
+
+
+def clone_sharing_weights(obj):
+    """深拷贝估计器，但 torch 参数 / buffer 复用原对象的张量 (副本池用)"""
+    memo = {}
+    for t in iter_tensors(obj):
+        memo[id(t)] = t
+    return copy.deepcopy(obj, memo)
+
+
+def release_free_memory():
+    """把已释放的堆内存还给操作系统 (glibc 默认不会立即归还，RSS 看不到下降)；其它平台为空操作"""
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def rss_bytes():
+    """当前进程常驻内存 (Linux 读 /proc，其它平台返回 None)"""
+    try:
+        with open(f"/proc/{os.getpid()}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
@@ -0,0 +1,29 @@
+# migraine_core/worker.py
+# 作用：进程池 worker 的预测器初始化。
+# 父进程先调用 preload_for_workers() 把模型加载到本进程，再以 fork 方式创建进程池，
+# 子进程直接继承已加载的预测器 (写时复制，不重复读盘/反序列化)；
+# spawn 方式 (Windows / macOS 默认) 下每个 worker 在 init_worker 里各自加载一次。
+
+from migraine_core.assets import MODEL_DIR
+from migraine_core.predictor import MigrainePredictor
+
+_worker_predictor = None
+
+
+def preload_for_workers(model_dir=MODEL_DIR, warmup=True):
+    """在父进程中加载预测器，供之后 fork 出的 worker 继承"""
+    global _worker_predictor
+    if _worker_predictor is None:
+        _worker_predictor = MigrainePredictor.from_model_dir(model_dir, warmup=warmup)
+    return _worker_predictor
+
+
+def init_worker(model_dir=MODEL_DIR, warmup=False):
+    """ProcessPoolExecutor(initializer=init_worker, initargs=(model_dir,))：继承不到时才自行加载"""
+    preload_for_workers(model_dir, warmup=warmup)
+
+
+def get_worker_predictor():
+    if _worker_predictor is None:
+        raise RuntimeError("worker 预测器未初始化：请把 init_worker 作为进程池的 initializer")
+    return _worker_predictor
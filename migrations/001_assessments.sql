@@ -0,0 +1,35 @@
+-- migrations/001_assessments.sql
+-- 作用：评估记录改为只追加 (每次提交一行)，保留同一手机号的完整时间序列。
+-- 在 Supabase 控制台的 SQL Editor 中执行一次；可重复执行。
+-- 原 patient_records 表 (按 phone upsert，只保留最新一次) 保留不动，其语义由 latest_assessments 视图提供。
+
+create table if not exists assessments (
+    id           bigint generated always as identity primary key,
+    phone        text not null,
+    patient_name text,
+    age          integer,
+    gender       text,
+    history      boolean,
+    input_data   jsonb,
+    risk_score   double precision,
+    risk_level   text,
+    created_at   timestamptz not null default now()
+);
+
+-- 按手机号 + 时间的范围查询 / 分页 (结果页趋势图)
+create index if not exists assessments_phone_created_at_idx on assessments (phone, created_at desc);
+-- 按时间范围读取 (iter_records 的 until 上限、导出)；增量流式读取按主键 id 续读
+create index if not exists assessments_created_at_idx on assessments (created_at);
+
+-- 每个手机号最新一次评估 (等价于原 patient_records 的内容)
+create or replace view latest_assessments as
+select distinct on (phone) *
+from assessments
+order by phone, created_at desc;
+
+-- 把 patient_records 中已有的数据回填进来 (只在 assessments 为空时执行)
+insert into assessments (phone, patient_name, age, gender, history, input_data, risk_score, risk_level, created_at)
+select phone, patient_name, age, gender, history, input_data, risk_score, risk_level,
+       coalesce(created_at::timestamptz, now())
+from patient_records
+where not exists (select 1 from assessments);
@@ -0,0 +1,9 @@
+-- migrations/002_assessment_client_id.sql
+-- 作用：给每条评估记录一个客户端生成的唯一 ID。保存超时 / 熔断时记录先写入本地队列 (spool/)，
+-- 恢复后按批补写；补写用 upsert ... on conflict (client_id) do nothing，同一条记录不会写入两次
+-- (包括“请求其实已经成功、只是响应超时”的情况)。
+-- 在 001_assessments.sql 之后执行一次；可重复执行。已有记录的 client_id 为 null，不受唯一约束影响。
+
+alter table assessments add column if not exists client_id text;
+
+create unique index if not exists assessments_client_id_idx on assessments (client_id);
@@ -0,0 +1,13 @@
+-- migrations/003_profile_answered_at.sql
+-- 作用：记录长期画像实际填写的时间。老用户选择“沿用上次的长期画像”时，新记录带上原画像的填写时间，
+-- 而不是本次提交时间；get_latest_profile 按它判断画像是否还在有效期内，沿用不会无限续期。
+-- 在 002_assessment_client_id.sql 之后执行一次；可重复执行。
+
+alter table assessments add column if not exists profile_answered_at timestamptz;
+
+-- 已有的有病史记录都是当次填写的长期画像
+update assessments set profile_answered_at = created_at
+where history and profile_answered_at is null;
+
+-- 按手机号 + 姓名查近期长期画像
+create index if not exists assessments_phone_profile_idx on assessments (phone, profile_answered_at desc);
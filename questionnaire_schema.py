@@ -0,0 +1,133 @@
+# questionnaire_schema.py
+# 作用：把 content_library 里的问卷映射 (section_* 标题键与题目键混在一个 dict 里) 在 import 时编译一次，
+# 供 app.py (渲染问卷、分组建议) 和 logic_processor (按 feat_cols_* 顺序拼特征向量) 共用，
+# 页面每次 rerun 不再重复遍历映射、做字符串匹配。
+
+import os
+import json
+from collections import namedtuple
+import numpy as np
+import content_library as lib
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "models")
+
+# 女性专属题目 (男性自动隐藏)：月经 / 排卵相关
+FEMALE_ONLY_MARKERS = ("月经", "排卵")
+GENDERS = ("女", "男")
+
+Question = namedtuple("Question", ["key", "text", "section", "label_html", "female_only"])
+Section = namedtuple("Section", ["key", "title", "questions"])
+
+
+def _is_female_only(key):
+    return any(m in key for m in FEMALE_ONLY_MARKERS)
+
+
+class QuestionnaireSchema:
+    """一份问卷 (长期画像 / 48h) 的编译结果"""
+
+    def __init__(self, mapping):
+        sections = []
+        current = None
+        for key, text in mapping.items():
+            if key.startswith("section"):
+                current = (key, text, [])
+                sections.append(current)
+            else:
+                label_html = f'<p style="font-size: 1.2rem; font-weight: 600; margin-bottom: 8px;">{text}</p>'
+                current[2].append(Question(key, text, current[1], label_html, _is_female_only(key)))
+
+        self.sections = tuple(Section(k, t, tuple(qs)) for k, t, qs in sections)
+        self.questions = tuple(q for s in self.sections for q in s.questions)
+        self.keys = tuple(q.key for q in self.questions)
+        self.by_key = {q.key: q for q in self.questions}
+        self.section_of = {q.key: q.section for q in self.questions}
+        self.evidence = {q.key: lib.EVIDENCE_LIBRARY[q.key] for q in self.questions if q.key in lib.EVIDENCE_LIBRARY}
+
+        # 按性别预先过滤好的可见题目 (整节都是女性专属题时，整节隐藏)
+        self._visible = {}
+        for gender in GENDERS:
+            visible = []
+            for s in self.sections:
+                qs = tuple(q for q in s.questions if not (gender == "男" and q.female_only))
+                if qs:
+                    visible.append(Section(s.key, s.title, qs))
+            self._visible[gender] = tuple(visible)
+
+    def visible_sections(self, gender):
+        return self._visible.get(gender, self.sections)
+
+    def visible_keys(self, gender):
+        return [q.key for s in self.visible_sections(gender) for q in s.questions]
+
+
+class FeatureLayout:
+    """一个 TabPFN 模型的特征列布局 (与 models/feat_cols_*.json 的顺序严格对齐)"""
+
+    def __init__(self, feat_cols):
+        self.feat_cols = list(feat_cols)
+        self.index = {c: i for i, c in enumerate(self.feat_cols)}
+
+        self.lca_prob_idx = {}
+        self.lca_onehot_idx = {}
+        mask_cols = []
+        value_cols = []
+        for c in self.feat_cols:
+            if c.startswith("LCA_class_prob_"):
+                self.lca_prob_idx[int(c.rsplit("_", 1)[1])] = self.index[c]
+            elif c.startswith("LCA_class_"):
+                self.lca_onehot_idx[int(c.rsplit("_", 1)[1])] = self.index[c]
+            elif c.endswith("_missingmask"):
+                mask_cols.append(c)
+            else:
+                value_cols.append(c)
+
+        # 作答类特征 (题目 key) 以及它们的 missing mask 位置
+        self.value_cols = value_cols
+        self.value_idx = np.array([self.index[c] for c in value_cols], dtype=np.intp)
+        value_pos = {c: i for i, c in enumerate(value_cols)}
+        pairs = [(value_pos[c[:-len("_missingmask")]], self.index[c])
+                 for c in mask_cols if c[:-len("_missingmask")] in value_pos]
+        self.mask_src_pos = np.array([p[0] for p in pairs], dtype=np.intp)
+        self.mask_idx = np.array([p[1] for p in pairs], dtype=np.intp)
+
+    def __len__(self):
+        return len(self.feat_cols)
+
+    def encode(self, data):
+        """作答字典 -> 特征向量 (缺失补 0，并写入 missing mask；LCA 列留给预测器填写)"""
+        vals = np.array([data.get(c, np.nan) for c in self.value_cols], dtype=np.float64)
+        missing = np.isnan(vals)
+        x = np.zeros(len(self.feat_cols), dtype=np.float64)
+        x[self.value_idx] = np.where(missing, 0.0, vals)
+        x[self.mask_idx] = missing[self.mask_src_pos]
+        return x
+
+    def encode_frame(self, df):
+        """encode 的批量版：DataFrame (列为题目 key) -> N×F 特征矩阵"""
+        vals = df.reindex(columns=self.value_cols).to_numpy(dtype=np.float64)
+        missing = np.isnan(vals)
+        X = np.zeros((len(vals), len(self.feat_cols)), dtype=np.float64)
+        X[:, self.value_idx] = np.where(missing, 0.0, vals)
+        X[:, self.mask_idx] = missing[:, self.mask_src_pos]
+        return X
+
+
+def _load_feat_cols(name):
+    path = os.path.join(MODEL_DIR, name)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ================= import 时编译一次 =================
+SCHEMA_LONGTERM = QuestionnaireSchema(lib.MAPPING_LONGTERM)
+SCHEMA_48H = QuestionnaireSchema(lib.MAPPING_48H)
+
+# 所有题目 -> 所属章节标题 (48h 与长期合并，用于结果页按章节分组建议)
+SECTION_OF = {**SCHEMA_48H.section_of, **SCHEMA_LONGTERM.section_of}
+EVIDENCE = {**SCHEMA_LONGTERM.evidence, **SCHEMA_48H.evidence}
+
+LAYOUT_48H = FeatureLayout(_load_feat_cols("feat_cols_48h.json"))
+LAYOUT_LONGTERM = FeatureLayout(_load_feat_cols("feat_cols_longterm.json"))
@@ -0,0 +1,310 @@
+# score_batch.py
+# 作用：批量给合作医院导出的问卷文件打分 (不经过网页)
+# 运行方式：
+#   python score_batch.py 输入.xlsx -o 结果.csv [--sheet Sheet1] [--chunk-size 1000] [--jobs 4]
+#
+# 输入：CSV / Parquet / XLSX，每行一份问卷。题目列既可以用 content_library 的 key 命名，
+#      也可以直接用题目原文；作答可以是 是/否、"从不/偶尔/经常/非常频繁/每次" 或 0~1 的数值。
+#      可选列：gender/性别 (男/女)、history/既往病史 (是否有长期病史，决定使用哪个模型)。
+# 输出：原有的非题目列 + n_answered_48h, fraud, fraud_reason, fraud_flags, raw_score, ppc, level, lca_class
+#      (.csv / .parquet 流式写出；.xlsx 在结束时一次写出)
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import content_library as lib
+import questionnaire_schema as qs
+import migraine_core as core
+from migraine_core import worker
+
+DEFAULT_CHUNK_ROWS = 1000
+MIN_ANSWERED_48H = 20  # 与网页端“至少完成 20 项评估”一致
+
+GENDER_COLS = ("gender", "性别")
+HISTORY_COLS = ("history", "既往病史", "has_history")
+TRUTHY = {"1", "1.0", "true", "yes", "y", "是", "有", "确诊偏头痛 / 有长期病史"}
+
+# 文字作答 -> 数值 (48h 为 是/否，长期画像为频率档位)
+ANSWER_VALUES = {"是": 1.0, "否": 0.0, **lib.FREQ_MAP_VAL}
+
+OUTPUT_COLS = ["n_answered_48h", "fraud", "fraud_reason", "fraud_flags", "raw_score", "ppc", "level", "lca_class"]
+
+
+# ================= 读取：按块流式读取 =================
+def _iter_xlsx(path, sheet, chunk_rows):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = (wb[sheet] if sheet else wb.worksheets[0]).iter_rows(values_only=True)
+        columns = [str(c).strip() if c is not None else f"col_{i}" for i, c in enumerate(next(rows))]
+        buf = []
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            buf.append(tuple(row[:len(columns)]) + (None,) * (len(columns) - len(row)))
+            if len(buf) >= chunk_rows:
+                yield pd.DataFrame(buf, columns=columns)
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=columns)
+    finally:
+        wb.close()
+
+
+def iter_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS, sheet=None):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        # 全部按文本读入：透传列原样保留 (不同块不会被推断成不同类型)，作答列由 _to_numeric 统一转换
+        yield from pd.read_csv(path, chunksize=chunk_rows, encoding="utf-8-sig", dtype=str)
+    elif ext == ".parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    elif ext in (".xlsx", ".xlsm"):
+        yield from _iter_xlsx(path, sheet, chunk_rows)
+    else:
+        raise ValueError(f"不支持的输入格式: {ext} (支持 .csv / .parquet / .xlsx)")
+
+
+# ================= 列映射与作答规范化 =================
+def build_column_map(columns):
+    """表头 -> 题目 key：先按 key 精确匹配，再按题目原文匹配 (忽略首尾空白)"""
+    by_text = {q.text.strip(): q.key for schema in (qs.SCHEMA_48H, qs.SCHEMA_LONGTERM) for q in schema.questions}
+    keys = set(qs.SCHEMA_48H.keys) | set(qs.SCHEMA_LONGTERM.keys)
+    col_map = {}
+    for c in columns:
+        name = str(c).strip()
+        key = name if name in keys else by_text.get(name)
+        if key is not None and key not in col_map.values():
+            col_map[c] = key
+    return col_map
+
+
+def _to_numeric(s):
+    if s.dtype.kind in "biuf":
+        return s.astype(np.float64)
+    text = s.astype("string").str.strip()
+    mapped = pd.to_numeric(text.map(ANSWER_VALUES), errors="coerce")
+    return mapped.fillna(pd.to_numeric(text, errors="coerce")).astype(np.float64)
+
+
+def _first_present(df, names):
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    return None
+
+
+def prepare_chunk(df, col_map):
+    """原始块 -> (作答 DataFrame (列为题目 key), has_history 数组, 性别数组, 透传列 DataFrame)"""
+    answers = pd.DataFrame({key: _to_numeric(df[c]) for c, key in col_map.items()}, index=df.index)
+
+    history = _first_present(df, HISTORY_COLS)
+    if history is not None:
+        has_history = history.astype("string").str.strip().str.lower().isin(TRUTHY).to_numpy()
+    else:
+        # 没有病史列时：填写过长期画像题目的视为有病史
+        lt_cols = [k for k in qs.SCHEMA_LONGTERM.keys if k in answers.columns]
+        has_history = answers[lt_cols].notna().any(axis=1).to_numpy() if lt_cols else np.zeros(len(df), bool)
+
+    gender = _first_present(df, GENDER_COLS)
+    gender = gender.astype("string").str.strip().fillna("女").to_numpy() if gender is not None \
+        else np.full(len(df), "女", dtype=object)
+
+    passthrough = df[[c for c in df.columns if c not in col_map]]
+    return answers, has_history, gender, passthrough
+
+
+# ================= 打分 (在 worker 进程中执行) =================
+def score_chunk(df, col_map, score_flagged=False):
+    answers, has_history, gender, out = prepare_chunk(df, col_map)
+    out = out.reset_index(drop=True).copy()
+    answers = answers.reset_index(drop=True)
+
+    # 反作弊：与网页端同一套规则 (只看 48h 作答)；近似重复在本 worker 处理过的行之间比较
+    predictor = worker.get_worker_predictor()
+    engine = predictor.fraud_engine
+    V = answers.reindex(columns=engine.keys).to_numpy(dtype=np.float64)
+    n_answered = (~np.isnan(V) & ~((gender == "男")[:, None] & engine.female_only[None, :])).sum(axis=1)
+    fraud = engine.check_matrix(V, gender, remember=True)
+    is_fraud, reasons = fraud.is_fraud, fraud.reasons
+    too_few = n_answered < MIN_ANSWERED_48H
+    reasons = [f"信息量不足 (48h 作答 {n} 项，少于 {MIN_ANSWERED_48H} 项)" if few and not fraud else r
+               for r, n, few, fraud in zip(reasons, n_answered, too_few, is_fraud)]
+    flagged = is_fraud | too_few
+
+    out["n_answered_48h"] = n_answered
+    out["fraud"] = is_fraud
+    out["fraud_reason"] = pd.array(reasons, dtype="string")
+    out["fraud_flags"] = pd.array([",".join(r for r, hit in fraud.flags.items() if hit[i]) or None
+                                   for i in range(len(out))], dtype="string")
+    out["raw_score"] = np.nan
+    out["ppc"] = np.nan
+    out["level"] = pd.array([None] * len(out), dtype="string")
+    out["lca_class"] = pd.array([pd.NA] * len(out), dtype="Int64")
+
+    rows = np.arange(len(out)) if score_flagged else np.flatnonzero(~flagged)
+    if len(rows):
+        res = predictor.predict_batch(answers.iloc[rows], has_history[rows])
+        ppc = core.stretch_probs(res["raw_score"])
+        out.loc[rows, "raw_score"] = res["raw_score"]
+        out.loc[rows, "ppc"] = ppc
+        out.loc[rows, "level"] = [core.concordance_level(p)[0] for p in ppc]
+        out.loc[rows, "lca_class"] = res["lca_class"]
+    return out
+
+
+# ================= 写出 =================
+def parquet_schema(input_path, passthrough_cols):
+    """Parquet 输出的固定 schema (在写第一块之前确定，后续块按它转换)：
+    打分列类型固定；透传列在 Parquet 输入时沿用输入文件的类型，CSV / XLSX 输入时一律按字符串写
+    (pandas 按块推断类型，如 age 一块是 int、一块是 float，或首块整列为空)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    src = pq.ParquetFile(input_path).schema_arrow if input_path.lower().endswith(".parquet") else None
+    fields = [src.field(str(c)) if src is not None else pa.field(str(c), pa.string()) for c in passthrough_cols]
+    fields += [pa.field("n_answered_48h", pa.int64()), pa.field("fraud", pa.bool_()),
+               pa.field("fraud_reason", pa.string()), pa.field("fraud_flags", pa.string()),
+               pa.field("raw_score", pa.float64()), pa.field("ppc", pa.float64()),
+               pa.field("level", pa.string()), pa.field("lca_class", pa.int64())]
+    return pa.schema(fields)
+
+
+class ChunkWriter:
+    def __init__(self, path, schema=None):
+        self.path = path
+        root, ext = os.path.splitext(path)
+        self.ext = ext.lower()
+        if self.ext not in (".csv", ".parquet", ".xlsx"):
+            raise ValueError(f"不支持的输出格式: {self.ext} (支持 .csv / .parquet / .xlsx)")
+        self._tmp = root + ".tmp" + ext  # 保留扩展名，写 xlsx 时 pandas 按扩展名选引擎
+        self._first = True
+        self._pq_writer = None
+        self._schema = schema  # 仅 Parquet 输出使用，见 parquet_schema
+        self._frames = []
+
+    def write(self, df):
+        if self.ext == ".csv":
+            df.to_csv(self._tmp, mode="w" if self._first else "a", header=self._first,
+                      index=False, encoding="utf-8-sig" if self._first else "utf-8")
+        elif self.ext == ".parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if self._pq_writer is None:
+                self._pq_writer = pq.ParquetWriter(self._tmp, self._schema)
+            df = df.astype({f.name: "string" for f in self._schema if pa.types.is_string(f.type)})
+            self._pq_writer.write_table(pa.Table.from_pandas(df, schema=self._schema, preserve_index=False))
+        else:
+            self._frames.append(df)
+        self._first = False
+
+    def close(self):
+        if self._pq_writer is not None:
+            self._pq_writer.close()
+        if self.ext == ".xlsx":
+            frames = self._frames or [pd.DataFrame(columns=OUTPUT_COLS)]
+            pd.concat(frames, ignore_index=True).to_excel(self._tmp, index=False, engine="openpyxl")
+        if os.path.exists(self._tmp):
+            os.replace(self._tmp, self.path)
+
+
+# ================= 主流程 =================
+def _make_executor(jobs, model_dir):
+    if jobs <= 1:
+        return None
+    if "fork" in mp.get_all_start_methods():
+        # 父进程已加载好模型，fork 出的 worker 直接继承，不再各自读盘
+        return ProcessPoolExecutor(jobs, mp_context=mp.get_context("fork"))
+    return ProcessPoolExecutor(jobs, initializer=worker.init_worker, initargs=(model_dir,))
+
+
+def run(input_path, output_path, chunk_rows=DEFAULT_CHUNK_ROWS, jobs=None, sheet=None,
+        score_flagged=False, model_dir=core.MODEL_DIR):
+    jobs = jobs or os.cpu_count() or 1
+    print(f"1. 加载模型 ({model_dir})...")
+    worker.preload_for_workers(model_dir)
+
+    chunks = iter_chunks(input_path, chunk_rows, sheet)
+    first = next(chunks, None)
+    if first is None:
+        print("⚠️ 输入文件没有数据行")
+        return 0
+    col_map = build_column_map(first.columns)
+    print(f"2. 识别到 {len(col_map)} 个题目列；未识别的 {len(first.columns) - len(col_map)} 列将原样透传")
+    if not col_map:
+        raise ValueError("没有识别到任何题目列：请使用 content_library 中的题目 key 或题目原文作为表头")
+
+    def _all_chunks():
+        yield first
+        yield from chunks
+
+    print(f"3. 开始打分 (每块 {chunk_rows} 行，{jobs} 个进程)...")
+    passthrough = [c for c in first.columns if c not in col_map]
+    writer = ChunkWriter(output_path, parquet_schema(input_path, passthrough)
+                         if output_path.lower().endswith(".parquet") else None)
+    executor = _make_executor(jobs, model_dir)
+    n_rows = n_flagged = 0
+    t0 = time.perf_counter()
+
+    def _collect(out):
+        nonlocal n_rows, n_flagged
+        writer.write(out)
+        n_rows += len(out)
+        n_flagged += int(out["raw_score"].isna().sum())
+        elapsed = time.perf_counter() - t0
+        print(f"   已处理 {n_rows} 行，拦截 {n_flagged} 行，{n_rows / max(elapsed, 1e-9):.1f} 行/s")
+
+    try:
+        if executor is None:
+            for df in _all_chunks():
+                _collect(score_chunk(df, col_map, score_flagged))
+        else:
+            # 最多同时排队 2×jobs 个块，按输入顺序写出，内存占用与文件大小无关
+            pending = deque()
+            for df in _all_chunks():
+                pending.append(executor.submit(score_chunk, df, col_map, score_flagged))
+                if len(pending) >= 2 * jobs:
+                    _collect(pending.popleft().result())
+            while pending:
+                _collect(pending.popleft().result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        writer.close()
+
+    elapsed = time.perf_counter() - t0
+    print(f"✅ 完成：{n_rows} 行，耗时 {elapsed:.1f}s ({n_rows / max(elapsed, 1e-9):.1f} 行/s)，结果已写入 {output_path}")
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量给问卷文件打分 (CSV / Parquet / XLSX)")
+    parser.add_argument("input", help="输入文件")
+    parser.add_argument("-o", "--output", help="输出文件 (.csv / .parquet / .xlsx)，默认 <输入>_scored.csv")
+    parser.add_argument("--sheet", help="XLSX 工作表名，默认第一个")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_ROWS, help="每块行数")
+    parser.add_argument("--jobs", type=int, default=None, help="进程数，默认全部 CPU 核心；1 表示单进程")
+    parser.add_argument("--score-flagged", action="store_true", help="被反作弊拦截的行也照常打分")
+    parser.add_argument("--model-dir", default=core.MODEL_DIR, help="模型目录")
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.input)[0] + "_scored.csv"
+    try:
+        run(args.input, output, args.chunk_size, args.jobs, args.sheet, args.score_flagged, args.model_dir)
+    except (ValueError, FileNotFoundError, RuntimeError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()